@@ -1,36 +1,34 @@
 from django.conf import settings
-from django.db import connection
-from django.utils.timezone import now
 from django.utils.deprecation import MiddlewareMixin
 
 from utils.api import JSONResponse
 from account.models import User
+from account.utils import get_appkey_user, invalidate_appkey, record_session_activity
 
 
 class APITokenAuthMiddleware(MiddlewareMixin):
     def process_request(self, request):
         appkey = request.META.get("HTTP_APPKEY")
         if appkey:
+            entry = get_appkey_user(appkey)
+            if not entry or entry["is_disabled"]:
+                return
             try:
-                request.user = User.objects.get(open_api_appkey=appkey, open_api=True, is_disabled=False)
+                # 按主键读取用户, 缓存过时的时候这里的条件也能保证 appkey 仍然有效
+                request.user = User.objects.get(id=entry["id"], open_api_appkey=appkey, open_api=True,
+                                                is_disabled=False)
                 request.csrf_processing_done = True
                 request.auth_method = "api_key"
             except User.DoesNotExist:
-                pass
+                invalidate_appkey(appkey)
 
 
 class SessionRecordMiddleware(MiddlewareMixin):
     def process_request(self, request):
         request.ip = request.META.get(settings.IP_HEADER, request.META.get("REMOTE_ADDR"))
-        if request.user.is_authenticated:
-            session = request.session
-            session["user_agent"] = request.META.get("HTTP_USER_AGENT", "")
-            session["ip"] = request.ip
-            session["last_activity"] = now()
-            user_sessions = request.user.session_keys
-            if session.session_key not in user_sessions:
-                user_sessions.append(session.session_key)
-                request.user.save()
+        # 使用 appkey 的请求没有会话
+        if request.user.is_authenticated and getattr(request, "auth_method", "") != "api_key":
+            record_session_activity(request)
 
 
 class AdminRoleRequiredMiddleware(MiddlewareMixin):
@@ -39,15 +37,3 @@ class AdminRoleRequiredMiddleware(MiddlewareMixin):
         if path.startswith("/admin/") or path.startswith("/api/admin/"):
             if not (request.user.is_authenticated and request.user.is_admin_role()):
                 return JSONResponse.response({"error": "login-required", "data": "Please login in first"})
-
-
-class LogSqlMiddleware(MiddlewareMixin):
-    def process_response(self, request, response):
-        print("\033[94m", "#" * 30, "\033[0m")
-        time_threshold = 0.03
-        for query in connection.queries:
-            if float(query["time"]) > time_threshold:
-                print("\033[93m", query, "\n", "-" * 30, "\033[0m")
-            else:
-                print(query, "\n", "-" * 30)
-        return response
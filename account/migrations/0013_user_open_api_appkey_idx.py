@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-19 05:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0012_userprofile_language'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('open_api_appkey__isnull', False)), fields=['open_api_appkey'], name='user_open_api_appkey_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-19 05:27
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0013_user_open_api_appkey_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='user',
+            name='session_keys',
+        ),
+    ]
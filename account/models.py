@@ -36,7 +36,6 @@ class User(AbstractBaseUser):
     auth_token = models.TextField(null=True)
     two_factor_auth = models.BooleanField(default=False)
     tfa_token = models.TextField(null=True)
-    session_keys = JSONField(default=list)
     # open api key
     open_api = models.BooleanField(default=False)
     open_api_appkey = models.TextField(null=True)
@@ -64,6 +63,11 @@ class User(AbstractBaseUser):
 
     class Meta:
         db_table = "user"
+        indexes = [
+            # APITokenAuthMiddleware 按 appkey 查找用户, 大部分用户没有 appkey
+            models.Index(fields=["open_api_appkey"], name="user_open_api_appkey_idx",
+                         condition=models.Q(open_api_appkey__isnull=False)),
+        ]
 
 
 class UserProfile(models.Model):
@@ -4,16 +4,21 @@ from unittest import mock
 from datetime import timedelta
 from copy import deepcopy
 
+from django.conf import settings
 from django.contrib import auth
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now
 from otpauth import OtpAuth
 
+from utils import throttling
 from utils.api.tests import APIClient, APITestCase
+from utils.cache import cache
 from utils.shortcuts import rand_str
 from options.options import SysOptions
 
 from .models import AdminType, ProblemPermission, User
-from utils.constants import ContestRuleType
+from utils.constants import CacheKey, ContestRuleType
 
 
 class PermissionDecoratorTest(APITestCase):
@@ -160,6 +165,54 @@ class UserLoginAPITest(APITestCase):
         self.assertDictEqual(resp.data, {"error": "error", "data": "Your account has been disabled"})
 
 
+class RateLimitTest(APITestCase):
+    def setUp(self):
+        self.login_url = self.reverse("user_login_api")
+        cache.delete_pattern(f"{CacheKey.throttling}:*")
+        throttling._blocked.clear()
+
+    def login(self, username="test"):
+        return self.client.post(self.login_url, data={"username": username, "password": "test"})
+
+    @mock.patch("utils.throttling._get_policy",
+                return_value={"algorithm": "sliding_window", "limit": 2, "window": 60})
+    def test_sliding_window(self, _):
+        self.assertEqual(self.login().data["data"], "Invalid username or password")
+        self.assertEqual(self.login().data["data"], "Invalid username or password")
+        resp = self.login()
+        self.assertFailed(resp, "Too many requests, please wait 60 seconds")
+        self.assertEqual(resp["Retry-After"], "60")
+
+        # 被限制期间直接在进程内拒绝, 不再访问 redis
+        with mock.patch("utils.throttling._get_limiter") as get_limiter:
+            self.assertFailed(self.login())
+            get_limiter.assert_not_called()
+
+    @mock.patch("utils.throttling._get_policy",
+                side_effect=lambda name: {"algorithm": "sliding_window", "window": 60,
+                                          "limit": {"login": 2, "login_ip": 4}[name]})
+    def test_login_by_account(self, _):
+        # 同一个 IP 后面的其他用户不受影响, 直到超过更宽松的 IP 限制
+        self.assertEqual(self.login().data["data"], "Invalid username or password")
+        self.assertEqual(self.login("TEST").data["data"], "Invalid username or password")
+        self.assertFailed(self.login(), "Too many requests, please wait 60 seconds")
+        self.assertEqual(self.login("other").data["data"], "Invalid username or password")
+        self.assertFailed(self.login("another"), "Too many requests, please wait 60 seconds")
+
+    @mock.patch("utils.throttling._get_policy",
+                return_value={"capacity": 1, "fill_rate": 0.5, "default_capacity": 1})
+    def test_token_bucket(self, _):
+        url = self.reverse("show_captcha")
+        self.assertSuccess(self.client.get(url))
+        resp = self.client.get(url)
+        self.assertFailed(resp, "Too many requests, please wait 2 seconds")
+        self.assertEqual(resp["Retry-After"], "2")
+
+    def test_redis_unavailable(self):
+        with mock.patch("utils.throttling.SlidingWindow.consume", side_effect=ConnectionError()):
+            self.assertEqual(self.login().data["data"], "Invalid username or password")
+
+
 class CaptchaTest(APITestCase):
     def _set_captcha(self, session):
         captcha = rand_str(4)
@@ -216,8 +269,9 @@ class UserRegisterAPITest(CaptchaTest):
 
 class SessionManagementAPITest(APITestCase):
     def setUp(self):
-        self.create_user("test", "test123")
+        user = self.create_user("test", "test123")
         self.url = self.reverse("session_management_api")
+        cache.delete(f"{CacheKey.user_sessions}:{user.id}")
         # launch a request to provide session data
         login_url = self.reverse("user_login_api")
         self.client.post(login_url, data={"username": "test", "password": "test123"})
@@ -228,9 +282,31 @@ class SessionManagementAPITest(APITestCase):
         data = resp.data["data"]
         self.assertEqual(len(data), 1)
 
-    # def test_delete_session_key(self):
-    #     resp = self.client.delete(self.url + "?session_key=" + self.session_key)
-    #     self.assertSuccess(resp)
+    def test_delete_session_key(self):
+        other = APIClient()
+        other.login(username="test", password="test123")
+        other.get(self.url)
+        session_key = other.session.session_key
+        self.assertEqual(len(self.client.get(self.url).data["data"]), 2)
+
+        resp = self.client.delete(self.url + "?session_key=" + session_key)
+        self.assertSuccess(resp)
+        data = self.client.get(self.url).data["data"]
+        self.assertEqual(len(data), 1)
+        self.assertTrue(data[0]["current_session"])
+        self.assertIsNone(other.get(self.reverse("user_profile_api")).data["data"])
+
+    def test_activity_write_coalescing(self):
+        self.client.get(self.url)
+        session_key = self.client.session.session_key
+        with mock.patch("account.utils.cache.pipeline") as pipeline:
+            self.client.get(self.url)
+            pipeline.assert_not_called()
+            # IP 变化时立即记录
+            self.client.get(self.url, **{settings.IP_HEADER: "1.2.3.4"})
+            pipeline.assert_called_once()
+            pipeline.return_value.hset.assert_called_once()
+            self.assertEqual(pipeline.return_value.hset.call_args[0][1], session_key)
 
     def test_delete_session_with_invalid_key(self):
         resp = self.client.delete(self.url + "?session_key=aaaaaaaaaa")
@@ -644,3 +720,28 @@ class OpenAPIAppkeyAPITest(APITestCase):
         resp = self.client.post(self.url, data={})
         self.assertSuccess(resp)
         self.assertEqual(resp.data["data"]["appkey"], User.objects.get(username=self.user.username).open_api_appkey)
+
+    def test_appkey_auth(self):
+        self.user.open_api = True
+        self.user.save()
+        appkey = self.client.post(self.url, data={}).data["data"]["appkey"]
+        client = APIClient()
+        profile_url = self.reverse("user_profile_api")
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = client.get(profile_url, HTTP_APPKEY=appkey)
+        self.assertEqual(resp.data["data"]["user"]["username"], self.user.username)
+        # 第二次请求不再按 appkey 查找用户
+        with CaptureQueriesContext(connection) as ctx:
+            client.get(profile_url, HTTP_APPKEY=appkey)
+        self.assertFalse(any('"open_api_appkey" = ' in item["sql"] and '"id" = ' not in item["sql"]
+                             for item in ctx.captured_queries))
+
+        # 更换 appkey 之后旧的立即失效
+        new_appkey = self.client.post(self.url, data={}).data["data"]["appkey"]
+        self.assertIsNone(client.get(profile_url, HTTP_APPKEY=appkey).data["data"])
+        self.assertEqual(client.get(profile_url, HTTP_APPKEY=new_appkey).data["data"]["user"]["username"],
+                         self.user.username)
+
+        User.objects.filter(id=self.user.id).update(is_disabled=True)
+        self.assertIsNone(client.get(profile_url, HTTP_APPKEY=new_appkey).data["data"])
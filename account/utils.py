@@ -0,0 +1,124 @@
+import hashlib
+import json
+import time
+from datetime import datetime, timezone
+from importlib import import_module
+
+from django.conf import settings
+
+from utils.cache import cache
+from utils.constants import CacheKey
+from .models import User
+
+# appkey 到用户的缓存时间, 进程内的缓存不能被其他进程清除, 时间要短一些
+APPKEY_CACHE_TIMEOUT = 60 * 60
+APPKEY_LOCAL_CACHE_TIMEOUT = 10
+_MAX_LOCAL_APPKEYS = 10000
+_local_appkeys = {}
+
+
+def _appkey_cache_key(appkey):
+    # 不在 redis 中保存 appkey 的明文
+    return f"{CacheKey.open_api_appkey}:{hashlib.sha256(appkey.encode('utf-8')).hexdigest()}"
+
+
+def get_appkey_user(appkey):
+    """
+    返回 appkey 对应的 {"id", "is_disabled", "admin_type"}, appkey 无效时返回 None.
+    缓存中的信息可能稍微过时, 调用方还要用数据库中的用户再确认一次
+    """
+    now = time.monotonic()
+    local = _local_appkeys.get(appkey)
+    if local and local[1] > now:
+        return local[0]
+
+    key = _appkey_cache_key(appkey)
+    entry = cache.get(key)
+    if entry is None:
+        user = User.objects.filter(open_api_appkey=appkey, open_api=True). \
+            values("id", "is_disabled", "admin_type").first()
+        # 无效的 appkey 也缓存, 避免用随机的 appkey 反复查询数据库
+        entry = user or {}
+        cache.set(key, entry, timeout=APPKEY_CACHE_TIMEOUT)
+
+    if len(_local_appkeys) >= _MAX_LOCAL_APPKEYS:
+        _local_appkeys.clear()
+    _local_appkeys[appkey] = (entry, now + APPKEY_LOCAL_CACHE_TIMEOUT)
+    return entry or None
+
+
+def invalidate_appkey(*appkeys):
+    """
+    更换 appkey, 关闭 open api, 禁用或者删除用户之后调用
+    """
+    appkeys = [item for item in appkeys if item]
+    if not appkeys:
+        return
+    for appkey in appkeys:
+        _local_appkeys.pop(appkey, None)
+    cache.delete_many([_appkey_cache_key(appkey) for appkey in appkeys])
+
+
+# 同一个会话的 IP 和 user agent 没有变化时, 最多每隔这么多秒记录一次活动时间
+SESSION_ACTIVITY_INTERVAL = 60
+# 会话中保存最后一次记录的 [ip, user_agent, 时间], 用来判断是否需要再次记录
+SESSION_ACTIVITY_KEY = "_activity"
+
+
+def _user_sessions_key(user_id):
+    return f"{CacheKey.user_sessions}:{user_id}"
+
+
+def record_session_activity(request):
+    """
+    每个用户的会话保存在一个 redis hash 中, field 是 session key, 值是会话最后的 IP, user agent 和活动时间
+    """
+    session = request.session
+    if not session.session_key:
+        return
+    user_agent = request.META.get("HTTP_USER_AGENT", "")
+    now = time.time()
+    last = session.get(SESSION_ACTIVITY_KEY)
+    if last and last[0] == request.ip and last[1] == user_agent and now - last[2] < SESSION_ACTIVITY_INTERVAL:
+        return
+    session[SESSION_ACTIVITY_KEY] = [request.ip, user_agent, now]
+    key = _user_sessions_key(request.user.id)
+    pipe = cache.pipeline()
+    pipe.hset(key, session.session_key, json.dumps({"ip": request.ip, "user_agent": user_agent, "time": now}))
+    pipe.expire(key, settings.SESSION_COOKIE_AGE)
+    pipe.execute()
+
+
+def get_user_sessions(user_id):
+    """
+    返回 {session_key: {"ip", "user_agent", "last_activity"}}, 已经过期的会话会被删除
+    """
+    key = _user_sessions_key(user_id)
+    sessions = {field.decode("utf-8"): json.loads(value) for field, value in cache.hgetall(key).items()}
+    if not sessions:
+        return {}
+    session_store = import_module(settings.SESSION_ENGINE).SessionStore
+    session_keys = list(sessions.keys())
+    # 一次 MGET 检查所有的会话是否还存在
+    alive = cache.get_many([session_store.cache_key_prefix + item for item in session_keys])
+    expired = [item for item in session_keys if session_store.cache_key_prefix + item not in alive]
+    if expired:
+        cache.hdel(key, *expired)
+    result = {}
+    for session_key in session_keys:
+        if session_key in expired:
+            continue
+        item = sessions[session_key]
+        result[session_key] = {"ip": item["ip"], "user_agent": item["user_agent"],
+                               "last_activity": datetime.fromtimestamp(item["time"], tz=timezone.utc)}
+    return result
+
+
+def delete_user_session(user_id, session_key):
+    """
+    删除用户自己的一个会话, session_key 不属于这个用户时返回 False
+    """
+    if not cache.hdel(_user_sessions_key(user_id), session_key):
+        return False
+    import_module(settings.SESSION_ENGINE).SessionStore(session_key).delete()
+    return True
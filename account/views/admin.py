@@ -7,7 +7,7 @@ from django.db.models import Q
 from django.http import HttpResponse
 from django.contrib.auth.hashers import make_password
 
-from submission.models import Submission
+from submission.models import ArchivedSubmission, ProblemBestSubmission, Submission
 from utils.api import APIView, validate_serializer
 from utils.shortcuts import rand_str
 
@@ -15,6 +15,7 @@ from ..decorators import super_admin_required
 from ..models import AdminType, ProblemPermission, User, UserProfile
 from ..serializers import EditUserSerializer, UserAdminSerializer, GenerateUserSerializer
 from ..serializers import ImportUserSeralizer
+from ..utils import invalidate_appkey
 
 
 class UserAdminAPI(APIView):
@@ -60,6 +61,7 @@ class UserAdminAPI(APIView):
             return self.error("Email already exists")
 
         pre_username = user.username
+        pre_appkey = user.open_api_appkey
         user.username = data["username"].lower()
         user.email = data["email"].lower()
         user.admin_type = data["admin_type"]
@@ -93,8 +95,12 @@ class UserAdminAPI(APIView):
         user.two_factor_auth = data["two_factor_auth"]
 
         user.save()
+        # 禁用用户或者关闭 open api 之后旧的 appkey 立即失效
+        invalidate_appkey(pre_appkey)
         if pre_username != user.username:
             Submission.objects.filter(username=pre_username).update(username=user.username)
+            ArchivedSubmission.objects.filter(username=pre_username).update(username=user.username)
+            ProblemBestSubmission.objects.filter(user_id=user.id).update(username=user.username)
 
         UserProfile.objects.filter(user=user).update(real_name=data["real_name"])
         return self.success(UserAdminSerializer(user).data)
@@ -119,7 +125,7 @@ class UserAdminAPI(APIView):
             user = user.filter(Q(username__icontains=keyword) |
                                Q(userprofile__real_name__icontains=keyword) |
                                Q(email__icontains=keyword))
-        return self.success(self.paginate_data(request, user, UserAdminSerializer))
+        return self.success(self.paginate_data(request, user, UserAdminSerializer, cursor_ordering=("-id",)))
 
     @super_admin_required
     def delete(self, request):
@@ -129,7 +135,10 @@ class UserAdminAPI(APIView):
         ids = id.split(",")
         if str(request.user.id) in ids:
             return self.error("Current user can not be deleted")
-        User.objects.filter(id__in=ids).delete()
+        users = User.objects.filter(id__in=ids)
+        appkeys = list(users.exclude(open_api_appkey__isnull=True).values_list("open_api_appkey", flat=True))
+        users.delete()
+        invalidate_appkey(*appkeys)
         return self.success()
 
 
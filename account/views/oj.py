@@ -1,6 +1,5 @@
 import os
 from datetime import timedelta
-from importlib import import_module
 
 import qrcode
 from django.conf import settings
@@ -17,6 +16,7 @@ from options.options import SysOptions
 from utils.api import APIView, validate_serializer, CSRFExemptAPIView
 from utils.captcha import Captcha
 from utils.shortcuts import rand_str, img2base64, datetime2str
+from utils.throttling import RateLimitScope, rate_limit
 from ..decorators import login_required
 from ..models import User, UserProfile, AdminType
 from ..serializers import (ApplyResetPasswordSerializer, ResetPasswordSerializer,
@@ -26,6 +26,7 @@ from ..serializers import (ApplyResetPasswordSerializer, ResetPasswordSerializer
 from ..serializers import (TwoFactorAuthCodeSerializer, UserProfileSerializer,
                            EditUserProfileSerializer, ImageUploadForm)
 from ..tasks import send_email_async
+from ..utils import delete_user_session, get_user_sessions, invalidate_appkey
 
 
 class UserProfileAPI(APIView):
@@ -153,6 +154,8 @@ class CheckTFARequiredAPI(APIView):
 
 
 class UserLoginAPI(APIView):
+    @rate_limit("login_ip")
+    @rate_limit("login", scope=RateLimitScope.ACCOUNT, account_field="username")
     @validate_serializer(UserLoginSerializer)
     def post(self, request):
         """
@@ -207,6 +210,7 @@ class UsernameOrEmailCheck(APIView):
 
 
 class UserRegisterAPI(APIView):
+    @rate_limit("register")
     @validate_serializer(UserRegisterSerializer)
     def post(self, request):
         """
@@ -279,6 +283,8 @@ class UserChangePasswordAPI(APIView):
 
 
 class ApplyResetPasswordAPI(APIView):
+    @rate_limit("reset_password_ip")
+    @rate_limit("reset_password", scope=RateLimitScope.ACCOUNT, account_field="email")
     @validate_serializer(ApplyResetPasswordSerializer)
     def post(self, request):
         if request.user.is_authenticated:
@@ -334,20 +340,9 @@ class ResetPasswordAPI(APIView):
 class SessionManagementAPI(APIView):
     @login_required
     def get(self, request):
-        engine = import_module(settings.SESSION_ENGINE)
-        session_store = engine.SessionStore
         current_session = request.session.session_key
-        session_keys = request.user.session_keys
         result = []
-        modified = False
-        for key in session_keys[:]:
-            session = session_store(key)
-            # session does not exist or is expiry
-            if not session._session:
-                session_keys.remove(key)
-                modified = True
-                continue
-
+        for key, session in get_user_sessions(request.user.id).items():
             s = {}
             if current_session == key:
                 s["current_session"] = True
@@ -356,8 +351,6 @@ class SessionManagementAPI(APIView):
             s["last_activity"] = datetime2str(session["last_activity"])
             s["session_key"] = key
             result.append(s)
-        if modified:
-            request.user.save()
         return self.success(result)
 
     @login_required
@@ -365,10 +358,7 @@ class SessionManagementAPI(APIView):
         session_key = request.GET.get("session_key")
         if not session_key:
             return self.error("Parameter Error")
-        request.session.delete(session_key)
-        if session_key in request.user.session_keys:
-            request.user.session_keys.remove(session_key)
-            request.user.save()
+        if delete_user_session(request.user.id, session_key):
             return self.success("Succeeded")
         else:
             return self.error("Invalid session_key")
@@ -413,9 +403,11 @@ class OpenAPIAppkeyAPI(APIView):
         user = request.user
         if not user.open_api:
             return self.error("OpenAPI function is truned off for you")
+        old_appkey = user.open_api_appkey
         api_appkey = rand_str()
         user.open_api_appkey = api_appkey
         user.save()
+        invalidate_appkey(old_appkey)
         return self.success({"appkey": api_appkey})
 
 
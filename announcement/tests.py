@@ -1,4 +1,11 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from account.models import User
+from utils import models as rich_text
 from utils.api.tests import APITestCase
+from utils.xss_filter import XSSHtml
 
 from .models import Announcement
 
@@ -46,3 +53,57 @@ class AnnouncementAPITest(APITestCase):
     def test_get_announcement_list(self):
         resp = self.client.get(self.url)
         self.assertSuccess(resp)
+
+    def test_get_announcement_list_by_cursor(self):
+        for index in range(4):
+            Announcement.objects.create(title=f"title{index}", content="content", visible=True, created_by=self.user)
+        ids = []
+        cursor = ""
+        while cursor is not None:
+            resp = self.client.get(self.url, data={"limit": 2, "cursor": cursor})
+            self.assertSuccess(resp)
+            self.assertNotIn("total", resp.data["data"])
+            ids.extend(item["id"] for item in resp.data["data"]["results"])
+            cursor = resp.data["data"]["next"]
+        self.assertEqual(ids, list(Announcement.objects.order_by("-create_time", "-id").values_list("id", flat=True)))
+
+    def test_get_announcement_list_by_invalid_cursor(self):
+        resp = self.client.get(self.url, data={"limit": 2, "cursor": "invalid"})
+        self.assertFailed(resp, "Invalid cursor")
+
+
+class RichTextFieldTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test")
+        rich_text._sanitized.clear()
+
+    def count_clean(self):
+        return mock.patch.object(XSSHtml, "clean", autospec=True, side_effect=XSSHtml.clean)
+
+    def test_sanitize(self):
+        announcement = Announcement.objects.create(title="title", content='<p onclick="x">a</p><script>b</script>',
+                                                   created_by=self.user)
+        announcement.refresh_from_db()
+        self.assertEqual(announcement.content, "<p>a</p>b")
+
+    def test_skip_unchanged(self):
+        Announcement.objects.create(title="title", content="<p>content</p>", created_by=self.user)
+        rich_text._sanitized.clear()
+        announcement = Announcement.objects.get()
+        with self.count_clean() as clean:
+            announcement.title = "new title"
+            announcement.save()
+            announcement.visible = False
+            announcement.save(update_fields=["visible"])
+        self.assertEqual(clean.call_count, 0)
+
+        announcement.content += "<script>x</script>"
+        announcement.save()
+        announcement.refresh_from_db()
+        self.assertEqual(announcement.content, "<p>content</p>x")
+
+    def test_memoize(self):
+        with self.count_clean() as clean:
+            for index in range(3):
+                Announcement.objects.create(title=f"title{index}", content="<p>same</p>", created_by=self.user)
+        self.assertEqual(clean.call_count, 1)
@@ -0,0 +1,120 @@
+"""
+比较比赛排名接口在缓存整个 queryset(旧的做法)和按页缓存序列化结果时每个请求的耗时
+
+    python -m benchmarks.contest_rank [参赛人数 ...]
+
+需要能连上 oj.settings 中配置的数据库和 redis, 生成的数据在事务中创建, 结束后回滚
+"""
+import os
+import random
+import sys
+import timeit
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "oj.settings")
+django.setup()
+
+from django.db import transaction  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from account.models import User, UserProfile  # noqa: E402
+from contest.models import ACMContestRank, Contest, ContestRuleType  # noqa: E402
+from contest.serializers import ACMContestRankSerializer  # noqa: E402
+from contest.utils import bump_rank_version  # noqa: E402
+from contest.views.oj import ContestRankAPI  # noqa: E402
+from utils.cache import cache  # noqa: E402
+from utils.constants import CacheKey  # noqa: E402
+
+PARTICIPANT_COUNTS = (1000, 10000)
+PROBLEM_COUNT = 10
+LIMIT = 50
+
+
+class Rollback(Exception):
+    pass
+
+
+def _create_contest(count, seed=0):
+    rand = random.Random(seed)
+    admin = User.objects.create(username=f"bench_rank_admin_{rand.getrandbits(32)}", admin_type="Super Admin")
+    contest = Contest.objects.create(title="bench", description="bench", created_by=admin,
+                                     start_time=timezone.now(), end_time=timezone.now() + timezone.timedelta(days=1),
+                                     rule_type=ContestRuleType.ACM, real_time_rank=True, allowed_ip_ranges=[],
+                                     visible=True)
+    users = User.objects.bulk_create([User(username=f"bench_rank_{contest.id}_{index}") for index in range(count)],
+                                     batch_size=1000)
+    UserProfile.objects.bulk_create([UserProfile(user=user) for user in users], batch_size=1000)
+    ranks = []
+    for user in users:
+        info = {}
+        for problem_id in rand.sample(range(1, 100), rand.randint(0, PROBLEM_COUNT)):
+            is_ac = rand.random() < 0.6
+            info[str(problem_id)] = {"is_ac": is_ac, "ac_time": rand.randint(0, 18000) if is_ac else 0,
+                                     "error_number": rand.randint(0, 5), "is_first_ac": False}
+        accepted = sum(item["is_ac"] for item in info.values())
+        ranks.append(ACMContestRank(user=user, contest=contest, submission_number=len(info) + accepted,
+                                    accepted_number=accepted, total_time=rand.randint(0, 100000),
+                                    submission_info=info))
+    ACMContestRank.objects.bulk_create(ranks, batch_size=1000)
+    return admin, contest
+
+
+def _legacy_page(view, contest, offset):
+    # 旧的做法: 整个 queryset 缓存在 redis 中, 每个请求取出全部行再分页和序列化
+    key = f"bench:{CacheKey.contest_rank_cache}:{contest.id}"
+    qs = cache.get(key)
+    if not qs:
+        qs = view.get_rank()
+        cache.set(key, qs)
+    return ACMContestRankSerializer(qs[offset:offset + LIMIT], many=True).data
+
+
+def run(counts=PARTICIPANT_COUNTS, number=50):
+    results = []
+    factory = RequestFactory()
+    for count in counts:
+        try:
+            with transaction.atomic():
+                admin, contest = _create_contest(count)
+                offset = count // 2
+                request = factory.get("/api/contest_rank",
+                                      {"contest_id": contest.id, "limit": LIMIT, "offset": offset})
+                request.user = admin
+                view = ContestRankAPI.as_view()
+
+                legacy_view = ContestRankAPI()
+                legacy_view.contest = contest
+                _legacy_page(legacy_view, contest, offset)
+
+                def cold():
+                    bump_rank_version(contest.id)
+                    view(request)
+
+                view(request)
+                results.append({"participants": count,
+                                "legacy_ms": min(timeit.repeat(lambda: _legacy_page(legacy_view, contest, offset),
+                                                               number=number, repeat=3)) / number * 1000,
+                                "cached_ms": min(timeit.repeat(lambda: view(request),
+                                                               number=number, repeat=3)) / number * 1000,
+                                "rebuild_ms": min(timeit.repeat(cold, number=number, repeat=3)) / number * 1000})
+                cache.delete(f"bench:{CacheKey.contest_rank_cache}:{contest.id}")
+                cache.delete_pattern(f"{CacheKey.contest_rank_cache}:{contest.id}:*")
+                cache.delete(f"{CacheKey.contest_rank_version}:{contest.id}")
+                raise Rollback()
+        except Rollback:
+            pass
+    return results
+
+
+def main():
+    columns = ["participants", "legacy_ms", "cached_ms", "rebuild_ms"]
+    print(" ".join(f"{column:>14}" for column in columns))
+    for row in run([int(count) for count in sys.argv[1:]] or PARTICIPANT_COUNTS):
+        print(" ".join(f"{row[column]:>14.2f}" if isinstance(row[column], float) else f"{row[column]:>14}"
+                       for column in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+比较 API 响应的 json 编码方式: 旧的 json.dumps(indent=4), 标准库紧凑格式, orjson(如果安装了),
+以及压缩后的大小. 数据的结构和排名, 题目列表, 提交列表接口返回的一页数据相同
+
+    python -m benchmarks.json_render [每页条数]
+
+不需要数据库和 redis
+"""
+import gzip
+import json
+import os
+import random
+import sys
+import timeit
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "oj.settings")
+django.setup()
+
+from utils.api.api import JSONRenderer, StdlibJSONRenderer, orjson  # noqa: E402
+from utils.middleware import brotli  # noqa: E402
+
+LIMIT = 250
+REPEAT = 5
+
+
+def _user(index):
+    return {"id": index, "username": f"user{index}", "real_name": None}
+
+
+def rank_page(limit, rand):
+    results = []
+    for index in range(limit):
+        info = {}
+        for problem_id in rand.sample(range(1, 100), 10):
+            is_ac = rand.random() < 0.6
+            info[str(problem_id)] = {"is_ac": is_ac, "ac_time": rand.randint(0, 18000) if is_ac else 0,
+                                     "error_number": rand.randint(0, 5), "is_first_ac": False}
+        results.append({"id": index, "user": _user(index), "submission_number": rand.randint(0, 30),
+                        "accepted_number": rand.randint(0, 10), "total_time": rand.randint(0, 100000),
+                        "submission_info": info, "contest": 1})
+    return {"error": None, "data": {"results": results, "total": limit * 20}}
+
+
+def problem_list(limit, rand):
+    results = []
+    for index in range(limit):
+        results.append({"id": index, "tags": ["動態規劃", "greedy"], "created_by": _user(1),
+                        "template": {}, "_id": f"A-{index}", "title": f"題目 {index}",
+                        "description": "<p>" + "描述" * 200 + "</p>", "input_description": "<p>輸入</p>",
+                        "output_description": "<p>輸出</p>", "samples": [{"input": "1 2", "output": "3"}],
+                        "hint": "<p>hint</p>", "languages": ["C", "C++", "Java", "Python3"],
+                        "create_time": "2024-03-01T08:00:00.000000Z", "last_update_time": None,
+                        "time_limit": 1000, "memory_limit": 256, "io_mode": {"io_mode": "Standard IO"},
+                        "spj": False, "spj_language": None, "rule_type": "ACM", "difficulty": "Low",
+                        "source": "NCHU", "total_score": 0, "submission_number": rand.randint(0, 5000),
+                        "accepted_number": rand.randint(0, 2000), "statistic_info": {"0": 10, "-1": 20},
+                        "share_submission": False, "my_status": rand.choice([None, 0, -1])})
+    return {"error": None, "data": {"results": results, "total": 1200}}
+
+
+def submission_list(limit, rand):
+    results = []
+    for index in range(limit):
+        results.append({"id": f"0{rand.getrandbits(124):031x}", "problem": f"A-{rand.randint(0, 500)}",
+                        "create_time": "2024-03-01T08:00:00.000000Z", "user_id": rand.randint(1, 3000),
+                        "username": f"user{index}", "result": rand.choice([0, -1, 1, 2, 4]),
+                        "language": "C++", "shared": False, "contest": None,
+                        "statistic_info": {"time_cost": rand.randint(0, 1000), "memory_cost": rand.randint(0, 10 ** 8)},
+                        "show_link": True})
+    return {"error": None, "data": {"results": results, "total": 100000}}
+
+
+def _time(func):
+    number = 20
+    return min(timeit.repeat(func, number=number, repeat=REPEAT)) / number * 1000
+
+
+def main(limit):
+    rand = random.Random(0)
+    encoders = [("stdlib indent=4", lambda data: json.dumps(data, indent=4).encode("utf-8")),
+                ("stdlib compact", StdlibJSONRenderer.render)]
+    if orjson is not None:
+        encoders.append(("orjson", JSONRenderer.render))
+    for name, build in (("rank page", rank_page), ("problem list", problem_list),
+                        ("submission list", submission_list)):
+        data = build(limit, rand)
+        print(f"{name} ({limit} rows)")
+        for encoder_name, encode in encoders:
+            body = encode(data)
+            print(f"  {encoder_name:<16} {_time(lambda: encode(data)):8.2f} ms  {len(body):>9} bytes")
+        body = JSONRenderer.render(data)
+        print(f"  {'gzip':<16} {_time(lambda: gzip.compress(body, compresslevel=6)):8.2f} ms  "
+              f"{len(gzip.compress(body, compresslevel=6)):>9} bytes")
+        if brotli is not None:
+            print(f"  {'brotli q4':<16} {_time(lambda: brotli.compress(body, quality=4)):8.2f} ms  "
+                  f"{len(brotli.compress(body, quality=4)):>9} bytes")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else LIMIT)
@@ -0,0 +1,413 @@
+"""
+提交流程的压力测试. 启动一个假的判题服务器(只实现 /judge, 延迟和结果分布可以配置), 通过 JudgeServerHeartbeatAPI
+注册之后按照目标速率调用 SubmissionAPI.post, 统计
+  submit: 提交接口的耗时
+  queue wait: 提交接口返回到判题服务器收到请求, 包括 dramatiq 队列和 waiting_queue 中的等待
+  judge to db: 判题服务器返回结果到结果写入数据库(收到最终状态的推送)
+  end to end: 开始提交到收到最终状态
+以及采样得到的数据库锁等待和端到端的吞吐量, 用来比较不同版本能承受的提交速率
+
+    python -m benchmarks.judge_load [--rate 20] [--count 500] [--judge-latency 200] [--json]
+
+需要能连上 oj.settings 中配置的数据库和 redis. 默认在本进程中启动 dramatiq worker, 已经有 worker 在运行时
+使用 --external-worker. 压测期间会临时放宽提交的频率限制, 生成的用户, 题目, 提交和判题服务器结束后会被删除.
+数据库中其他状态正常的判题服务器也会分到任务, 压测前最好先禁用
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "oj.settings")
+django.setup()
+
+import dramatiq  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+
+from account.models import User, UserProfile  # noqa: E402
+from conf.models import JudgeServer  # noqa: E402
+from options.options import SysOptions  # noqa: E402
+from problem.models import Problem, ProblemDifficulty, ProblemRuleType  # noqa: E402
+from submission.models import ArchivedSubmission, JudgeStatus, Submission, SubmissionCode  # noqa: E402
+from utils.cache import cache  # noqa: E402
+from utils.constants import CacheKey  # noqa: E402
+from utils.shortcuts import rand_str  # noqa: E402
+
+# 提交的代码中带上序号, 判题服务器据此把请求和提交对应起来
+_marker = re.compile(r"// bench:(\d+)")
+CODE = "// bench:{}\nint main() {{ return 0; }}\n"
+LANGUAGE = "C++"
+HEARTBEAT_INTERVAL = 3
+LOCK_SAMPLE_INTERVAL = 0.1
+# 压测期间的频率限制, 实际上不限制
+UNLIMITED_BUCKET = {"capacity": 10 ** 9, "fill_rate": 10 ** 6, "default_capacity": 10 ** 9}
+
+
+def parse_verdicts(value):
+    """
+    "0:60,-1:30,-2:10" -> ([0, -1, -2], [60, 30, 10]), -2(编译错误)返回 err
+    """
+    results, weights = [], []
+    for item in value.split(","):
+        result, weight = item.rsplit(":", 1)
+        results.append(int(result))
+        weights.append(float(weight))
+    return results, weights
+
+
+class _JudgeHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        received = time.monotonic()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/judge":
+            self.send_error(404)
+            return
+        if self.headers.get("X-Judge-Server-Token") != server.token:
+            self._reply({"err": "invalid token", "data": "invalid token"})
+            return
+        match = _marker.search(json.loads(body)["src"])
+        seq = int(match.group(1)) if match else None
+
+        time.sleep(max(0, random.uniform(1 - server.jitter, 1 + server.jitter) * server.latency))
+        result = random.choices(server.results, server.weights)[0]
+        if result == JudgeStatus.COMPILE_ERROR:
+            data = {"err": "CompileError", "data": "fake compile error"}
+        else:
+            data = {"err": None, "data": [{"test_case": "1", "result": result, "cpu_time": random.randint(0, 1000),
+                                           "real_time": random.randint(0, 1000), "memory": random.randint(1, 64) << 20,
+                                           "signal": 0, "exit_code": 0, "error": 0, "output_md5": None,
+                                           "output": None}]}
+        with server.lock:
+            server.requests += 1
+            if seq is not None:
+                server.received[seq] = received
+                server.responded[seq] = time.monotonic()
+        self._reply(data)
+
+    def _reply(self, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeJudgeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, token, latency, jitter, verdicts):
+        """
+        :param token: sha256 之后的 judge_server_token
+        :param latency: 每次判题的平均耗时(秒), 实际耗时在 latency * (1 ± jitter) 之间均匀分布
+        :param verdicts: parse_verdicts 的返回值
+        """
+        super().__init__(("127.0.0.1", 0), _JudgeHandler)
+        self.token = token
+        self.latency = latency
+        self.jitter = jitter
+        self.results, self.weights = verdicts
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.received = {}
+        self.responded = {}
+
+    @property
+    def service_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class _CompletionListener(threading.Thread):
+    """
+    订阅所有提交的状态推送, 记录每个提交收到最终状态的时间
+    """
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.completed = {}
+        self.stopped = threading.Event()
+        self.pubsub = cache.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.psubscribe(f"{CacheKey.submission_status}:*")
+
+    def run(self):
+        while not self.stopped.is_set():
+            message = self.pubsub.get_message(timeout=0.5)
+            if not message or message["type"] != "pmessage":
+                continue
+            data = json.loads(message["data"])
+            if data["result"] not in (JudgeStatus.PENDING, JudgeStatus.JUDGING):
+                self.completed.setdefault(data["id"], time.monotonic())
+        self.pubsub.close()
+
+
+class _LockSampler(threading.Thread):
+    """
+    定时查询 pg_stat_activity 中等待锁的连接数, 锁等待的总时间按 等待的连接数 * 采样间隔 估算
+    """
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.samples = []
+        self.max_wait = 0
+        self.deadlocks = 0
+        self.stopped = threading.Event()
+
+    def _deadlocks(self, cursor):
+        cursor.execute("SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()")
+        return cursor.fetchone()[0]
+
+    def run(self):
+        try:
+            with connection.cursor() as cursor:
+                deadlocks = self._deadlocks(cursor)
+                while not self.stopped.wait(LOCK_SAMPLE_INTERVAL):
+                    cursor.execute("SELECT count(*), coalesce(max(extract(epoch FROM now() - query_start)), 0) "
+                                   "FROM pg_stat_activity WHERE datname = current_database() "
+                                   "AND wait_event_type = 'Lock'")
+                    waiting, longest = cursor.fetchone()
+                    self.samples.append(waiting)
+                    self.max_wait = max(self.max_wait, float(longest))
+                self.deadlocks = self._deadlocks(cursor) - deadlocks
+        finally:
+            connection.close()
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    result = {"count": len(values)}
+    for name, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        result[name] = values[min(len(values) - 1, int(p * len(values)))] * 1000
+    result["max"] = values[-1] * 1000
+    return result
+
+
+class JudgeLoadBenchmark:
+    def __init__(self, args):
+        self.args = args
+        self.tag = rand_str(6)
+        self.hostname = f"bench-judge-{self.tag}"
+        self.token = hashlib.sha256(SysOptions.judge_server_token.encode("utf-8")).hexdigest()
+        self.users = []
+        self.problem = None
+        self.submitted = {}
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def setup(self):
+        for index in range(self.args.users):
+            user = User.objects.create(username=f"bench_{self.tag}_{index}")
+            UserProfile.objects.create(user=user)
+            self.users.append(user)
+        self.problem = Problem.objects.create(_id=f"bench-{self.tag}", title="judge load benchmark",
+                                              description="", input_description="", output_description="",
+                                              samples=[], test_case_id="bench", test_case_score=[],
+                                              languages=[LANGUAGE], template={}, created_by=self.users[0],
+                                              time_limit=1000, memory_limit=256, rule_type=ProblemRuleType.ACM,
+                                              difficulty=ProblemDifficulty.Low)
+        self.clients = queue.Queue()
+        for user in self.users:
+            client = Client()
+            client.force_login(user)
+            self.clients.put(client)
+
+    def cleanup(self):
+        if self.problem:
+            submissions = Submission.objects.filter(problem_id=self.problem.id)
+            code_hashes = set(submissions.values_list("code_blob_id", flat=True))
+            submissions.delete()
+            # 代码按内容存储, 不随提交删除, 每次压测的代码都不同, 这里一起删掉
+            SubmissionCode.objects.filter(hash__in=code_hashes) \
+                .exclude(hash__in=Submission.objects.values("code_blob_id")) \
+                .exclude(hash__in=ArchivedSubmission.objects.values("code_blob_id")).delete()
+            self.problem.delete()
+        User.objects.filter(id__in=[user.id for user in self.users]).delete()
+        JudgeServer.objects.filter(hostname=self.hostname).delete()
+
+    def heartbeat(self, client, service_url):
+        resp = client.post("/api/judge_server_heartbeat",
+                           data={"hostname": self.hostname, "judger_version": "bench", "cpu_core": self.args.judge_cores,
+                                 "memory": 0, "cpu": 0, "action": "heartbeat", "service_url": service_url},
+                           content_type="application/json",
+                           HTTP_X_JUDGE_SERVER_TOKEN=self.token)
+        if resp.data["error"]:
+            raise RuntimeError(f"heartbeat failed: {resp.data}")
+
+    def submit(self, seq):
+        client = self.clients.get()
+        try:
+            start = time.monotonic()
+            resp = client.post("/api/submission", data={"problem_id": self.problem.id, "language": LANGUAGE,
+                                                        "code": CODE.format(seq)},
+                               content_type="application/json")
+            end = time.monotonic()
+        finally:
+            self.clients.put(client)
+        with self.lock:
+            if resp.data["error"]:
+                self.errors.append(resp.data["data"])
+            else:
+                self.submitted[seq] = (resp.data["data"]["submission_id"], start, end)
+        connection.close()
+
+    def run(self):
+        args = self.args
+        judge = FakeJudgeServer(self.token, args.judge_latency / 1000,
+                                args.judge_jitter, parse_verdicts(args.verdicts))
+        threading.Thread(target=judge.serve_forever, daemon=True).start()
+        heartbeat_client = Client()
+        self.heartbeat(heartbeat_client, judge.service_url)
+        stopped = threading.Event()
+
+        def heartbeat_loop():
+            while not stopped.wait(HEARTBEAT_INTERVAL):
+                self.heartbeat(heartbeat_client, judge.service_url)
+            connection.close()
+
+        threading.Thread(target=heartbeat_loop, daemon=True).start()
+
+        worker = None
+        if not args.external_worker:
+            worker = dramatiq.Worker(dramatiq.get_broker(), worker_threads=args.worker_threads)
+            worker.start()
+        listener = _CompletionListener()
+        listener.start()
+        sampler = _LockSampler() if connection.vendor == "postgresql" else None
+        if sampler:
+            sampler.start()
+
+        start = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=min(args.concurrency, args.users)) as executor:
+                for seq in range(args.count):
+                    delay = start + seq / args.rate - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    executor.submit(self.submit, seq)
+            submit_end = time.monotonic()
+            deadline = submit_end + args.timeout
+            while time.monotonic() < deadline:
+                if all(item[0] in listener.completed for item in self.submitted.values()):
+                    break
+                time.sleep(0.1)
+        finally:
+            stopped.set()
+            listener.stopped.set()
+            if sampler:
+                sampler.stopped.set()
+                sampler.join()
+            if worker:
+                worker.stop()
+            judge.shutdown()
+        return self.report(judge, listener, sampler, start, submit_end)
+
+    def report(self, judge, listener, sampler, start, submit_end):
+        completed = listener.completed
+        submit, queue_wait, judge_to_db, end_to_end = [], [], [], []
+        for seq, (submission_id, sent, returned) in self.submitted.items():
+            submit.append(returned - sent)
+            if seq in judge.received:
+                queue_wait.append(judge.received[seq] - returned)
+            done = completed.get(submission_id)
+            if done is None:
+                continue
+            end_to_end.append(done - sent)
+            if seq in judge.responded:
+                judge_to_db.append(done - judge.responded[seq])
+        finished = [completed[item[0]] for item in self.submitted.values() if item[0] in completed]
+        verdicts = {}
+        for result in Submission.objects.filter(problem_id=self.problem.id).values_list("result", flat=True):
+            verdicts[str(result)] = verdicts.get(str(result), 0) + 1
+        result = {
+            "config": {name: value for name, value in vars(self.args).items() if name != "json"},
+            "submitted": len(self.submitted),
+            "submit_errors": len(self.errors),
+            "completed": len(finished),
+            "judge_requests": judge.requests,
+            "verdicts": verdicts,
+            "submit_rate": len(self.submitted) / (submit_end - start),
+            "throughput": len(finished) / (max(finished) - start) if finished else 0,
+            "latency_ms": {"submit": _percentiles(submit), "queue_wait": _percentiles(queue_wait),
+                           "judge_to_db": _percentiles(judge_to_db), "end_to_end": _percentiles(end_to_end)},
+        }
+        if sampler:
+            samples = sampler.samples or [0]
+            result["db_lock"] = {"samples": len(sampler.samples),
+                                 "waiting_ratio": sum(1 for item in samples if item) / len(samples),
+                                 "max_waiting": max(samples),
+                                 "avg_waiting": sum(samples) / len(samples),
+                                 "total_wait_s": sum(samples) * LOCK_SAMPLE_INTERVAL,
+                                 "max_wait_ms": sampler.max_wait * 1000,
+                                 "deadlocks": sampler.deadlocks}
+        if self.errors:
+            result["first_error"] = self.errors[0]
+        return result
+
+
+def print_report(result):
+    print(f"submitted {result['submitted']} ({result['submit_errors']} errors), completed {result['completed']}, "
+          f"judge requests {result['judge_requests']}, verdicts {result['verdicts']}")
+    print(f"submit rate {result['submit_rate']:.1f}/s, end to end throughput {result['throughput']:.1f}/s")
+    columns = ["count", "p50", "p95", "p99", "max"]
+    print(f"{'ms':<12}" + " ".join(f"{column:>10}" for column in columns))
+    for name, item in result["latency_ms"].items():
+        print(f"{name:<12}" + " ".join(f"{item[column]:>10.1f}" if isinstance(item.get(column), float)
+                                       else f"{item.get(column, '-'):>10}" for column in columns))
+    lock = result.get("db_lock")
+    if lock:
+        print(f"db lock: waiting in {lock['waiting_ratio']:.1%} of {lock['samples']} samples, "
+              f"max {lock['max_waiting']} / avg {lock['avg_waiting']:.2f} waiting, "
+              f"~{lock['total_wait_s']:.2f}s total, longest {lock['max_wait_ms']:.1f}ms, "
+              f"deadlocks {lock['deadlocks']}")
+    if "first_error" in result:
+        print(f"first error: {result['first_error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="submission pipeline load benchmark")
+    parser.add_argument("--rate", type=float, default=20, help="目标提交速率, 每秒")
+    parser.add_argument("--count", type=int, default=500, help="提交的总数")
+    parser.add_argument("--users", type=int, default=50, help="提交的用户数")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时发出的提交请求数")
+    parser.add_argument("--judge-latency", type=float, default=200, help="每次判题的平均耗时, 毫秒")
+    parser.add_argument("--judge-jitter", type=float, default=0.5, help="判题耗时的浮动比例")
+    parser.add_argument("--judge-cores", type=int, default=4, help="假判题服务器的 cpu 核数, 决定同时判题的数量")
+    parser.add_argument("--verdicts", default="0:60,-1:30,-2:10", help="判题结果的分布, 结果:权重")
+    parser.add_argument("--worker-threads", type=int, default=8, help="本进程中 dramatiq worker 的线程数")
+    parser.add_argument("--external-worker", action="store_true", help="不在本进程中启动 dramatiq worker")
+    parser.add_argument("--timeout", type=float, default=60, help="提交结束之后等待判题完成的最长时间, 秒")
+    parser.add_argument("--json", action="store_true", help="输出 json, 方便在不同的版本之间比较")
+    args = parser.parse_args()
+    logging.getLogger("dramatiq").setLevel(logging.WARNING)
+
+    throttling = SysOptions.throttling
+    benchmark = JudgeLoadBenchmark(args)
+    try:
+        SysOptions.throttling = dict(throttling, user=UNLIMITED_BUCKET, ip=UNLIMITED_BUCKET)
+        benchmark.setup()
+        result = benchmark.run()
+    finally:
+        SysOptions.throttling = throttling
+        benchmark.cleanup()
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
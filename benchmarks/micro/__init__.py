@@ -0,0 +1,88 @@
+"""
+后端 CPU 密集函数的微基准测试. 输入由固定的随机种子生成, 不需要数据库和 redis, 结果是 json,
+可以和 baseline.json 或者其他版本的结果直接比较
+
+    python -m benchmarks.micro [--filter 名称 ...] [--output result.json] [--compare benchmarks/micro/baseline.json]
+
+每个用例记录每次调用的耗时(微秒), 取 repeat 轮中最快的一轮(min_us)和中位数(median_us), 比较时使用 min_us.
+用例和基线的说明见 README.md
+"""
+import datetime
+import os
+import platform
+import subprocess
+import timeit
+
+_cases = []
+
+
+def benchmark(name, number):
+    """
+    注册一个用例, 被装饰的函数准备好输入之后 yield 要计时的无参函数, yield 之后的代码用来清理
+
+    @benchmark("utils.natural_sort_key", number=200)
+    def natural_sort_key_case():
+        names = [...]
+        yield lambda: sorted(names, key=natural_sort_key)
+
+    :param number: 每一轮调用的次数, 让每一轮的耗时在 0.1 秒左右
+    """
+    def decorator(func):
+        _cases.append((name, number, func))
+        return func
+
+    return decorator
+
+
+def get_cases(filters=None):
+    return [item for item in _cases if not filters or any(word in item[0] for word in filters)]
+
+
+def run_case(name, number, func, repeat=5):
+    steps = func()
+    target = next(steps)
+    try:
+        # 预热, 排除首次调用时的导入, 正则编译等开销
+        target()
+        timings = sorted(timeit.repeat(target, number=number, repeat=repeat))
+    finally:
+        next(steps, None)
+    return {"number": number, "repeat": repeat,
+            "min_us": round(timings[0] / number * 1e6, 2),
+            "median_us": round(timings[len(timings) // 2] / number * 1e6, 2)}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def environment():
+    import django
+    return {"python": f"{platform.python_implementation()} {platform.python_version()}",
+            "django": django.get_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "commit": _git_commit(),
+            "time": datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0).isoformat()}
+
+
+def run(filters=None, repeat=5):
+    return {"environment": environment(),
+            "results": {name: run_case(name, number, func, repeat) for name, number, func in get_cases(filters)}}
+
+
+def compare(result, baseline):
+    """
+    :return: [(name, 基线的 min_us, 当前的 min_us, 当前 / 基线)], 基线中没有的用例比值为 None
+    """
+    rows = []
+    for name, item in result["results"].items():
+        base = baseline["results"].get(name)
+        base_us = base["min_us"] if base else None
+        rows.append((name, base_us, item["min_us"], item["min_us"] / base_us if base_us else None))
+    return rows
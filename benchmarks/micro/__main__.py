@@ -0,0 +1,51 @@
+import argparse
+import json
+import os
+import sys
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "oj.settings")
+django.setup()
+
+from . import compare, get_cases, run  # noqa: E402
+from . import cases  # noqa: E402, F401
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.micro", description="backend micro benchmarks")
+    parser.add_argument("--filter", nargs="*", help="只运行名称中包含这些字符串的用例")
+    parser.add_argument("--repeat", type=int, default=5, help="每个用例运行的轮数")
+    parser.add_argument("--output", help="把结果写入这个 json 文件")
+    parser.add_argument("--compare", help="和这个 json 文件中的结果比较")
+    parser.add_argument("--list", action="store_true", help="只列出用例")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, number, _ in get_cases(args.filter):
+            print(name)
+        return
+
+    result = run(args.filter, args.repeat)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"{'case':<36} {'baseline us':>14} {'current us':>14} {'ratio':>8}")
+        for name, base_us, current_us, ratio in compare(result, baseline):
+            print(f"{name:<36} {base_us if base_us is not None else '-':>14} {current_us:>14} "
+                  f"{f'{ratio:.2f}' if ratio is not None else '-':>8}")
+    elif not args.output:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        for name, item in result["results"].items():
+            print(f"{name:<36} {item['min_us']:>14} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+用例和输入数据的生成, 所有的数据都由固定的随机种子生成, 大小和线上常见的数据相近
+"""
+import base64
+import io
+import os
+import random
+import tempfile
+import zipfile
+
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from account.models import AdminType, User
+from contest.models import ACMContestRank
+from contest.serializers import ACMContestRankSerializer
+from fps.parser import FPSParser
+from judge.dispatcher import check_java_code
+from problem.models import Problem
+from problem.utils import TEMPLATE_BASE, parse_problem_template
+from problem.views.admin import TestCaseZipProcessor
+from submission.models import JudgeStatus, Submission
+from submission.serializers import SubmissionListSerializer
+from utils import models as rich_text
+from utils.shortcuts import natural_sort_key, time_ordered_id
+from utils.xss_filter import XSSHtml
+
+from . import benchmark
+
+_words = ["array", "integer", "query", "graph", "vertex", "edge", "modulo", "subsequence", "給定", "一個", "長度",
+          "為", "的", "序列", "請", "輸出", "最小", "答案", "每組", "測資"]
+
+
+def _sentence(rand, length=20):
+    return " ".join(rand.choice(_words) for _ in range(length))
+
+
+def problem_statement(rand, paragraphs=40):
+    """
+    富文本编辑器生成的题目描述, 包括段落, 公式, 表格, 代码, 图片和链接, 以及少量需要被过滤的标签和属性.
+    paragraphs=40 时大约 12KB
+    """
+    parts = []
+    for index in range(paragraphs):
+        kind = index % 8
+        if kind == 0:
+            parts.append(f"<h3>{_sentence(rand, 3)}</h3>")
+        elif kind == 1:
+            parts.append(f'<p>{_sentence(rand)} <span class="math-tex">\\(1 \\le N \\le 10^{rand.randint(3, 9)}\\)</span> '
+                         f"<strong>{_sentence(rand, 3)}</strong> <code>a[i]</code> {_sentence(rand)}</p>")
+        elif kind == 2:
+            rows = "".join(f"<tr><td>{rand.randint(1, 100)}</td><td>{rand.randint(1, 10 ** 9)}</td>"
+                           f'<td style="text-align: center;">{_sentence(rand, 2)}</td></tr>' for _ in range(6))
+            parts.append(f'<table border="1" cellpadding="2"><thead><tr><th>#</th><th>N</th><th>說明</th></tr></thead>'
+                         f"<tbody>{rows}</tbody></table>")
+        elif kind == 3:
+            code = "\n".join(f"for (int i = 0; i &lt; n; i++) ans += a[i] * {rand.randint(1, 9)};" for _ in range(8))
+            parts.append(f'<pre class="language-cpp"><code>{code}</code></pre>')
+        elif kind == 4:
+            parts.append(f'<p><img src="/public/upload/{rand.getrandbits(64):016x}.png" width="{rand.randint(100, 600)}" '
+                         f'alt="figure" style="max-width: 100%;" /></p>')
+        elif kind == 5:
+            parts.append(f"<ul><li>{_sentence(rand, 8)}</li><li>{_sentence(rand, 8)}</li>"
+                         f'<li><a href="https://oj.example.com/problem/{index}" target="_blank">{_sentence(rand, 2)}</a></li></ul>')
+        elif kind == 6:
+            # 编辑器中粘贴的内容可能带有需要过滤的标签和属性
+            parts.append(f'<div onclick="alert(1)" data-id="{index}"><font color="red">{_sentence(rand, 6)}</font>'
+                         f'<script>alert({index})</script><iframe src="https://example.com"></iframe></div>')
+        else:
+            parts.append(f"<p>{_sentence(rand, 40)}&nbsp;&lt;&gt;&#39;<br/>{_sentence(rand, 10)}</p>")
+    return "\n".join(parts)
+
+
+def java_code(rand, methods=30):
+    """
+    大约 250 行的 Java 程序, import 和用到的完整限定类名都属于 java.util 和 java.io
+    """
+    lines = ["import java.util.*;", "import java.io.BufferedReader;", "import java.io.InputStreamReader;", "",
+             "/* 解题思路: 使用 java.util.PriorityQueue 维护 */", "public class Main {"]
+    for index in range(methods):
+        lines.extend([f"    // 第 {index} 个辅助函数, 使用 java.util.ArrayList",
+                      f"    static long solve{index}(int[] a, int n) {{",
+                      "        java.util.List<Integer> list = new java.util.ArrayList<>();",
+                      "        Map<Integer, Long> cnt = new HashMap<>();",
+                      f"        long ans = {rand.randint(0, 100)};",
+                      f"        for (int i = 0; i < n; i++) {{ ans += (long) a[i] * {rand.randint(1, 9)}; list.add(a[i]); }}",
+                      "        return ans % 1000000007L;",
+                      "    }"])
+    lines.extend(["    public static void main(String[] args) throws Exception {",
+                  "        BufferedReader br = new BufferedReader(new InputStreamReader(System.in));",
+                  "        int n = Integer.parseInt(br.readLine().trim());",
+                  "        StringTokenizer st = new StringTokenizer(br.readLine());",
+                  "        int[] a = new int[n];",
+                  "        for (int i = 0; i < n; i++) a[i] = Integer.parseInt(st.nextToken());",
+                  "        System.out.println(solve0(a, n));",
+                  "    }", "}"])
+    return "\n".join(lines)
+
+
+def _strip_imports(code):
+    return "\n".join(line.replace("java.util.", "").replace("java.io.", "") for line in code.split("\n")
+                     if not line.startswith("import"))
+
+
+@benchmark("problem.parse_problem_template", number=2000)
+def parse_problem_template_case():
+    rand = random.Random(0)
+    prepend = "\n".join(f"#include <{name}>" for name in ("bits/stdc++.h", "vector", "string", "map", "set")) + \
+        "\nusing namespace std;\n" + "\n".join(f"const int MAXN{i} = {rand.randint(1, 10 ** 6)};" for i in range(20))
+    template = "\n".join(f"// TODO: {_sentence(rand, 6)}" for _ in range(20)) + "\nint solve(vector<int>& a) {\n}\n"
+    append = "int main() {\n" + "\n".join(f"    // {_sentence(rand, 5)}" for _ in range(20)) + "\n    return 0;\n}"
+    template_str = TEMPLATE_BASE.format(prepend, template, append)
+    # parse_problem_template 带有 lru_cache, 这里测量未命中缓存时的解析
+    yield lambda: parse_problem_template.__wrapped__(template_str)
+
+
+@benchmark("utils.xss_clean", number=20)
+def xss_clean_case():
+    content = problem_statement(random.Random(0))
+
+    def clean():
+        with XSSHtml() as parser:
+            parser.clean(content)
+
+    yield clean
+
+
+@benchmark("utils.rich_text_prep", number=5)
+def rich_text_prep_case():
+    # 大约 60KB 的题目描述, 第一次保存, 没有命中缓存
+    content = problem_statement(random.Random(0), 200)
+    field = Problem._meta.get_field("description")
+
+    def prep():
+        rich_text._sanitized.clear()
+        field.get_prep_value(content)
+
+    yield prep
+
+
+@benchmark("utils.rich_text_prep_memoized", number=500)
+def rich_text_prep_memoized_case():
+    # 内容相同的另一次保存, 例如批量导入中重复的内容
+    content = problem_statement(random.Random(0), 200)
+    field = Problem._meta.get_field("description")
+    yield lambda: field.get_prep_value(content)
+
+
+@benchmark("utils.rich_text_prep_unchanged", number=500)
+def rich_text_prep_unchanged_case():
+    # 从数据库中读出之后没有修改, 再次保存
+    field = Problem._meta.get_field("description")
+    content = field.from_db_value(problem_statement(random.Random(0), 200), None, None)
+    yield lambda: field.get_prep_value(content)
+
+
+@benchmark("judge.check_java_code", number=50)
+def check_java_code_case():
+    code = java_code(random.Random(0))
+    allowed_imports = ["java.util.*", "java.io.BufferedReader", "java.io.InputStreamReader"]
+    yield lambda: check_java_code(code, True, allowed_imports)
+
+
+@benchmark("judge.check_java_code_disabled", number=100)
+def check_java_code_disabled_case():
+    # 没有 spj_code 配置时不允许任何 import, 不使用标准库的代码需要扫描全部内容
+    code = _strip_imports(java_code(random.Random(0)))
+    yield lambda: check_java_code(code, False, None)
+
+
+@benchmark("submission.list_page", number=50)
+def submission_list_page_case():
+    # SubmissionListAPI 带 problem_id 时排名已经在 SQL 中完成, 这里测量一页结果的序列化和排名的赋值
+    rand = random.Random(0)
+    author = User(id=1, username="author", admin_type=AdminType.ADMIN)
+    viewer = User(id=2, username="viewer", admin_type=AdminType.REGULAR_USER)
+    problem = Problem(id=1, _id="A001", created_by=author, share_submission=False)
+    submissions = []
+    for index in range(50):
+        result = rand.choice([JudgeStatus.ACCEPTED] * 6 + [JudgeStatus.WRONG_ANSWER, JudgeStatus.COMPILE_ERROR])
+        submission = Submission(id=time_ordered_id(), problem=problem, user_id=index + 3, username=f"user{index}",
+                                result=result, language=rand.choice(["C", "C++", "Java", "Python3"]),
+                                statistic_info={"time_cost": rand.randint(0, 1000),
+                                                "memory_cost": rand.randint(1, 256) << 20},
+                                create_time=timezone.now())
+        submission.rank = index + 1
+        submissions.append(submission)
+
+    def page():
+        results = SubmissionListSerializer(submissions, many=True, user=viewer).data
+        for item, submission in zip(results, submissions):
+            item["rank"] = submission.rank
+
+    yield page
+
+
+@benchmark("contest.acm_rank_serializer", number=5)
+def acm_rank_serializer_case():
+    # 比赛排名的一页, 250 人, 12 道题
+    rand = random.Random(0)
+    ranks = []
+    for index in range(250):
+        info = {}
+        for problem_id in range(1, 13):
+            if rand.random() < 0.3:
+                continue
+            is_ac = rand.random() < 0.6
+            info[str(problem_id)] = {"is_ac": is_ac, "ac_time": rand.randint(0, 18000) if is_ac else 0,
+                                     "error_number": rand.randint(0, 5), "is_first_ac": False}
+        accepted = sum(item["is_ac"] for item in info.values())
+        ranks.append(ACMContestRank(id=index + 1, user=User(id=index + 1, username=f"user{index}"), contest_id=1,
+                                    submission_number=len(info) + accepted, accepted_number=accepted,
+                                    total_time=rand.randint(0, 100000), submission_info=info))
+    yield lambda: ACMContestRankSerializer(ranks, many=True).data
+
+
+@benchmark("utils.natural_sort_key", number=100)
+def natural_sort_key_case():
+    # 200 组测试数据的文件名
+    names = [f"{index}.{ext}" for index in range(1, 201) for ext in ("in", "out")]
+    random.Random(0).shuffle(names)
+    yield lambda: sorted(names, key=natural_sort_key)
+
+
+@benchmark("problem.process_zip", number=5)
+def process_zip_case():
+    # 50 组测试数据, 每个文件 16KB, Windows 换行
+    rand = random.Random(0)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        for index in range(1, 51):
+            for ext in ("in", "out"):
+                line = " ".join(str(rand.randint(0, 10 ** 9)) for _ in range(20)) + "\r\n"
+                zip_file.writestr(f"{index}.{ext}", line * (16384 // len(line)))
+    processor = TestCaseZipProcessor()
+    with tempfile.TemporaryDirectory() as test_case_dir, override_settings(TEST_CASE_DIR=test_case_dir):
+        yield lambda: processor.process_zip(buffer, spj=False)
+
+
+@benchmark("fps.parse", number=20)
+def fps_parse_case():
+    # 10 道题, 每道题 10 组 8KB 的测试数据和一张图片
+    rand = random.Random(0)
+    image = base64.b64encode(bytes(rand.getrandbits(8) for _ in range(4096))).decode("ascii")
+    items = []
+    for index in range(10):
+        test_cases = "".join(f"<test_input><![CDATA[{' '.join(str(rand.randint(0, 10 ** 6)) for _ in range(1000))}]]>"
+                             f"</test_input><test_output><![CDATA[{rand.randint(0, 10 ** 9)}]]></test_output>"
+                             for _ in range(10))
+        items.append(f"<item><title><![CDATA[Problem {index}]]></title>"
+                     f'<time_limit unit="s"><![CDATA[1]]></time_limit>'
+                     f'<memory_limit unit="mb"><![CDATA[256]]></memory_limit>'
+                     f"<description><![CDATA[{problem_statement(rand, 8)}]]></description>"
+                     f"<input><![CDATA[<p>{_sentence(rand)}</p>]]></input>"
+                     f"<output><![CDATA[<p>{_sentence(rand)}</p>]]></output>"
+                     f"<sample_input><![CDATA[3\n1 2 3]]></sample_input><sample_output><![CDATA[6]]></sample_output>"
+                     f"{test_cases}<hint><![CDATA[]]></hint><source><![CDATA[NCHU]]></source>"
+                     f"<img><src><![CDATA[/upload/{index}.png]]></src><base64><![CDATA[{image}]]></base64></img>"
+                     f'<solution language="C++"><![CDATA[int main() {{ return 0; }}]]></solution></item>')
+    fd, path = tempfile.mkstemp(suffix=".xml")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?><fps version="1.2"><generator name="HUSTOJ"/>')
+        f.write("".join(items))
+        f.write("</fps>")
+    try:
+        yield lambda: FPSParser(path).parse()
+    finally:
+        os.remove(path)
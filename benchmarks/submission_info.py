@@ -0,0 +1,60 @@
+"""
+比较判题详情以 json 保存和按列编码(submission.encoding)保存时的大小与编解码耗时
+
+    python -m benchmarks.submission_info
+"""
+import json
+import random
+import timeit
+
+from submission.encoding import decode_info, encode_info
+
+TEST_CASE_COUNTS = (10, 50, 200)
+
+
+def judge_info(count, seed=0):
+    """
+    生成和 JudgeServer 返回格式相同的判题结果, 大部分测试点通过, 少数超时或答案错误
+    """
+    rand = random.Random(seed)
+    data = []
+    for index in range(count):
+        result = rand.choice([0] * 8 + [-1, 1])
+        cpu_time = rand.randint(0, 1000)
+        data.append({"cpu_time": cpu_time, "real_time": cpu_time + rand.randint(0, 50),
+                     "memory": rand.randint(1, 256) * 1024 * 1024, "signal": 0, "exit_code": 0, "error": 0,
+                     "result": result, "test_case": str(index + 1),
+                     "output_md5": "%032x" % rand.getrandbits(128), "output": None})
+    return {"err": None, "data": data}
+
+
+def _per_call_us(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def run(counts=TEST_CASE_COUNTS, number=200):
+    results = []
+    for count in counts:
+        info = judge_info(count)
+        text = json.dumps(info)
+        blob = encode_info(info)
+        results.append({"test_cases": count,
+                        "json_bytes": len(text.encode("utf-8")),
+                        "encoded_bytes": len(blob),
+                        "json_dump_us": _per_call_us(lambda: json.dumps(info), number),
+                        "encode_us": _per_call_us(lambda: encode_info(info), number),
+                        "json_load_us": _per_call_us(lambda: json.loads(text), number),
+                        "decode_us": _per_call_us(lambda: decode_info(blob), number)})
+    return results
+
+
+def main():
+    columns = ["test_cases", "json_bytes", "encoded_bytes", "json_dump_us", "encode_us", "json_load_us", "decode_us"]
+    print(" ".join(f"{column:>14}" for column in columns))
+    for row in run():
+        print(" ".join(f"{row[column]:>14.1f}" if isinstance(row[column], float) else f"{row[column]:>14}"
+                       for column in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+比较提交 id 使用 rand_str() 和 time_ordered_id() 时的插入吞吐量与主键索引大小
+
+    python -m benchmarks.submission_insert
+
+需要能连上 oj.settings 中配置的数据库, 只使用临时表, 不会改动已有数据
+"""
+import os
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "oj.settings")
+django.setup()
+
+from django.db import connection, transaction  # noqa: E402
+
+from utils.shortcuts import rand_str, time_ordered_id  # noqa: E402
+
+ROW_COUNTS = (20000, 100000)
+BATCH_SIZE = 1000
+# 和 submission 表宽度相近的一行
+PAYLOAD = "x" * 200
+
+
+def _insert(table, generator, count):
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"CREATE TEMP TABLE {table} (id text PRIMARY KEY, payload text) ON COMMIT DROP")
+        start = time.perf_counter()
+        for offset in range(0, count, BATCH_SIZE):
+            rows = [(generator(), PAYLOAD) for _ in range(min(BATCH_SIZE, count - offset))]
+            cursor.executemany(f"INSERT INTO {table} (id, payload) VALUES (%s, %s)", rows)
+        elapsed = time.perf_counter() - start
+        cursor.execute(f"SELECT pg_relation_size('{table}_pkey')")
+        index_bytes = cursor.fetchone()[0]
+    return elapsed, index_bytes
+
+
+def run(counts=ROW_COUNTS):
+    results = []
+    for count in counts:
+        for name, generator in (("rand_str", rand_str), ("time_ordered_id", time_ordered_id)):
+            elapsed, index_bytes = _insert(f"bench_{name}", generator, count)
+            results.append({"rows": count, "id": name,
+                            "rows_per_s": count / elapsed,
+                            "index_kb": index_bytes / 1024})
+    return results
+
+
+def main():
+    columns = ["rows", "id", "rows_per_s", "index_kb"]
+    print(" ".join(f"{column:>16}" for column in columns))
+    for row in run():
+        print(" ".join(f"{row[column]:>16.1f}" if isinstance(row[column], float) else f"{row[column]:>16}"
+                       for column in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,13 @@ import hashlib
 from unittest import mock
 
 from django.conf import settings
+from django.test import override_settings
 from django.utils import timezone
 
 from options.options import SysOptions
+from utils import middleware
 from utils.api.tests import APITestCase
+from utils.middleware import reset_request_stats
 from .models import JudgeServer
 
 
@@ -183,3 +186,29 @@ class DashboardInfoAPITest(APITestCase):
         resp = self.client.get(self.url)
         self.assertSuccess(resp)
         self.assertEqual(resp.data["data"]["user_count"], 1)
+
+
+@override_settings(INSTRUMENTATION={"sample_rate": 1, "slow_request_ms": 0, "server_timing": True,
+                                    "flush_interval": 0})
+class RequestStatsAPITest(APITestCase):
+    def setUp(self):
+        self.url = self.reverse("request_stats_api")
+        self.create_super_admin()
+        middleware._request_stats.data.clear()
+        reset_request_stats()
+
+    def test_request_stats(self):
+        with self.assertLogs("utils.middleware", level="WARNING") as logs:
+            resp = self.client.get(self.reverse("dashboard_info_api"))
+        self.assertIn("Slow request GET /api/admin/dashboard_info", logs.output[0])
+        self.assertRegex(resp["Server-Timing"], r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", redis;desc="\d+ calls"$')
+
+        resp = self.client.get(self.url)
+        self.assertSuccess(resp)
+        stats = {item["endpoint"]: item for item in resp.data["data"]}
+        item = stats["GET dashboard_info_api"]
+        self.assertEqual((item["count"], item["sampled"], item["slow"]), (1, 1, 1))
+        self.assertGreater(item["avg_sql"], 0)
+
+        self.assertSuccess(self.client.delete(self.url))
+        self.assertNotIn("GET dashboard_info_api", {item["endpoint"] for item in self.client.get(self.url).data["data"]})
@@ -1,7 +1,7 @@
 from django.conf.urls import url
 
 from ..views import SMTPAPI, JudgeServerAPI, WebsiteConfigAPI, TestCasePruneAPI, SMTPTestAPI
-from ..views import ReleaseNotesAPI, DashboardInfoAPI
+from ..views import ReleaseNotesAPI, DashboardInfoAPI, RequestStatsAPI
 
 urlpatterns = [
     url(r"^smtp/?$", SMTPAPI.as_view(), name="smtp_admin_api"),
@@ -11,4 +11,5 @@ urlpatterns = [
     url(r"^prune_test_case/?$", TestCasePruneAPI.as_view(), name="prune_test_case_api"),
     url(r"^versions/?$", ReleaseNotesAPI.as_view(), name="get_release_notes_api"),
     url(r"^dashboard_info", DashboardInfoAPI.as_view(), name="dashboard_info_api"),
+    url(r"^request_stats/?$", RequestStatsAPI.as_view(), name="request_stats_api"),
 ]
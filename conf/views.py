@@ -21,6 +21,7 @@ from options.options import SysOptions
 from problem.models import Problem
 from submission.models import Submission
 from utils.api import APIView, CSRFExemptAPIView, validate_serializer
+from utils.middleware import get_request_stats, reset_request_stats
 from utils.shortcuts import send_email, get_env
 from utils.xss_filter import XSSHtml
 from .models import JudgeServer
@@ -33,7 +34,7 @@ from .serializers import (CreateEditWebsiteConfigSerializer,
 class SMTPAPI(APIView):
     @super_admin_required
     def get(self, request):
-        smtp = SysOptions.smtp_config
+        smtp = dict(SysOptions.smtp_config)
         if not smtp:
             return self.success(None)
         smtp.pop("password")
@@ -48,7 +49,7 @@ class SMTPAPI(APIView):
     @super_admin_required
     @validate_serializer(EditSMTPConfigSerializer)
     def put(self, request):
-        smtp = SysOptions.smtp_config
+        smtp = dict(SysOptions.smtp_config)
         data = request.data
         for item in ["server", "port", "email", "tls"]:
             smtp[item] = data[item]
@@ -239,3 +240,17 @@ class DashboardInfoAPI(APIView):
                 "STATIC_CDN_HOST": get_env("STATIC_CDN_HOST", default="")
             }
         })
+
+
+class RequestStatsAPI(APIView):
+    @super_admin_required
+    def get(self, request):
+        """
+        每个接口的请求数, 平均耗时, SQL 和 redis 的次数, 所有进程最多延迟 flush_interval 秒汇总
+        """
+        return self.success(get_request_stats())
+
+    @super_admin_required
+    def delete(self, request):
+        reset_request_stats()
+        return self.success()
@@ -0,0 +1,109 @@
+"""
+比赛的事件流, 用于推送排名变化和新的公告, 客户端在本地维护排名而不是定时重新获取整页排名
+
+事件保存在每个比赛的 redis stream 中, 客户端记下最后一个事件的 id, 用长轮询读取之后的事件.
+第一次请求时不带 last_id, 只返回当前最新的 id, 客户端随后再获取一次完整的排名和公告列表.
+事件太旧已经被裁剪掉时返回 reset, 客户端应当重新获取完整的数据
+"""
+import json
+import logging
+
+from django.db.models import Q
+from redis.exceptions import ResponseError
+
+from account.models import AdminType
+from utils.cache import cache
+from utils.constants import CacheKey, ContestRuleType
+from utils.long_poll import LongPollSlot
+from .utils import get_contest_rank
+
+logger = logging.getLogger(__name__)
+
+# 每个比赛保留的事件数
+MAX_EVENTS = 1000
+# 比赛没有新事件一段时间之后删除事件流
+EVENTS_TIMEOUT = 60 * 60 * 24
+
+
+class ContestEventType:
+    RANK = "rank"
+    ANNOUNCEMENT = "announcement"
+
+
+def _stream(contest_id):
+    return f"{CacheKey.contest_events}:{contest_id}"
+
+
+def _parse_id(event_id):
+    return tuple(int(item) for item in event_id.split("-"))
+
+
+def publish_contest_event(contest_id, event):
+    try:
+        pipe = cache.pipeline()
+        pipe.xadd(_stream(contest_id), {"data": json.dumps(event)}, maxlen=MAX_EVENTS, approximate=False)
+        pipe.expire(_stream(contest_id), EVENTS_TIMEOUT)
+        pipe.execute()
+    except Exception as e:
+        # 推送失败不影响判题和发布公告, 客户端还可以重新获取
+        logger.exception(e)
+
+
+def latest_event_id(contest_id):
+    try:
+        return cache.xinfo_stream(_stream(contest_id))["last-generated-id"].decode("utf-8")
+    except ResponseError:
+        # 还没有任何事件
+        return "0-0"
+
+
+def read_contest_events(contest_id, last_id, timeout):
+    """
+    读取 last_id 之后的事件, 没有新事件时最多等待 timeout 秒
+    :return: (事件列表, 最后一个事件的 id, 是否需要重新获取完整数据, 是否等待过)
+    """
+    key = _stream(contest_id)
+    first = cache.xrange(key, count=1)
+    if first and _parse_id(first[0][0].decode("utf-8")) > _parse_id(last_id) and cache.xlen(key) >= MAX_EVENTS:
+        return [], latest_event_id(contest_id), True, False
+
+    slot = LongPollSlot()
+    try:
+        waited = timeout > 0 and slot.acquire()
+        result = cache.xread({key: last_id}, count=MAX_EVENTS, block=int(timeout * 1000) if waited else None)
+    finally:
+        slot.release()
+    events = []
+    for _, messages in result:
+        for event_id, fields in messages:
+            last_id = event_id.decode("utf-8")
+            event = json.loads(fields[b"data"])
+            event["id"] = last_id
+            events.append(event)
+    return events, last_id, False, waited
+
+
+def publish_rank_event(contest, rank, problem_id, username):
+    """
+    排名变化的事件, 包括用户新的名次和这道题对应的单元格
+    """
+    # 管理员和被禁用的用户不在排名中, 不推送
+    if rank.user.admin_type != AdminType.REGULAR_USER or rank.user.is_disabled:
+        return
+    # 和 get_contest_rank 的排序一致, 排在前面的人数
+    if contest.rule_type == ContestRuleType.ACM:
+        better = Q(accepted_number__gt=rank.accepted_number) | \
+            Q(accepted_number=rank.accepted_number, total_time__lt=rank.total_time) | \
+            Q(accepted_number=rank.accepted_number, total_time=rank.total_time, id__lt=rank.id)
+        scores = {"accepted_number": rank.accepted_number, "total_time": rank.total_time}
+    else:
+        better = Q(total_score__gt=rank.total_score) | Q(total_score=rank.total_score, id__lt=rank.id)
+        scores = {"total_score": rank.total_score}
+    problem_id = str(problem_id)
+    publish_contest_event(contest.id, {"type": ContestEventType.RANK,
+                                       "user": {"id": rank.user_id, "username": username},
+                                       "position": get_contest_rank(contest).filter(better).count() + 1,
+                                       "submission_number": rank.submission_number,
+                                       **scores,
+                                       "problem_id": problem_id,
+                                       "cell": rank.submission_info.get(problem_id)})
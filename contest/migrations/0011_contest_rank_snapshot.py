@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-19 04:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contest', '0010_auto_20190326_0201'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contest',
+            name='rank_freeze_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ContestRankSnapshot',
+            fields=[
+                ('contest', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rank_snapshot', serialize=False, to='contest.contest')),
+                ('rows', models.JSONField(default=list)),
+                ('revealed', models.BooleanField(default=False)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('last_update_time', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'contest_rank_snapshot',
+            },
+        ),
+    ]
@@ -13,6 +13,8 @@ class Contest(models.Model):
     description = RichTextField()
     # show real time rank or cached rank
     real_time_rank = models.BooleanField()
+    # 不显示实时排名时, 从这个时间开始普通用户看到的是封榜时的排名快照
+    rank_freeze_time = models.DateTimeField(null=True, blank=True)
     password = models.TextField(null=True)
     # enum of ContestRuleType
     rule_type = models.TextField()
@@ -43,6 +45,15 @@ class Contest(models.Model):
             return ContestType.PASSWORD_PROTECTED_CONTEST
         return ContestType.PUBLIC_CONTEST
 
+    @property
+    def rank_frozen(self):
+        if self.real_time_rank:
+            return False
+        if self.rank_freeze_time is None:
+            # 没有设置封榜时间的 ACM 比赛从一开始就不公开实时排名, OI 比赛结束前普通用户看不到排名, 结束后显示最终排名
+            return self.rule_type == ContestRuleType.ACM
+        return self.rank_freeze_time <= now()
+
     # 是否有权查看problem 的一些统计信息 诸如submission_number, accepted_number 等
     def problem_details_permission(self, user):
         return self.rule_type == ContestRuleType.ACM or \
@@ -88,6 +99,21 @@ class OIContestRank(AbstractContestRank):
         unique_together = (("user", "contest"),)
 
 
+class ContestRankSnapshot(models.Model):
+    """
+    封榜时的排名快照, 只写入一次, 揭晓排名时整体替换为最终排名
+    """
+    contest = models.OneToOneField(Contest, on_delete=models.CASCADE, primary_key=True, related_name="rank_snapshot")
+    # 对普通用户序列化之后的排名, 按名次排列
+    rows = JSONField(default=list)
+    revealed = models.BooleanField(default=False)
+    create_time = models.DateTimeField(auto_now_add=True)
+    last_update_time = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "contest_rank_snapshot"
+
+
 class ContestAnnouncement(models.Model):
     contest = models.ForeignKey(Contest, on_delete=models.CASCADE)
     title = models.TextField()
@@ -13,6 +13,7 @@ class CreateConetestSeriaizer(serializers.Serializer):
     password = serializers.CharField(allow_blank=True, max_length=32)
     visible = serializers.BooleanField()
     real_time_rank = serializers.BooleanField()
+    rank_freeze_time = serializers.DateTimeField(required=False, allow_null=True)
     allowed_ip_ranges = serializers.ListField(child=serializers.CharField(max_length=32), allow_empty=True)
 
 
@@ -25,6 +26,7 @@ class EditConetestSeriaizer(serializers.Serializer):
     password = serializers.CharField(allow_blank=True, allow_null=True, max_length=32)
     visible = serializers.BooleanField()
     real_time_rank = serializers.BooleanField()
+    rank_freeze_time = serializers.DateTimeField(required=False, allow_null=True)
     allowed_ip_ranges = serializers.ListField(child=serializers.CharField(max_length=32))
 
 
@@ -66,6 +68,10 @@ class EditContestAnnouncementSerializer(serializers.Serializer):
     visible = serializers.BooleanField(required=False)
 
 
+class ContestRankRevealSerializer(serializers.Serializer):
+    contest_id = serializers.IntegerField()
+
+
 class ContestPasswordVerifySerializer(serializers.Serializer):
     contest_id = serializers.IntegerField()
     password = serializers.CharField(max_length=30, required=True)
@@ -0,0 +1,43 @@
+import logging
+
+import dramatiq
+
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.shortcuts import DRAMATIQ_WORKER_ARGS
+from utils.tasks import delete_files
+from .models import Contest
+from .utils import export_contest_rank
+
+logger = logging.getLogger(__name__)
+
+# 导出的文件和下载凭证的有效期(秒)
+RANK_EXPORT_TIMEOUT = 60 * 60
+
+
+class RankExportStatus:
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+
+
+def rank_export_path(token, file_format):
+    return f"/tmp/contest-rank-{token}.{file_format}"
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def contest_rank_export_task(token, contest_id, file_format, is_contest_admin):
+    key = f"{CacheKey.contest_rank_export}:{token}"
+    state = cache.get(key)
+    if not state:
+        return
+    path = rank_export_path(token, file_format)
+    try:
+        export_contest_rank(Contest.objects.get(id=contest_id), path, file_format, is_contest_admin)
+        state["status"] = RankExportStatus.DONE
+    except Exception as e:
+        logger.exception(e)
+        state["status"] = RankExportStatus.FAILED
+    cache.set(key, state, timeout=RANK_EXPORT_TIMEOUT)
+    if state["status"] == RankExportStatus.DONE:
+        delete_files.send_with_options(args=(path,), delay=RANK_EXPORT_TIMEOUT * 1000)
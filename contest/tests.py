@@ -1,11 +1,28 @@
 import copy
+import csv
+import gzip
+import io
+import json
 from datetime import datetime, timedelta
+from unittest import mock
 
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
+from judge.dispatcher import JudgeDispatcher
+from problem.models import Problem
+from submission.models import JudgeStatus, Submission
 from utils.api.tests import APITestCase
+from utils.cache import cache
+from utils.long_poll import LongPollSlot
+from utils.middleware import JSONCompressionMiddleware
 
-from .models import ContestAnnouncement, ContestRuleType, Contest
+from .events import publish_rank_event
+from .models import ACMContestRank, ContestAnnouncement, ContestRankSnapshot, ContestRuleType, Contest
+from .tasks import contest_rank_export_task
+from .utils import bump_rank_version
 
 DEFAULT_CONTEST_DATA = {"title": "test title", "description": "test description",
                         "start_time": timezone.localtime(timezone.now()),
@@ -160,3 +177,265 @@ class ContestRankAPITest(APITestCase):
     def get_contest_rank(self):
         resp = self.client.get(self.url + "?contest_id=" + self.acm_contest.id)
         self.assertSuccess(resp)
+
+
+class ContestRankPrepare(APITestCase):
+    def setUp(self):
+        self.admin = self.create_admin()
+        data = copy.deepcopy(DEFAULT_CONTEST_DATA)
+        data["password"] = None
+        self.contest = Contest.objects.create(created_by=self.admin, **data)
+        # 测试数据库每次重建, 比赛 id 会重复, 清掉之前留在 redis 中的缓存
+        cache.delete_pattern(f"contest_rank_*:{self.contest.id}*")
+        self.ranks = []
+        for index in range(3):
+            user = self.create_user(f"user{index}", "test123", login=False)
+            self.ranks.append(ACMContestRank.objects.create(user=user, contest=self.contest, accepted_number=index))
+        self.url = self.reverse("contest_rank_api")
+
+    def get_usernames(self, **params):
+        resp = self.client.get(self.url, data={"contest_id": self.contest.id, **params})
+        self.assertSuccess(resp)
+        return [item["user"]["username"] for item in resp.data["data"]["results"]]
+
+
+class ContestRankCacheTest(ContestRankPrepare):
+    def test_page_cached_until_version_bump(self):
+        self.assertEqual(self.get_usernames(limit=2), ["user2", "user1"])
+        ACMContestRank.objects.filter(id=self.ranks[0].id).update(accepted_number=10)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.get_usernames(limit=2), ["user2", "user1"])
+        self.assertFalse([query for query in context.captured_queries if "acm_contest_rank" in query["sql"]])
+        bump_rank_version(self.contest.id)
+        self.assertEqual(self.get_usernames(limit=2), ["user0", "user2"])
+        self.assertEqual(self.get_usernames(limit=2, offset=2), ["user1"])
+
+    def test_compressed_response(self):
+        with mock.patch.object(JSONCompressionMiddleware, "min_length", 0):
+            resp = self.client.get(self.url, data={"contest_id": self.contest.id}, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(resp["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp["Vary"])
+        data = json.loads(gzip.decompress(resp.content))
+        self.assertEqual([item["user"]["username"] for item in data["data"]["results"]], ["user2", "user1", "user0"])
+
+        # 不支持压缩的客户端得到紧凑格式的 json
+        resp = self.client.get(self.url, data={"contest_id": self.contest.id})
+        self.assertNotIn("Content-Encoding", resp)
+        self.assertNotIn(b"\n", resp.content)
+
+    def test_stale_page_served_while_rebuilding(self):
+        self.assertEqual(self.get_usernames(), ["user2", "user1", "user0"])
+        ACMContestRank.objects.filter(id=self.ranks[0].id).update(accepted_number=10)
+        bump_rank_version(self.contest.id)
+        with mock.patch.object(cache, "add", return_value=False):
+            self.assertEqual(self.get_usernames(), ["user2", "user1", "user0"])
+        self.assertEqual(self.get_usernames(), ["user0", "user2", "user1"])
+
+    def test_force_refresh(self):
+        self.assertEqual(self.get_usernames(), ["user2", "user1", "user0"])
+        ACMContestRank.objects.filter(id=self.ranks[0].id).update(accepted_number=10)
+        self.assertEqual(self.get_usernames(force_refresh="1"), ["user0", "user2", "user1"])
+        self.assertEqual(self.get_usernames(), ["user0", "user2", "user1"])
+
+
+class ContestRankExportTest(ContestRankPrepare):
+    def setUp(self):
+        super().setUp()
+        self.problems = []
+        for index in range(2):
+            self.problems.append(Problem.objects.create(_id=f"P{index}", title=f"problem{index}", contest=self.contest,
+                                                        created_by=self.admin, description="", input_description="",
+                                                        output_description="", samples=[], test_case_id="",
+                                                        test_case_score=[], hint="", languages=["C"], template={},
+                                                        time_limit=1000, memory_limit=256, rule_type="ACM",
+                                                        spj=False, difficulty="Low", source=""))
+        self.ranks[2].submission_info = {str(self.problems[1].id): {"is_ac": True}, "0": {"is_ac": True}}
+        self.ranks[2].save()
+
+    def export(self, **params):
+        with mock.patch("contest.views.oj.contest_rank_export_task.send", side_effect=contest_rank_export_task), \
+                mock.patch("contest.tasks.delete_files"):
+            resp = self.client.get(self.url, data={"contest_id": self.contest.id, "download_csv": "1", **params})
+        self.assertSuccess(resp)
+        return self.client.get(self.reverse("contest_rank_export_api"), data={"token": resp.data["data"]["token"]})
+
+    def test_export_csv(self):
+        resp = self.export(format="csv")
+        rows = list(csv.reader(io.StringIO(b"".join(resp.streaming_content).decode("utf-8-sig"))))
+        self.assertEqual(rows[0], ["User ID", "Username", "Real Name", "AC", "Total Submission", "Total Time",
+                                   "problem0", "problem1"])
+        self.assertEqual([row[1] for row in rows[1:]], ["user2", "user1", "user0"])
+        self.assertEqual(rows[1][6:], ["", "True"])
+
+    def test_export_xlsx(self):
+        resp = self.export()
+        self.assertTrue(b"".join(resp.streaming_content).startswith(b"PK"))
+
+    def test_export_pending(self):
+        with mock.patch("contest.views.oj.contest_rank_export_task.send"):
+            resp = self.client.get(self.url, data={"contest_id": self.contest.id, "download_csv": "1"})
+        url = self.reverse("contest_rank_export_api")
+        token = resp.data["data"]["token"]
+        self.assertEqual(self.client.get(url, data={"token": token}).data["data"], {"status": "pending"})
+        # 下载凭证只有发起导出的用户可以使用
+        self.create_user("other", "other")
+        self.assertFailed(self.client.get(url, data={"token": token}))
+
+
+class ContestRankFreezeTest(ContestRankPrepare):
+    def setUp(self):
+        super().setUp()
+        self.contest.real_time_rank = False
+        self.contest.rank_freeze_time = timezone.now() - timedelta(minutes=1)
+        self.contest.save()
+        self.user = self.create_user("participant", "test123", login=False)
+
+    def login_participant(self):
+        self.client.login(username="participant", password="test123")
+
+    def test_frozen_rank(self):
+        self.login_participant()
+        self.assertEqual(self.get_usernames(), ["user2", "user1", "user0"])
+        ACMContestRank.objects.filter(id=self.ranks[0].id).update(accepted_number=10)
+        bump_rank_version(self.contest.id)
+        self.assertEqual(self.get_usernames(), ["user2", "user1", "user0"])
+        self.assertEqual(self.get_usernames(limit=1, offset=1), ["user1"])
+        # redis 中的快照丢失时从数据库恢复
+        cache.delete(f"contest_rank_snapshot:{self.contest.id}")
+        self.assertEqual(self.get_usernames(), ["user2", "user1", "user0"])
+
+        self.client.login(username="admin", password="admin")
+        self.assertEqual(self.get_usernames(), ["user0", "user2", "user1"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertSuccess(self.client.post(self.reverse("contest_rank_reveal_api"),
+                                                data={"contest_id": self.contest.id}))
+        self.login_participant()
+        self.assertEqual(self.get_usernames(), ["user0", "user2", "user1"])
+
+    def test_not_frozen_before_freeze_time(self):
+        self.contest.rank_freeze_time = timezone.now() + timedelta(minutes=1)
+        self.contest.save()
+        self.login_participant()
+        self.assertEqual(self.get_usernames(), ["user2", "user1", "user0"])
+        self.assertFalse(ContestRankSnapshot.objects.filter(contest=self.contest).exists())
+
+
+class ContestRankNotRealTimeTest(ContestRankPrepare):
+    def setUp(self):
+        super().setUp()
+        self.contest.real_time_rank = False
+        self.contest.save()
+        self.problem = Problem.objects.create(_id="P0", title="problem0", contest=self.contest, created_by=self.admin,
+                                              description="", input_description="", output_description="", samples=[],
+                                              test_case_id="", test_case_score=[], hint="", languages=["C"],
+                                              template={}, time_limit=1000, memory_limit=256, rule_type="ACM",
+                                              spj=False, difficulty="Low", source="")
+        self.user = self.create_user("participant", "test123")
+
+    def judge_accepted(self):
+        submission = Submission.objects.create(problem=self.problem, contest=self.contest, user_id=self.user.id,
+                                               username=self.user.username, code="code", language="C",
+                                               result=JudgeStatus.ACCEPTED, info={}, statistic_info={})
+        dispatcher = JudgeDispatcher(submission.id, self.problem.id)
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            dispatcher.update_contest_problem_status()
+            dispatcher.update_contest_rank()
+
+    def test_rank_not_changed_by_judge(self):
+        self.assertEqual(self.get_usernames(limit=1), ["user2"])
+        self.judge_accepted()
+        self.assertTrue(ACMContestRank.objects.filter(contest=self.contest, user=self.user, accepted_number=1).exists())
+        # 换一个分页参数或者缓存过期都不能看到新的排名
+        self.assertEqual(self.get_usernames(limit=10), ["user2", "user1", "user0"])
+        cache.delete_pattern(f"contest_rank_cache:{self.contest.id}*")
+        self.assertEqual(self.get_usernames(limit=10, offset=1), ["user1", "user0"])
+
+        self.client.login(username="admin", password="admin")
+        self.assertEqual(self.get_usernames(), ["user2", "user1", "participant", "user0"])
+
+    def test_snapshot_dropped_when_real_time_rank_toggled(self):
+        self.assertEqual(self.get_usernames(), ["user2", "user1", "user0"])
+        self.judge_accepted()
+
+        self.client.login(username="admin", password="admin")
+        url = self.reverse("contest_admin_api")
+        data = {"id": self.contest.id, "title": self.contest.title, "description": self.contest.description,
+                "start_time": self.contest.start_time, "end_time": self.contest.end_time, "password": None,
+                "visible": True, "allowed_ip_ranges": []}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertSuccess(self.client.put(url, data={**data, "real_time_rank": True}))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertSuccess(self.client.put(url, data={**data, "real_time_rank": False}))
+        self.client.login(username="participant", password="test123")
+        self.assertEqual(self.get_usernames(), ["user2", "user1", "participant", "user0"])
+
+
+class ContestEventTest(ContestRankPrepare):
+    def setUp(self):
+        super().setUp()
+        cache.delete(f"contest_events:{self.contest.id}")
+        self.url = self.reverse("contest_event_api")
+
+    def get_events(self, last_id, timeout="0"):
+        resp = self.client.get(self.url, data={"contest_id": self.contest.id, "last_id": last_id, "timeout": timeout})
+        self.assertSuccess(resp)
+        return resp.data["data"]
+
+    def test_rank_event(self):
+        resp = self.client.get(self.url, data={"contest_id": self.contest.id})
+        last_id = resp.data["data"]["last_id"]
+        self.assertEqual(self.get_events(last_id)["events"], [])
+
+        rank = self.ranks[0]
+        rank.accepted_number = 5
+        rank.submission_info = {"1": {"is_ac": True, "ac_time": 60, "error_number": 0}}
+        rank.save()
+        publish_rank_event(self.contest, rank, 1, "user0")
+        data = self.get_events(last_id, timeout="1")
+        self.assertEqual(len(data["events"]), 1)
+        event = data["events"][0]
+        self.assertEqual((event["type"], event["position"], event["cell"]), ("rank", 1, rank.submission_info["1"]))
+        self.assertEqual(data["last_id"], event["id"])
+        self.assertEqual(self.get_events(data["last_id"])["events"], [])
+
+        # 不在排名中的用户不推送
+        rank.user.is_disabled = True
+        rank.user.save()
+        publish_rank_event(self.contest, rank, 1, "user0")
+        self.assertEqual(self.get_events(data["last_id"])["events"], [])
+        rank = ACMContestRank.objects.create(user=self.admin, contest=self.contest)
+        publish_rank_event(self.contest, rank, 1, "admin")
+        self.assertEqual(self.get_events(data["last_id"])["events"], [])
+
+    def test_announcement_event(self):
+        last_id = self.client.get(self.url, data={"contest_id": self.contest.id}).data["data"]["last_id"]
+        url = self.reverse("contest_announcement_admin_api")
+        resp = self.client.post(url, data={"contest_id": self.contest.id, "title": "title", "content": "content",
+                                           "visible": True})
+        announcement_id = resp.data["data"]["id"]
+        self.client.put(url, data={"id": announcement_id, "visible": False})
+        events = self.get_events(last_id)["events"]
+        self.assertEqual([event["announcement"]["id"] for event in events], [announcement_id, announcement_id])
+        self.assertEqual(events[0]["announcement"]["title"], "title")
+        # 隐藏的公告不推送内容
+        self.assertEqual(events[1]["announcement"], {"id": announcement_id, "visible": False})
+
+        last_id = events[-1]["id"]
+        self.client.delete(url + f"?id={announcement_id}")
+        events = self.get_events(last_id)["events"]
+        self.assertEqual([event["announcement"] for event in events], [{"id": announcement_id, "deleted": True}])
+
+    def test_long_poll_budget(self):
+        last_id = "0-0"
+        # 名额和提交状态的长轮询共用, 用完时不等待
+        slots = [LongPollSlot() for _ in range(settings.LONG_POLL_MAX_WAITERS)]
+        for slot in slots:
+            self.assertTrue(slot.acquire())
+        try:
+            self.assertFalse(LongPollSlot().acquire())
+            data = self.get_events(last_id, timeout="5")
+            self.assertFalse(data["long_poll"])
+        finally:
+            for slot in slots:
+                slot.release()
+        self.assertTrue(self.get_events(last_id, timeout="0.1")["long_poll"])
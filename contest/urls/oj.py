@@ -3,7 +3,7 @@ from django.conf.urls import url
 from ..views.oj import ContestAnnouncementListAPI
 from ..views.oj import ContestPasswordVerifyAPI, ContestAccessAPI
 from ..views.oj import ContestListAPI, ContestAPI
-from ..views.oj import ContestRankAPI
+from ..views.oj import ContestRankAPI, ContestRankExportAPI, ContestEventAPI
 
 urlpatterns = [
     url(r"^contests/?$", ContestListAPI.as_view(), name="contest_list_api"),
@@ -12,4 +12,6 @@ urlpatterns = [
     url(r"^contest/announcement/?$", ContestAnnouncementListAPI.as_view(), name="contest_announcement_api"),
     url(r"^contest/access/?$", ContestAccessAPI.as_view(), name="contest_access_api"),
     url(r"^contest_rank/?$", ContestRankAPI.as_view(), name="contest_rank_api"),
+    url(r"^contest_rank/export/?$", ContestRankExportAPI.as_view(), name="contest_rank_export_api"),
+    url(r"^contest/events/?$", ContestEventAPI.as_view(), name="contest_event_api"),
 ]
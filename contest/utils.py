@@ -0,0 +1,184 @@
+import csv
+import json
+
+import xlsxwriter
+from django.db import IntegrityError, transaction
+
+from account.models import AdminType
+from problem.models import Problem
+from utils.cache import cache
+from utils.constants import CacheKey, ContestRuleType
+from utils.shortcuts import rand_str
+from .models import ACMContestRank, ContestRankSnapshot, OIContestRank
+from .serializers import ACMContestRankSerializer, OIContestRankSerializer
+
+# 排名页缓存的过期时间, 版本号变化后旧的页面仍然可以在重建期间返回
+RANK_PAGE_TIMEOUT = 60 * 60
+# 重建一页排名的锁, 重建的进程异常退出时锁也会自动过期
+RANK_REBUILD_LOCK_TIMEOUT = 30
+
+
+def get_rank_version(contest_id):
+    return int(cache.get(f"{CacheKey.contest_rank_version}:{contest_id}") or 0)
+
+
+def bump_rank_version(contest_id):
+    """
+    排名发生变化时调用, 已经缓存的排名页全部过时, 但在重建之前仍然会被返回
+    """
+    return cache.redis_incr(f"{CacheKey.contest_rank_version}:{contest_id}")
+
+
+def get_rank_page(contest_id, page_key, build, force_refresh=False):
+    """
+    返回排名页序列化之后的 json 字符串, 缓存按 (比赛, page_key) 保存, page_key 中应包含分页参数和是否为比赛管理员.
+    缓存的版本号落后时, 只有拿到锁的一个请求调用 build() 重建, 其他请求直接返回旧的页面
+    :param build: 返回这一页数据的函数, 结果必须可以 json 序列化
+    """
+    key = f"{CacheKey.contest_rank_cache}:{contest_id}:{page_key}"
+    version = get_rank_version(contest_id)
+    entry = None if force_refresh else cache.get(key)
+    if entry and entry["version"] == version:
+        return entry["data"]
+    lock_key = f"{CacheKey.contest_rank_lock}:{contest_id}:{page_key}"
+    if entry and not cache.add(lock_key, 1, timeout=RANK_REBUILD_LOCK_TIMEOUT):
+        return entry["data"]
+    try:
+        data = json.dumps(build(), separators=(",", ":"))
+        cache.set(key, {"version": version, "data": data}, timeout=RANK_PAGE_TIMEOUT)
+    finally:
+        if entry:
+            cache.delete(lock_key)
+    return data
+
+
+def get_contest_rank(contest):
+    if contest.rule_type == ContestRuleType.ACM:
+        return ACMContestRank.objects.filter(contest=contest,
+                                             user__admin_type=AdminType.REGULAR_USER,
+                                             user__is_disabled=False). \
+            select_related("user").order_by("-accepted_number", "total_time", "id")
+    else:
+        return OIContestRank.objects.filter(contest=contest,
+                                            user__admin_type=AdminType.REGULAR_USER,
+                                            user__is_disabled=False). \
+            select_related("user").order_by("-total_score", "id")
+
+
+def _serialize_rank_rows(contest):
+    serializer = OIContestRankSerializer if contest.rule_type == ContestRuleType.OI else ACMContestRankSerializer
+    return serializer(get_contest_rank(contest).iterator(chunk_size=1000), many=True).data
+
+
+def _load_rank_snapshot(contest_id, rows, replace):
+    """
+    把快照写入 redis 列表, 第一个元素是占位的空字符串, 没有人参赛时列表也存在.
+    先写入临时 key 再改名, 读取的一方不会看到写了一半的列表; replace 为 False 时不覆盖已有的列表
+    """
+    key = f"{CacheKey.contest_rank_snapshot}:{contest_id}"
+    tmp_key = f"{key}:{rand_str()}"
+    pipe = cache.pipeline()
+    pipe.rpush(tmp_key, "", *(json.dumps(row, separators=(",", ":")) for row in rows))
+    if replace:
+        pipe.rename(tmp_key, key)
+    else:
+        pipe.renamenx(tmp_key, key)
+        pipe.delete(tmp_key)
+    pipe.execute()
+
+
+def take_rank_snapshot(contest, revealed=False):
+    """
+    保存当前的排名, revealed 为 False 时是封榜快照, 已经存在快照时不再写入;
+    为 True 时用一次查询算出的最终排名整体替换快照
+    """
+    rows = _serialize_rank_rows(contest)
+    if revealed:
+        ContestRankSnapshot.objects.update_or_create(contest=contest, defaults={"rows": rows, "revealed": True})
+    else:
+        try:
+            with transaction.atomic():
+                ContestRankSnapshot.objects.create(contest=contest, rows=rows)
+        except IntegrityError:
+            # 其他进程已经写入了快照
+            return
+    transaction.on_commit(lambda: _load_rank_snapshot(contest.id, rows, replace=True))
+
+
+def ensure_rank_snapshot(contest):
+    if not ContestRankSnapshot.objects.filter(contest=contest).exists():
+        take_rank_snapshot(contest)
+
+
+def delete_rank_snapshot(contest):
+    ContestRankSnapshot.objects.filter(contest=contest).delete()
+    transaction.on_commit(lambda: cache.delete(f"{CacheKey.contest_rank_snapshot}:{contest.id}"))
+
+
+def get_rank_snapshot_page(contest, offset, limit):
+    """
+    从 redis 中的快照取出一页, 直接拼接成 json 字符串返回, 不需要解码和重新编码
+    """
+    key = f"{CacheKey.contest_rank_snapshot}:{contest.id}"
+    pipe = cache.pipeline()
+    pipe.llen(key)
+    pipe.lrange(key, offset + 1, offset + limit)
+    size, rows = pipe.execute()
+    if size:
+        return '{"results":[' + b",".join(rows).decode("utf-8") + '],"total":' + str(size - 1) + "}"
+    # redis 中没有快照(还没有封榜快照, 或者 redis 的数据丢失了), 从数据库中读取
+    ensure_rank_snapshot(contest)
+    snapshot = ContestRankSnapshot.objects.get(contest=contest)
+    _load_rank_snapshot(contest.id, snapshot.rows, replace=False)
+    return json.dumps({"results": snapshot.rows[offset:offset + limit], "total": len(snapshot.rows)},
+                      separators=(",", ":"))
+
+
+def _rank_export_rows(contest, is_contest_admin):
+    """
+    逐行生成排名表格的内容, 第一行是表头
+    """
+    problems = list(Problem.objects.filter(contest=contest, visible=True).order_by("_id").values_list("id", "title"))
+    if contest.rule_type == ContestRuleType.OI:
+        header = ["User ID", "Username", "Real Name", "Total Score"]
+    else:
+        header = ["User ID", "Username", "Real Name", "AC", "Total Submission", "Total Time"]
+    # 题目 id 到列的映射, 不可见的题目不导出
+    columns = {str(problem_id): len(header) + index for index, (problem_id, _) in enumerate(problems)}
+    yield header + [title for _, title in problems]
+
+    ranks = get_contest_rank(contest)
+    if is_contest_admin:
+        ranks = ranks.select_related("user__userprofile")
+    for rank in ranks.iterator(chunk_size=1000):
+        user = rank.user
+        row = [str(user.id), user.username, (user.userprofile.real_name or "") if is_contest_admin else ""]
+        if contest.rule_type == ContestRuleType.OI:
+            row.append(str(rank.total_score))
+        else:
+            row.extend([str(rank.accepted_number), str(rank.submission_number), str(rank.total_time)])
+        row.extend([""] * len(problems))
+        for problem_id, info in rank.submission_info.items():
+            column = columns.get(problem_id)
+            if column is not None:
+                row[column] = str(info) if contest.rule_type == ContestRuleType.OI else str(info["is_ac"])
+        yield row
+
+
+def export_contest_rank(contest, path, file_format="xlsx", is_contest_admin=False):
+    """
+    把比赛排名导出到 path, file_format 可选 xlsx 或 csv. 按行写入文件, 不在内存中保存整个表格
+    """
+    rows = _rank_export_rows(contest, is_contest_admin)
+    if file_format == "csv":
+        # 带 BOM, excel 打开时才能正确识别编码
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            csv.writer(f).writerows(rows)
+        return
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    worksheet = workbook.add_worksheet()
+    for row_index, row in enumerate(rows):
+        for column_index, value in enumerate(row):
+            if value:
+                worksheet.write_string(row_index, column_index, value)
+    workbook.close()
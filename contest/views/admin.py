@@ -8,17 +8,18 @@ from django.http import FileResponse
 
 from account.decorators import check_contest_permission, ensure_created_by
 from account.models import User
-from submission.models import Submission, JudgeStatus
+from submission.models import ArchivedSubmission, Submission, JudgeStatus
+from submission.utils import SubmissionArchiveUnion
 from utils.api import APIView, validate_serializer
-from utils.cache import cache
-from utils.constants import CacheKey
 from utils.shortcuts import rand_str
 from utils.tasks import delete_files
 from ..models import Contest, ContestAnnouncement, ACMContestRank
 from ..serializers import (ContestAnnouncementSerializer, ContestAdminSerializer,
                            CreateConetestSeriaizer, CreateContestAnnouncementSerializer,
                            EditConetestSeriaizer, EditContestAnnouncementSerializer,
-                           ACMContesHelperSerializer, )
+                           ACMContesHelperSerializer, ContestRankRevealSerializer)
+from ..events import ContestEventType, publish_contest_event
+from ..utils import bump_rank_version, delete_rank_snapshot, take_rank_snapshot
 
 
 class ContestAPI(APIView):
@@ -30,6 +31,10 @@ class ContestAPI(APIView):
         data["created_by"] = request.user
         if data["end_time"] <= data["start_time"]:
             return self.error("Start time must occur earlier than end time")
+        if data.get("rank_freeze_time"):
+            data["rank_freeze_time"] = dateutil.parser.parse(data["rank_freeze_time"])
+            if not data["start_time"] <= data["rank_freeze_time"] <= data["end_time"]:
+                return self.error("Rank freeze time must be between start time and end time")
         if data.get("password") and data["password"] == "":
             data["password"] = None
         for ip_range in data["allowed_ip_ranges"]:
@@ -52,6 +57,14 @@ class ContestAPI(APIView):
         data["end_time"] = dateutil.parser.parse(data["end_time"])
         if data["end_time"] <= data["start_time"]:
             return self.error("Start time must occur earlier than end time")
+        if data.get("rank_freeze_time"):
+            data["rank_freeze_time"] = dateutil.parser.parse(data["rank_freeze_time"])
+            if not data["start_time"] <= data["rank_freeze_time"] <= data["end_time"]:
+                return self.error("Rank freeze time must be between start time and end time")
+        if data["real_time_rank"] != contest.real_time_rank or \
+                "rank_freeze_time" in data and data["rank_freeze_time"] != contest.rank_freeze_time:
+            # 封榜时间或者是否显示实时排名变了, 之前的快照作废, 下次封榜时再重新生成
+            delete_rank_snapshot(contest)
         if not data["password"]:
             data["password"] = None
         for ip_range in data["allowed_ip_ranges"]:
@@ -60,8 +73,7 @@ class ContestAPI(APIView):
             except ValueError:
                 return self.error(f"{ip_range} is not a valid cidr network")
         if not contest.real_time_rank and data.get("real_time_rank"):
-            cache_key = f"{CacheKey.contest_rank_cache}:{contest.id}"
-            cache.delete(cache_key)
+            bump_rank_version(contest.id)
 
         for k, v in data.items():
             setattr(contest, k, v)
@@ -103,7 +115,10 @@ class ContestAnnouncementAPI(APIView):
         except Contest.DoesNotExist:
             return self.error("Contest does not exist")
         announcement = ContestAnnouncement.objects.create(**data)
-        return self.success(ContestAnnouncementSerializer(announcement).data)
+        data = ContestAnnouncementSerializer(announcement).data
+        if announcement.visible:
+            publish_contest_event(contest.id, {"type": ContestEventType.ANNOUNCEMENT, "announcement": data})
+        return self.success(data)
 
     @validate_serializer(EditContestAnnouncementSerializer)
     def put(self, request):
@@ -119,6 +134,13 @@ class ContestAnnouncementAPI(APIView):
         for k, v in data.items():
             setattr(contest_announcement, k, v)
         contest_announcement.save()
+        # 修改或者隐藏公告也推送, 客户端按 id 更新本地的公告列表, 隐藏的公告不推送内容
+        if contest_announcement.visible:
+            announcement = ContestAnnouncementSerializer(contest_announcement).data
+        else:
+            announcement = {"id": contest_announcement.id, "visible": False}
+        publish_contest_event(contest_announcement.contest_id,
+                              {"type": ContestEventType.ANNOUNCEMENT, "announcement": announcement})
         return self.success()
 
     def delete(self, request):
@@ -127,11 +149,15 @@ class ContestAnnouncementAPI(APIView):
         """
         contest_announcement_id = request.GET.get("id")
         if contest_announcement_id:
+            announcements = ContestAnnouncement.objects.filter(id=contest_announcement_id)
             if request.user.is_admin():
-                ContestAnnouncement.objects.filter(id=contest_announcement_id,
-                                                   contest__created_by=request.user).delete()
-            else:
-                ContestAnnouncement.objects.filter(id=contest_announcement_id).delete()
+                announcements = announcements.filter(contest__created_by=request.user)
+            deleted = list(announcements.values_list("id", "contest_id"))
+            announcements.delete()
+            # 客户端按 id 从本地的公告列表中删除
+            for announcement_id, contest_id in deleted:
+                publish_contest_event(contest_id, {"type": ContestEventType.ANNOUNCEMENT,
+                                                   "announcement": {"id": announcement_id, "deleted": True}})
         return self.success()
 
     def get(self, request):
@@ -195,13 +221,35 @@ class ACMContestHelper(APIView):
         return self.success()
 
 
+class ContestRankRevealAPI(APIView):
+    @validate_serializer(ContestRankRevealSerializer)
+    def post(self, request):
+        """
+        揭晓封榜后的排名: 一次算出最终排名替换快照, 普通用户随后看到的就是最终排名
+        """
+        try:
+            contest = Contest.objects.get(id=request.data["contest_id"])
+            ensure_created_by(contest, request.user)
+        except Contest.DoesNotExist:
+            return self.error("Contest does not exist")
+        if not contest.rank_frozen:
+            return self.error("Contest rank is not frozen")
+        take_rank_snapshot(contest, revealed=True)
+        return self.success()
+
+
 class DownloadContestSubmissions(APIView):
     def _dump_submissions(self, contest, exclude_admin=True):
         problem_ids = contest.problem_set.all().values_list("id", "_id")
         id2display_id = {k[0]: k[1] for k in problem_ids}
         ac_map = {k[0]: False for k in problem_ids}
-        submissions = Submission.objects.filter(contest=contest, result=JudgeStatus.ACCEPTED).order_by("-create_time")
-        user_ids = submissions.values_list("user_id", flat=True)
+        # 结束较久的比赛的提交可能已经归档
+        submissions = SubmissionArchiveUnion().filter(contest=contest, result=JudgeStatus.ACCEPTED) \
+            .prefetch_related("code_blob")
+        user_ids = set()
+        for model in (Submission, ArchivedSubmission):
+            user_ids.update(model.objects.filter(contest=contest, result=JudgeStatus.ACCEPTED)
+                            .order_by().values_list("user_id", flat=True).distinct())
         users = User.objects.filter(id__in=user_ids)
         path = f"/tmp/{rand_str()}.zip"
         with zipfile.ZipFile(path, "w") as zip_file:
@@ -1,22 +1,23 @@
-import io
+import re
 
-import xlsxwriter
-from django.http import HttpResponse
+from django.http import FileResponse
 from django.utils.timezone import now
-from django.core.cache import cache
 
-from problem.models import Problem
 from utils.api import APIView, validate_serializer
+from utils.cache import cache
 from utils.constants import CacheKey, CONTEST_PASSWORD_SESSION_KEY
-from utils.shortcuts import datetime2str, check_is_id
-from account.models import AdminType
+from utils.shortcuts import datetime2str, check_is_id, rand_str
+from utils.throttling import RateLimitScope, rate_limit
 from account.decorators import login_required, check_contest_permission, check_contest_password
 
 from utils.constants import ContestRuleType, ContestStatus
-from ..models import ContestAnnouncement, Contest, OIContestRank, ACMContestRank
+from ..models import ContestAnnouncement, Contest
 from ..serializers import ContestAnnouncementSerializer
 from ..serializers import ContestSerializer, ContestPasswordVerifySerializer
 from ..serializers import OIContestRankSerializer, ACMContestRankSerializer
+from ..events import latest_event_id, read_contest_events
+from ..tasks import RANK_EXPORT_TIMEOUT, RankExportStatus, contest_rank_export_task, rank_export_path
+from ..utils import get_contest_rank, get_rank_page, get_rank_snapshot_page
 
 
 class ContestAnnouncementListAPI(APIView):
@@ -104,25 +105,20 @@ class ContestAccessAPI(APIView):
 
 class ContestRankAPI(APIView):
     def get_rank(self):
-        if self.contest.rule_type == ContestRuleType.ACM:
-            return ACMContestRank.objects.filter(contest=self.contest,
-                                                 user__admin_type=AdminType.REGULAR_USER,
-                                                 user__is_disabled=False).\
-                select_related("user").order_by("-accepted_number", "total_time")
-        else:
-            return OIContestRank.objects.filter(contest=self.contest,
-                                                user__admin_type=AdminType.REGULAR_USER,
-                                                user__is_disabled=False). \
-                select_related("user").order_by("-total_score")
-
-    def column_string(self, n):
-        string = ""
-        while n > 0:
-            n, remainder = divmod(n - 1, 26)
-            string = chr(65 + remainder) + string
-        return string
+        return get_contest_rank(self.contest)
+
+    def build_rank_page(self, request, serializer, is_contest_admin):
+        # 排名按页分别缓存, 这里只查询和序列化当前这一页
+        qs = self.get_rank()
+        if is_contest_admin:
+            # 管理员可以看到真实姓名
+            qs = qs.select_related("user__userprofile")
+        data = self.paginate_data(request, qs)
+        data["results"] = serializer(data["results"], many=True, is_contest_admin=is_contest_admin).data
+        return data
 
     @check_contest_permission(check_type="ranks")
+    @rate_limit("rank_export", scope=RateLimitScope.USER, condition=lambda request: request.GET.get("download_csv"))
     def get(self, request):
         download_csv = request.GET.get("download_csv")
         force_refresh = request.GET.get("force_refresh")
@@ -132,61 +128,67 @@ class ContestRankAPI(APIView):
         else:
             serializer = ACMContestRankSerializer
 
-        if force_refresh == "1" and is_contest_admin:
-            qs = self.get_rank()
-        else:
-            cache_key = f"{CacheKey.contest_rank_cache}:{self.contest.id}"
-            qs = cache.get(cache_key)
-            if not qs:
-                qs = self.get_rank()
-                cache.set(cache_key, qs)
-
         if download_csv:
-            data = serializer(qs, many=True, is_contest_admin=is_contest_admin).data
-            contest_problems = Problem.objects.filter(contest=self.contest, visible=True).order_by("_id")
-            problem_ids = [item.id for item in contest_problems]
-
-            f = io.BytesIO()
-            workbook = xlsxwriter.Workbook(f)
-            worksheet = workbook.add_worksheet()
-            worksheet.write("A1", "User ID")
-            worksheet.write("B1", "Username")
-            worksheet.write("C1", "Real Name")
-            if self.contest.rule_type == ContestRuleType.OI:
-                worksheet.write("D1", "Total Score")
-                for item in range(contest_problems.count()):
-                    worksheet.write(self.column_string(5 + item) + "1", f"{contest_problems[item].title}")
-                for index, item in enumerate(data):
-                    worksheet.write_string(index + 1, 0, str(item["user"]["id"]))
-                    worksheet.write_string(index + 1, 1, item["user"]["username"])
-                    worksheet.write_string(index + 1, 2, item["user"]["real_name"] or "")
-                    worksheet.write_string(index + 1, 3, str(item["total_score"]))
-                    for k, v in item["submission_info"].items():
-                        worksheet.write_string(index + 1, 4 + problem_ids.index(int(k)), str(v))
-            else:
-                worksheet.write("D1", "AC")
-                worksheet.write("E1", "Total Submission")
-                worksheet.write("F1", "Total Time")
-                for item in range(contest_problems.count()):
-                    worksheet.write(self.column_string(7 + item) + "1", f"{contest_problems[item].title}")
-
-                for index, item in enumerate(data):
-                    worksheet.write_string(index + 1, 0, str(item["user"]["id"]))
-                    worksheet.write_string(index + 1, 1, item["user"]["username"])
-                    worksheet.write_string(index + 1, 2, item["user"]["real_name"] or "")
-                    worksheet.write_string(index + 1, 3, str(item["accepted_number"]))
-                    worksheet.write_string(index + 1, 4, str(item["submission_number"]))
-                    worksheet.write_string(index + 1, 5, str(item["total_time"]))
-                    for k, v in item["submission_info"].items():
-                        worksheet.write_string(index + 1, 6 + problem_ids.index(int(k)), str(v["is_ac"]))
-
-            workbook.close()
-            f.seek(0)
-            response = HttpResponse(f.read())
-            response["Content-Disposition"] = f"attachment; filename=content-{self.contest.id}-rank.xlsx"
-            response["Content-Type"] = "application/xlsx"
-            return response
-
-        page_qs = self.paginate_data(request, qs)
-        page_qs["results"] = serializer(page_qs["results"], many=True, is_contest_admin=is_contest_admin).data
-        return self.success(page_qs)
+            if self.contest.rank_frozen and not is_contest_admin:
+                return self.error("Rank is frozen")
+            # 表格在后台生成, 这里只返回下载凭证, 之后通过 ContestRankExportAPI 下载
+            file_format = "csv" if request.GET.get("format") == "csv" else "xlsx"
+            token = rand_str()
+            cache.set(f"{CacheKey.contest_rank_export}:{token}",
+                      {"status": RankExportStatus.PENDING, "user_id": request.user.id, "format": file_format,
+                       "contest_id": self.contest.id},
+                      timeout=RANK_EXPORT_TIMEOUT)
+            contest_rank_export_task.send(token, self.contest.id, file_format, is_contest_admin)
+            return self.success({"token": token})
+
+        limit, offset = self.get_limit_offset(request)
+        if self.contest.rank_frozen and not is_contest_admin:
+            # 封榜之后普通用户看到的是封榜时的快照, 管理员仍然看到实时排名
+            return self.success_json(get_rank_snapshot_page(self.contest, offset, limit))
+        data = get_rank_page(self.contest.id, f"{int(is_contest_admin)}:{offset}:{limit}",
+                             lambda: self.build_rank_page(request, serializer, is_contest_admin),
+                             force_refresh=force_refresh == "1" and is_contest_admin)
+        return self.success_json(data)
+
+
+class ContestRankExportAPI(APIView):
+    @login_required
+    def get(self, request):
+        token = request.GET.get("token")
+        if not token:
+            return self.error("Parameter error, token is required")
+        state = cache.get(f"{CacheKey.contest_rank_export}:{token}")
+        if not state or state["user_id"] != request.user.id:
+            return self.error("Export does not exist or has expired")
+        if state["status"] == RankExportStatus.FAILED:
+            return self.error("Failed to export the rank")
+        if state["status"] == RankExportStatus.PENDING:
+            return self.success({"status": state["status"]})
+        file_format = state["format"]
+        resp = FileResponse(open(rank_export_path(token, file_format), "rb"))
+        resp["Content-Disposition"] = f"attachment; filename=content-{state['contest_id']}-rank.{file_format}"
+        resp["Content-Type"] = "text/csv" if file_format == "csv" else "application/xlsx"
+        return resp
+
+
+class ContestEventAPI(APIView):
+    # 长轮询最长等待的秒数, 要小于 nginx 和 gunicorn 的超时时间
+    max_wait = 25
+
+    @check_contest_permission(check_type="announcements")
+    def get(self, request):
+        """
+        last_id: 客户端收到的最后一个事件的 id, 不传时只返回当前最新的 id.
+        返回的 reset 为 true 时客户端应当重新获取完整的排名和公告列表
+        """
+        last_id = request.GET.get("last_id")
+        if not last_id:
+            return self.success({"events": [], "last_id": latest_event_id(self.contest.id), "reset": True})
+        if not re.match(r"^\d+-\d+$", last_id):
+            return self.error("Invalid parameter, last_id")
+        try:
+            timeout = min(float(request.GET.get("timeout", self.max_wait)), self.max_wait)
+        except ValueError:
+            return self.error("Invalid parameter, timeout")
+        events, last_id, reset, waited = read_contest_events(self.contest.id, last_id, timeout)
+        return self.success({"events": events, "last_id": last_id, "reset": reset, "long_poll": waited})
@@ -48,6 +48,10 @@ if [ -z "$MAX_WORKER_NUM" ]; then
     fi
 fi
 
+if [ -z "$GUNICORN_THREADS" ]; then
+    export GUNICORN_THREADS=4
+fi
+
 cd $APP/dist
 if [ ! -z "$STATIC_CDN_HOST" ]; then
     find . -name "*.*" -type f -exec sed -i "s/__STATIC_CDN_HOST__/\/$STATIC_CDN_HOST/g" {} \;
@@ -107,14 +107,21 @@ class FPSParser(object):
 
 
 class FPSHelper(object):
-    def save_image(self, problem, base_dir, base_url):
-        _problem = copy.deepcopy(problem)
+    def save_image(self, problem, base_dir, base_url, saved_files=None):
+        """
+        :param saved_files: 不为 None 时把写入的图片路径加入这个列表, 导入失败时用来清理
+        """
+        # 只会替换 description 等字符串字段, 浅拷贝即可, 避免复制全部测试用例
+        _problem = copy.copy(problem)
         for img in _problem["images"]:
             name = "".join(random.choice(string.ascii_lowercase + string.digits) for _ in range(12))
             ext = os.path.splitext(img["src"])[1]
             file_name = name + ext
-            with open(os.path.join(base_dir, file_name), "wb") as f:
+            path = os.path.join(base_dir, file_name)
+            with open(path, "wb") as f:
                 f.write(img["blob"])
+            if saved_files is not None:
+                saved_files.append(path)
             for item in ["description", "input", "output"]:
                 _problem[item] = _problem[item].replace(img["src"], os.path.join(base_url, file_name))
         return _problem
@@ -1,6 +1,7 @@
 import hashlib
 import json
 import logging
+import re
 from urllib.parse import urljoin
 
 import requests
@@ -10,10 +11,14 @@ from django.db.models import F
 from account.models import User
 from conf.models import JudgeServer
 from contest.models import ContestRuleType, ACMContestRank, OIContestRank, ContestStatus
+from contest.events import publish_rank_event
+from contest.utils import bump_rank_version, ensure_rank_snapshot
 from options.options import SysOptions
 from problem.models import Problem, ProblemRuleType
 from problem.utils import parse_problem_template
 from submission.models import JudgeStatus, Submission
+from submission.status import publish_submission_status
+from submission.utils import update_best_submission
 from utils.cache import cache
 from utils.constants import CacheKey
 
@@ -34,6 +39,67 @@ def process_pending_task():
             judge_task.send(**data)
 
 
+# 多行注释(包括可能用于绕过检测的)和单行注释
+_java_block_comment = re.compile(r"/\*[\s\S]*?\*/")
+_java_line_comment = re.compile(r"//.*")
+# 完整限定类名, 包名中可以有空格, 如 java.util.HashSet, java . util . HashSet
+_java_qualified_name = re.compile(
+    r"(new\s+|^|\s+|<|,\s*)([a-zA-Z][a-zA-Z0-9]*\s*(\.\s*[a-zA-Z][a-zA-Z0-9]*)+)(\s*[(<]|\s+[a-zA-Z])")
+# 只匹配 java 和 javax 开头的完整限定类名
+_java_std_qualified_name = re.compile(
+    r"(new\s+|^|\s+|<|,\s*)((java|javax)\s*\.\s*[a-zA-Z][a-zA-Z0-9]*(\s*\.\s*[a-zA-Z][a-zA-Z0-9]*)+)(\s*[(<]|\s+[a-zA-Z])")
+_whitespace = re.compile(r"\s+")
+
+
+def _is_java_import_allowed(name, allowed_imports):
+    for rule in allowed_imports:
+        # `*` 允许所有, `java.util.*` 允许整个包, 否则是具体的类
+        if rule == "*":
+            return True
+        elif rule.endswith(".*"):
+            if name.startswith(rule[:-1]):
+                return True
+        elif name == rule:
+            return True
+    return False
+
+
+def check_java_code(code, has_config, allowed_imports):
+    """
+    检查 Java 代码的 import 语句和代码中用到的 java.*, javax.* 完整限定类名.
+    没有 spj_code 配置(has_config 为 False)或者配置中没有 allowed_imports 时不允许任何 import
+    :return: 不允许时返回错误信息, 否则返回 None
+    """
+    for line in code.split("\n"):
+        words = line.split()
+        if words and words[0] == "import":
+            # 只包含 "import" 关键字
+            if len(words) < 2:
+                return "Invalid import statement."
+            imported_lib = words[1].strip(";")
+            if not has_config or allowed_imports is None:
+                return f"Import '{imported_lib}' is not allowed (all imports disabled)."
+            if not _is_java_import_allowed(imported_lib, allowed_imports):
+                return f"Import '{imported_lib}' is not allowed."
+
+    if has_config and allowed_imports is None:
+        return None
+    cleaned_code = _java_line_comment.sub("", _java_block_comment.sub("", code))
+    if has_config:
+        for match in _java_qualified_name.finditer(cleaned_code):
+            # 移除所有空格之后再检查
+            name = _whitespace.sub("", match.group(2))
+            if (name.startswith("java.") or name.startswith("javax.")) and \
+                    not _is_java_import_allowed(name, allowed_imports):
+                return f"Fully qualified class '{name}' is not allowed."
+    else:
+        match = _java_std_qualified_name.search(cleaned_code)
+        if match:
+            name = _whitespace.sub("", match.group(2))
+            return f"Fully qualified class '{name}' is not allowed (all imports disabled)."
+    return None
+
+
 class ChooseJudgeServer:
     def __init__(self):
         self.server = None
@@ -94,9 +160,9 @@ class SPJCompiler(DispatcherBase):
 class JudgeDispatcher(DispatcherBase):
     def __init__(self, submission_id, problem_id):
         super().__init__()
-        self.submission = Submission.objects.get(id=submission_id)
+        self.submission = Submission.objects.select_related("code_blob").get(id=submission_id)
         self.contest_id = self.submission.contest_id
-        self.last_result = self.submission.result if self.submission.info else None
+        self.last_result = self.submission.result if self.submission.has_info() else None
 
         if self.contest_id:
             self.problem = Problem.objects.select_related("contest").get(id=problem_id, contest_id=self.contest_id)
@@ -126,6 +192,12 @@ class JudgeDispatcher(DispatcherBase):
             self.submission.statistic_info["score"] = score
 
     def judge(self):
+        self._judge()
+        # 判题可能中途返回(过期, import 不合法等), 统一在这里更新非比赛题目的最优提交
+        if not self.contest_id:
+            update_best_submission(self.problem, self.submission.user_id)
+
+    def _judge(self):
         language = self.submission.language
         sub_config = list(filter(lambda item: language == item["name"], SysOptions.languages))[0]
         
@@ -189,140 +261,12 @@ class JudgeDispatcher(DispatcherBase):
 
         # ✅ 处理 Java `import` 限制
         if self.submission.language == "Java":
-            # ✅ 首先处理 import 语句
-            for line in self.submission.code.split("\n"):
-                words = line.split()
-                if words and words[0] == "import":  # ✅ 确保至少有两个单词
-                    if len(words) < 2:  # ❌ 只包含 "import" 关键字，报错
-                        self.submission.result = JudgeStatus.COMPILE_ERROR
-                        self.submission.statistic_info = {
-                            "err_info": "Invalid import statement."
-                        }
-                        self.submission.save(update_fields=["result", "statistic_info"])
-                        return
-
-                    imported_lib = words[1].strip(";")  # ✅ 现在可以安全获取导入的包名
-
-                    if self.problem.spj_code:  # ✅ 只有 `spj_code` 存在时才检查 `allowed_imports`
-                        if allowed_imports is None:  # ✅ 没有定义 `allowed_imports`，禁止所有 `import`
-                            self.submission.result = JudgeStatus.COMPILE_ERROR
-                            self.submission.statistic_info = {
-                                "err_info": f"Import '{imported_lib}' is not allowed (all imports disabled)."
-                            }
-                            self.submission.save(update_fields=["result", "statistic_info"])
-                            return
-
-                        # ✅ 处理 `allowed_imports` 里的 `*`
-                        allowed = False
-                        for rule in allowed_imports:
-                            if rule == "*":  # ✅ 处理 `*` 这种情况
-                                allowed = True
-                                break
-                            elif rule.endswith(".*"):  # ✅ 处理 `java.util.*` 这种情况
-                                package_prefix = rule[:-1]  # 去掉 `*`
-                                if imported_lib.startswith(package_prefix):  # ✅ 允许 `java.util.XXX`
-                                    allowed = True
-                                    break
-                            elif imported_lib == rule:  # ✅ 处理 `java.util.Scanner` 这种具体类
-                                allowed = True
-                                break
-
-                        if not allowed:
-                            self.submission.result = JudgeStatus.COMPILE_ERROR
-                            self.submission.statistic_info = {
-                                "err_info": f"Import '{imported_lib}' is not allowed."
-                            }
-                            self.submission.save(update_fields=["result", "statistic_info"])
-                            return
-                    else:
-                        # ✅ 如果 `spj_code` 为空，则禁用所有 `import`
-                        self.submission.result = JudgeStatus.COMPILE_ERROR
-                        self.submission.statistic_info = {
-                            "err_info": f"Import '{imported_lib}' is not allowed (all imports disabled)."
-                        }
-                        self.submission.save(update_fields=["result", "statistic_info"])
-                        return
-            
-            # ✅ 检查完整限定类名的使用 (如 java.util.HashSet)
-            if self.problem.spj_code and allowed_imports is not None:
-                # 先清理代码中的所有注释
-                import re
-                
-                # 函数移除所有注释（包括多行注释和单行注释）
-                def remove_comments(code):
-                    # 移除多行注释（包括可能用于绕过检测的）
-                    code = re.sub(r'/\*[\s\S]*?\*/', '', code)
-                    # 移除单行注释
-                    code = re.sub(r'//.*', '', code)
-                    return code
-                
-                # 清理后的代码
-                cleaned_code = remove_comments(self.submission.code)
-                
-                # 构建正则表达式检测完整限定类名 - 修改后的表达式可以处理包名中的空格
-                qualified_pattern = re.compile(r'(new\s+|^|\s+|<|,\s*)([a-zA-Z][a-zA-Z0-9]*\s*(\.\s*[a-zA-Z][a-zA-Z0-9]*)+)(\s*[(<]|\s+[a-zA-Z])')
-                
-                # 在清理后的代码中查找所有完整限定类名
-                matches = qualified_pattern.finditer(cleaned_code)
-                for match in matches:
-                    qualified_name = match.group(2)  # 获取匹配的完整限定名
-                    # 移除所有空格以进行检查
-                    clean_qualified_name = re.sub(r'\s+', '', qualified_name)
-                    
-                    # 检查是否是Java标准库中的类
-                    if clean_qualified_name.startswith("java.") or clean_qualified_name.startswith("javax."):
-                        # 检查是否允许这个完整限定名
-                        allowed = False
-                        for rule in allowed_imports:
-                            if rule == "*":
-                                allowed = True
-                                break
-                            elif rule.endswith(".*"):
-                                package_prefix = rule[:-1]  # 去掉 `*`
-                                if clean_qualified_name.startswith(package_prefix):
-                                    allowed = True
-                                    break
-                            elif clean_qualified_name == rule:
-                                allowed = True
-                                break
-                            
-                        if not allowed:
-                            self.submission.result = JudgeStatus.COMPILE_ERROR
-                            self.submission.statistic_info = {
-                                "err_info": f"Fully qualified class '{clean_qualified_name}' is not allowed."
-                            }
-                            self.submission.save(update_fields=["result", "statistic_info"])
-                            return
-            elif not self.problem.spj_code:
-                # 如果无 spj_code，禁止使用任何 Java 标准库
-                import re
-                
-                # 先清理代码中的所有注释
-                def remove_comments(code):
-                    # 移除多行注释（包括可能用于绕过检测的）
-                    code = re.sub(r'/\*[\s\S]*?\*/', '', code)
-                    # 移除单行注释
-                    code = re.sub(r'//.*', '', code)
-                    return code
-                
-                # 清理后的代码
-                cleaned_code = remove_comments(self.submission.code)
-                
-                # 修改正则表达式以匹配完整限定类名 - 处理包名中的空格
-                qualified_pattern = re.compile(r'(new\s+|^|\s+|<|,\s*)((java|javax)\s*\.\s*[a-zA-Z][a-zA-Z0-9]*(\s*\.\s*[a-zA-Z][a-zA-Z0-9]*)+)(\s*[(<]|\s+[a-zA-Z])')
-                
-                # 在清理后的代码中查找Java标准库类的使用
-                matches = qualified_pattern.finditer(cleaned_code)
-                for match in matches:
-                    qualified_name = match.group(2)
-                    # 移除所有空格以进行检查
-                    clean_qualified_name = re.sub(r'\s+', '', qualified_name)
-                    self.submission.result = JudgeStatus.COMPILE_ERROR
-                    self.submission.statistic_info = {
-                        "err_info": f"Fully qualified class '{clean_qualified_name}' is not allowed (all imports disabled)."
-                    }
-                    self.submission.save(update_fields=["result", "statistic_info"])
-                    return
+            err_info = check_java_code(self.submission.code, bool(self.problem.spj_code), allowed_imports)
+            if err_info:
+                self.submission.result = JudgeStatus.COMPILE_ERROR
+                self.submission.statistic_info = {"err_info": err_info}
+                self.submission.save(update_fields=["result", "statistic_info"])
+                return
         
         
         
@@ -368,6 +312,7 @@ class JudgeDispatcher(DispatcherBase):
                 cache.lpush(CacheKey.waiting_queue, json.dumps(data))
                 return
             Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.JUDGING)
+            publish_submission_status(self.submission.id, JudgeStatus.JUDGING)
             resp = self._request(urljoin(server.service_url, "/judge"), data=data)
 
         if not resp:
@@ -539,8 +484,12 @@ class JudgeDispatcher(DispatcherBase):
             problem.save(update_fields=["submission_number", "accepted_number", "statistic_info"])
 
     def update_contest_rank(self):
-        if self.contest.rule_type == ContestRuleType.OI or self.contest.real_time_rank:
-            cache.delete(f"{CacheKey.contest_rank_cache}:{self.contest.id}")
+        # 事务提交之后排名才会变化, 这时再让缓存的排名页过时. 封榜时普通用户看到的是快照, 缓存的排名页只给管理员
+        contest_id = self.contest.id
+        transaction.on_commit(lambda: bump_rank_version(contest_id))
+        if self.contest.rank_frozen:
+            # 封榜之后第一次更新排名前先保存快照, 快照中不包含封榜之后判完的提交
+            ensure_rank_snapshot(self.contest)
 
         def get_rank(model):
             return model.objects.select_for_update().get(user_id=self.submission.user_id, contest=self.contest)
@@ -561,6 +510,10 @@ class JudgeDispatcher(DispatcherBase):
             except IntegrityError:
                 rank = get_rank(model)
         func(rank)
+        if self.contest.real_time_rank:
+            # 排名变化推送给正在看排名的客户端, 封榜或者不公开实时排名时不推送
+            contest, problem_id, username = self.contest, self.problem.id, self.submission.username
+            transaction.on_commit(lambda: publish_rank_event(contest, rank, problem_id, username))
 
     def _update_acm_contest_rank(self, rank):
         info = rank.submission_info.get(str(self.submission.problem_id))
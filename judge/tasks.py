@@ -1,8 +1,9 @@
 import dramatiq
 
 from account.models import User
-from submission.models import Submission
+from submission.models import JudgeStatus, Submission
 from judge.dispatcher import JudgeDispatcher
+from submission.status import publish_submission_status
 from utils.shortcuts import DRAMATIQ_WORKER_ARGS
 
 
@@ -12,3 +13,7 @@ def judge_task(submission_id, problem_id):
     if User.objects.get(id=uid).is_disabled:
         return
     JudgeDispatcher(submission_id, problem_id).judge()
+    # 判题有很多个结束的分支, 统一在这里推送最终的状态. 没有空闲的判题服务器时提交回到队列中, 仍然是 PENDING
+    submission = Submission.objects.only("result", "statistic_info").get(id=submission_id)
+    if submission.result != JudgeStatus.PENDING:
+        publish_submission_status(submission_id, submission.result, submission.statistic_info)
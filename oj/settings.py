@@ -56,6 +56,8 @@ LOCAL_APPS = [
 INSTALLED_APPS = VENDOR_APPS + LOCAL_APPS
 
 MIDDLEWARE = (
+    'utils.middleware.JSONCompressionMiddleware',
+    'utils.middleware.InstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -66,7 +68,6 @@ MIDDLEWARE = (
     'django.middleware.security.SecurityMiddleware',
     'account.middleware.AdminRoleRequiredMiddleware',
     'account.middleware.SessionRecordMiddleware',
-    # 'account.middleware.LogSqlMiddleware',
 )
 ROOT_URLCONF = 'oj.urls'
 
@@ -202,7 +203,10 @@ def redis_config(db):
         "LOCATION": f"{REDIS_URL}/{db}",
         "TIMEOUT": None,
         "KEY_PREFIX": "",
-        "KEY_FUNCTION": make_key
+        "KEY_FUNCTION": make_key,
+        "OPTIONS": {
+            "REDIS_CLIENT_CLASS": "utils.cache.CountingRedis"
+        }
     }
 
 
@@ -245,4 +249,20 @@ RAVEN_CONFIG = {
 
 IP_HEADER = "HTTP_X_REAL_IP"
 
+# 每个进程同时等待的长轮询请求数, 提交状态和比赛事件共用, 见 utils.long_poll.
+# 等待时占用 gunicorn 的线程(--threads, 见 deploy/supervisord.conf), 至少给普通请求留两个线程
+LONG_POLL_MAX_WAITERS = max(int(get_env("GUNICORN_THREADS", "4")) - 2, 0)
+
+# 请求耗时统计, 见 utils.middleware.InstrumentationMiddleware
+INSTRUMENTATION = {
+    # 统计 SQL 和 redis 次数的请求比例, 所有请求都会记录总耗时
+    "sample_rate": float(get_env("INSTRUMENTATION_SAMPLE_RATE", "0.1")),
+    # 超过这个时间(毫秒)的请求记录到日志中
+    "slow_request_ms": int(get_env("INSTRUMENTATION_SLOW_REQUEST_MS", "1000")),
+    # 被统计的请求是否返回 Server-Timing 头
+    "server_timing": True,
+    # 每个进程汇总到 redis 的间隔(秒)
+    "flush_interval": 10,
+}
+
 DEFAULT_AUTO_FIELD='django.db.models.AutoField'
\ No newline at end of file
@@ -1,10 +1,14 @@
+import copy
 import functools
+import logging
 import os
 import threading
 import time
 
 from django.db import transaction, IntegrityError
 
+from utils.cache import cache
+from utils.constants import CacheKey
 from utils.shortcuts import rand_str
 from judge.languages import languages
 from .models import SysOptions as SysOptionsModel
@@ -86,6 +90,8 @@ class my_property:
 
 DEFAULT_SHORT_TTL = 2
 
+logger = logging.getLogger(__name__)
+
 
 def default_token():
     token = os.environ.get("JUDGE_SERVER_TOKEN")
@@ -103,6 +109,7 @@ class OptionKeys:
     judge_server_token = "judge_server_token"
     throttling = "throttling"
     languages = "languages"
+    submission_archive_days = "submission_archive_days"
 
 
 class OptionDefaultValue:
@@ -114,12 +121,219 @@ class OptionDefaultValue:
     submission_list_show_all = True
     smtp_config = {}
     judge_server_token = default_token
-    throttling = {"ip": {"capacity": 100, "fill_rate": 0.1, "default_capacity": 50},
-                  "user": {"capacity": 20, "fill_rate": 0.03, "default_capacity": 10}}
+    # ip 和 user 用于提交代码, 其他的是 rate_limit 使用的各接口的策略.
+    # 机房和比赛现场的学生通常在同一个 NAT 后面, 按 IP 的限制要足够宽松, 登录和重置密码另外按账号加 IP 限制
+    throttling = {"ip": {"capacity": 100, "fill_rate": 0.1, "default_capacity": 50, "enabled": False},
+                  "user": {"capacity": 20, "fill_rate": 0.03, "default_capacity": 10},
+                  "captcha": {"capacity": 30, "fill_rate": 0.5, "default_capacity": 30},
+                  "login": {"algorithm": "sliding_window", "limit": 10, "window": 60},
+                  "login_ip": {"algorithm": "sliding_window", "limit": 300, "window": 60},
+                  "register": {"algorithm": "sliding_window", "limit": 100, "window": 60 * 60},
+                  "reset_password": {"algorithm": "sliding_window", "limit": 5, "window": 60 * 60},
+                  "reset_password_ip": {"algorithm": "sliding_window", "limit": 50, "window": 60 * 60},
+                  "problem_search": {"capacity": 60, "fill_rate": 1, "default_capacity": 60},
+                  "rank_export": {"algorithm": "sliding_window", "limit": 5, "window": 10 * 60}}
     languages = languages
+    # 超过这个天数的提交会被归档, 0 表示不归档
+    submission_archive_days = 0
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError("SysOptions values are shared between threads, copy them before modifying")
+
+
+class _FrozenDict(dict):
+    """
+    快照中的 dict, 修改时报错. 复制和 pickle 之后是普通的 dict
+    """
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class _FrozenList(list):
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = append = clear = extend = insert = pop = remove = \
+        reverse = sort = _read_only
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(value, memo) for value in self]
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return _FrozenDict((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return _FrozenList(_freeze(item) for item in value)
+    return value
+
+
+class _OptionsSnapshot:
+    """
+    本进程中所有配置的快照, 一次查询全部读出, 读取配置时不访问数据库和 redis.
+
+    修改配置时 redis 中的版本号加一, 并在频道中发布消息, 每个进程的后台线程订阅这个频道, 收到消息后丢弃快照.
+    订阅的连接定期 PING, 断开或者没有回复时每秒检查一次 redis 中的版本号; redis 也不可用时每 DEFAULT_SHORT_TTL 秒重新从数据库读取.
+    快照中的 dict 和 list 在线程之间共享, 是只读的
+    """
+    version_key = CacheKey.options_version
+    channel = CacheKey.options_invalidate
+    version_check_interval = 1
+    # 订阅的连接超过 health_check_interval 秒没有消息时发送 PING, 两倍的时间没有任何回复时认为连接已经断开
+    health_check_interval = 10
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.thread = None
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.values = None
+        self.version = None
+        # 每次丢弃快照时加一, 加载时版本号已经变化的快照不会被保存
+        self.generation = 0
+        self.loaded_at = self.checked_at = 0
+        # 订阅的连接最后一次收到回复的时间
+        self.alive_at = 0
+
+    @property
+    def listening(self):
+        return time.monotonic() - self.alive_at < 2 * self.health_check_interval
+
+    def _listen(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = cache.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # 订阅之前的修改可能没有收到
+                self.invalidate()
+                self.alive_at = pinged_at = time.monotonic()
+                while True:
+                    message = pubsub.get_message(timeout=self.health_check_interval)
+                    now = time.monotonic()
+                    if message is not None:
+                        self.alive_at = now
+                        if message["type"] == "message":
+                            self.invalidate()
+                    if not self.listening:
+                        raise ConnectionError("no reply from redis")
+                    if now - max(self.alive_at, pinged_at) >= self.health_check_interval:
+                        pubsub.ping()
+                        pinged_at = now
+            except Exception as e:
+                logger.warning("Options invalidation listener disconnected: %s", e)
+            self.alive_at = 0
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            time.sleep(self.version_check_interval)
+
+    def _ensure_listener(self):
+        if self.pid != os.getpid():
+            # fork 之后线程不会被复制, 快照也可能是父进程中过时的数据
+            self._reset()
+            self.thread = None
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._listen, name="sys-options-listener", daemon=True)
+            self.thread.start()
+
+    def _redis_version(self):
+        try:
+            return int(cache.get(self.version_key) or 0)
+        except Exception as e:
+            logger.warning("Failed to get options version: %s", e)
+            return None
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.values = None
+
+    def publish(self):
+        """
+        配置修改提交之后调用, 通知所有进程
+        """
+        self.invalidate()
+        try:
+            pipe = cache.pipeline()
+            pipe.incr(self.version_key)
+            pipe.publish(self.channel, "1")
+            pipe.execute()
+        except Exception as e:
+            logger.exception(e)
+
+    def get(self, load):
+        """
+        :param load: 从数据库读取全部配置的函数, 返回 (dict, 是否可以缓存)
+        """
+        with self.lock:
+            self._ensure_listener()
+            values, generation = self.values, self.generation
+        now = time.monotonic()
+        if values is not None and not self.listening and now - self.checked_at >= self.version_check_interval:
+            version = self._redis_version()
+            self.checked_at = now
+            if version is None:
+                if now - self.loaded_at >= DEFAULT_SHORT_TTL:
+                    values = None
+            elif version != self.version:
+                values = None
+        if values is not None:
+            return values
+
+        version = self._redis_version()
+        values, cacheable = load()
+        if cacheable:
+            values = _freeze(values)
+        with self.lock:
+            if cacheable and generation == self.generation:
+                self.values, self.version = values, version
+                self.loaded_at = self.checked_at = time.monotonic()
+        return values
+
+    def set_pending(self):
+        """
+        在事务中修改了配置, 提交之前这个线程直接读取数据库, 其他线程仍然使用快照
+        """
+        connection = transaction.get_connection()
+        if connection.in_atomic_block:
+            self.local.pending = list(connection.savepoint_ids)
+
+    def is_pending(self):
+        pending = getattr(self.local, "pending", None)
+        if pending is None:
+            return False
+        connection = transaction.get_connection()
+        if connection.in_atomic_block and connection.savepoint_ids[:len(pending)] == pending:
+            return True
+        # 事务已经结束, 提交时快照已经在 on_commit 中丢弃, 回滚时快照中本来就没有修改后的值
+        self.local.pending = None
+        return False
+
+    def clear_pending(self):
+        self.local.pending = None
 
 
 class _SysOptionsMeta(type):
+    _snapshot = _OptionsSnapshot()
+
     @classmethod
     def _get_keys(cls):
         return [key for key in OptionKeys.__dict__ if not key.startswith("__")]
@@ -136,15 +350,23 @@ class _SysOptionsMeta(type):
                 except IntegrityError:
                     pass
 
+    @classmethod
+    def _load_options(mcs):
+        values = dict(SysOptionsModel.objects.values_list("key", "value"))
+        if all(key in values for key in mcs._get_keys()):
+            return values, True
+        # 缺少的配置刚刚写入, 可能还没有提交, 这一次不缓存
+        mcs._init_option()
+        return dict(SysOptionsModel.objects.values_list("key", "value")), False
+
     @classmethod
     def _get_option(mcs, option_key):
-        try:
-            option = SysOptionsModel.objects.get(key=option_key)
-            value = option.value
-            return value
-        except SysOptionsModel.DoesNotExist:
-            mcs._init_option()
-            return mcs._get_option(option_key)
+        """
+        返回的 dict 和 list 在线程之间共享, 是只读的, 需要修改时先复制
+        """
+        if mcs._snapshot.is_pending():
+            return mcs._load_options()[0][option_key]
+        return mcs._snapshot.get(mcs._load_options)[option_key]
 
     @classmethod
     def _set_option(mcs, option_key: str, option_value):
@@ -156,6 +378,14 @@ class _SysOptionsMeta(type):
         except SysOptionsModel.DoesNotExist:
             mcs._init_option()
             mcs._set_option(option_key, option_value)
+            return
+        mcs._snapshot.set_pending()
+        transaction.on_commit(mcs._on_options_commit)
+
+    @classmethod
+    def _on_options_commit(mcs):
+        mcs._snapshot.clear_pending()
+        mcs._snapshot.publish()
 
     @classmethod
     def _increment(mcs, option_key):
@@ -168,6 +398,8 @@ class _SysOptionsMeta(type):
         except SysOptionsModel.DoesNotExist:
             mcs._init_option()
             return mcs._increment(option_key)
+        mcs._snapshot.set_pending()
+        transaction.on_commit(mcs._on_options_commit)
 
     @classmethod
     def set_options(mcs, options):
@@ -181,7 +413,7 @@ class _SysOptionsMeta(type):
             result[key] = mcs._get_option(key)
         return result
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_base_url(cls):
         return cls._get_option(OptionKeys.website_base_url)
 
@@ -189,7 +421,7 @@ class _SysOptionsMeta(type):
     def website_base_url(cls, value):
         cls._set_option(OptionKeys.website_base_url, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_name(cls):
         return cls._get_option(OptionKeys.website_name)
 
@@ -197,7 +429,7 @@ class _SysOptionsMeta(type):
     def website_name(cls, value):
         cls._set_option(OptionKeys.website_name, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_name_shortcut(cls):
         return cls._get_option(OptionKeys.website_name_shortcut)
 
@@ -205,7 +437,7 @@ class _SysOptionsMeta(type):
     def website_name_shortcut(cls, value):
         cls._set_option(OptionKeys.website_name_shortcut, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_footer(cls):
         return cls._get_option(OptionKeys.website_footer)
 
@@ -221,7 +453,7 @@ class _SysOptionsMeta(type):
     def allow_register(cls, value):
         cls._set_option(OptionKeys.allow_register, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def submission_list_show_all(cls):
         return cls._get_option(OptionKeys.submission_list_show_all)
 
@@ -253,7 +485,7 @@ class _SysOptionsMeta(type):
     def throttling(cls, value):
         cls._set_option(OptionKeys.throttling, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def languages(cls):
         return cls._get_option(OptionKeys.languages)
 
@@ -261,15 +493,23 @@ class _SysOptionsMeta(type):
     def languages(cls, value):
         cls._set_option(OptionKeys.languages, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
+    def submission_archive_days(cls):
+        return cls._get_option(OptionKeys.submission_archive_days)
+
+    @submission_archive_days.setter
+    def submission_archive_days(cls, value):
+        cls._set_option(OptionKeys.submission_archive_days, value)
+
+    @my_property
     def spj_languages(cls):
         return [item for item in cls.languages if "spj" in item]
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def language_names(cls):
         return [item["name"] for item in cls.languages]
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def spj_language_names(cls):
         return [item["name"] for item in cls.languages if "spj" in item]
 
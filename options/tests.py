@@ -1 +1,92 @@
-# Create your tests here.
+import copy
+import json
+import time
+from unittest import mock
+
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from utils.cache import MyRedisCache
+from .models import SysOptions as SysOptionsModel
+from .options import SysOptions, _OptionsSnapshot
+
+
+class SysOptionsSnapshotTest(TestCase):
+    def setUp(self):
+        SysOptions._init_option()
+        SysOptions.website_name
+        # 等待订阅的线程启动, 它在订阅之后会丢弃一次快照
+        deadline = time.monotonic() + 1
+        while not SysOptions._snapshot.listening and time.monotonic() < deadline:
+            time.sleep(0.01)
+        SysOptions._snapshot.invalidate()
+
+    def test_bulk_load(self):
+        with CaptureQueriesContext(connection) as ctx:
+            SysOptions.website_name
+            SysOptions.languages
+            SysOptions.throttling
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_read_own_write(self):
+        SysOptions.website_name
+        SysOptions.website_name = "test oj"
+        self.assertEqual(SysOptions.website_name, "test oj")
+
+    def test_rollback(self):
+        old = SysOptions.website_name
+        try:
+            with transaction.atomic():
+                SysOptions.website_name = "rolled back"
+                self.assertEqual(SysOptions.website_name, "rolled back")
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(SysOptions.website_name, old)
+
+    def test_invalidate_from_other_process(self):
+        SysOptions.website_name
+        # 其他进程修改了数据库并发布消息
+        SysOptionsModel.objects.filter(key="website_name").update(value="changed oj")
+        self.assertNotEqual(SysOptions.website_name, "changed oj")
+        SysOptions._snapshot.publish()
+        deadline = time.monotonic() + 1
+        while SysOptions.website_name != "changed oj" and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(SysOptions.website_name, "changed oj")
+
+    def test_values_read_only(self):
+        throttling = SysOptions.throttling
+        with self.assertRaises(TypeError):
+            throttling["ip"]["capacity"] = 0
+        with self.assertRaises(TypeError):
+            SysOptions.languages.append({})
+        # 复制之后可以修改, json 序列化的结果不变
+        copied = copy.deepcopy(throttling)
+        copied["ip"]["capacity"] = 0
+        self.assertEqual(type(copied["ip"]), dict)
+        self.assertEqual(json.loads(json.dumps(SysOptions.languages)), SysOptions.languages)
+
+
+class OptionsListenerTest(TestCase):
+    def test_reconnect_without_reply(self):
+        snapshot = _OptionsSnapshot()
+        snapshot.health_check_interval = 0.05
+        snapshot.version_check_interval = 0.01
+        pubsub = mock.Mock()
+        # 半开的连接: 没有任何消息, PING 也没有回复
+        pubsub.get_message.side_effect = lambda timeout: time.sleep(timeout)
+        # 每个线程有自己的 cache 实例, 在类上替换
+        with mock.patch.object(MyRedisCache, "pubsub", create=True, return_value=pubsub) as create_pubsub:
+            snapshot._ensure_listener()
+            deadline = time.monotonic() + 2
+            while create_pubsub.call_count < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertGreaterEqual(create_pubsub.call_count, 2)
+            pubsub.ping.assert_called()
+            pubsub.close.assert_called()
+            # 结束这个快照的线程
+            pubsub.get_message.side_effect = SystemExit()
+            snapshot.thread.join(1)
+        self.assertFalse(snapshot.thread.is_alive())
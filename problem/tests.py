@@ -1,8 +1,11 @@
+import base64
 import copy
 import hashlib
 import os
 import shutil
+import tempfile
 from datetime import timedelta
+from unittest import mock
 from zipfile import ZipFile
 
 from django.conf import settings
@@ -13,6 +16,7 @@ from .models import ProblemTag, ProblemIOMode
 from .models import Problem, ProblemRuleType
 from contest.models import Contest
 from contest.tests import DEFAULT_CONTEST_DATA
+from fps.parser import FPSHelper
 
 from .views.admin import TestCaseAPI
 from .utils import parse_problem_template
@@ -283,6 +287,89 @@ class AddProblemFromPublicProblemAPITest(ProblemCreateTestBase):
         self.assertTrue(Problem.objects.filter(contest_id=self.contest["id"]).exists())
 
 
+class FPSProblemImportAPITest(APITestCase):
+    def setUp(self):
+        self.url = self.reverse("fps_problem_api")
+        self.create_super_admin()
+
+    def make_fps_file(self, count, invalid=None):
+        """
+        每道题带一张图片, 第 invalid 道题的标题过长, 不能通过校验
+        """
+        image = base64.b64encode(b"\x89PNG").decode("ascii")
+        items = []
+        for index in range(count):
+            title = "x" * 200 if index == invalid else f"problem {index}"
+            items.append(f"""<item>
+<title><![CDATA[{title}]]></title>
+<time_limit unit="s"><![CDATA[1]]></time_limit>
+<memory_limit unit="mb"><![CDATA[256]]></memory_limit>
+<description><![CDATA[<p>description {index}<img src="/img/{index}.png"></p>]]></description>
+<input><![CDATA[input]]></input>
+<output><![CDATA[output]]></output>
+<sample_input><![CDATA[1 2]]></sample_input>
+<sample_output><![CDATA[3]]></sample_output>
+<test_input><![CDATA[1 2]]></test_input>
+<test_output><![CDATA[3]]></test_output>
+<hint><![CDATA[]]></hint>
+<source><![CDATA[]]></source>
+<img><src><![CDATA[/img/{index}.png]]></src><base64><![CDATA[{image}]]></base64></img>
+</item>""")
+        f = tempfile.NamedTemporaryFile("w+b", suffix=".xml")
+        self.addCleanup(f.close)
+        f.write(('<?xml version="1.0" encoding="UTF-8"?>\n<fps version="1.2">' + "".join(items) + "</fps>").encode("utf-8"))
+        f.seek(0)
+        return f
+
+    def import_fps(self, f):
+        test_case_dir = tempfile.mkdtemp()
+        upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_case_dir)
+        self.addCleanup(shutil.rmtree, upload_dir)
+        with self.settings(TEST_CASE_DIR=test_case_dir, UPLOAD_DIR=upload_dir):
+            resp = self.client.post(self.url, data={"file": f}, format="multipart")
+        return resp, test_case_dir, upload_dir
+
+    def test_import_fps_problems(self):
+        resp, test_case_dir, upload_dir = self.import_fps(self.make_fps_file(5))
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"], {"import_count": 5, "test_case_count": 5, "image_count": 5})
+        problems = Problem.objects.filter(_id__startswith="fps-")
+        self.assertEqual(problems.count(), 5)
+        self.assertEqual(len(set(problems.values_list("_id", flat=True))), 5)
+        for problem in problems:
+            self.assertEqual(len(problem.test_case_score), 1)
+            self.assertTrue(os.path.exists(os.path.join(test_case_dir, problem.test_case_id, "info")))
+        self.assertEqual(len(os.listdir(upload_dir)), 5)
+
+    def test_import_invalid_fps_problems(self):
+        resp, test_case_dir, upload_dir = self.import_fps(self.make_fps_file(5, invalid=3))
+        self.assertFailed(resp)
+        self.assertIn("problem 4/5", resp.data["data"])
+        self.assertFalse(Problem.objects.filter(_id__startswith="fps-").exists())
+        # 已经写入的测试用例和图片都被删除
+        self.assertEqual(os.listdir(test_case_dir), [])
+        self.assertEqual(os.listdir(upload_dir), [])
+
+    def test_import_fps_save_failed(self):
+        save_image = FPSHelper.save_image
+
+        def fail_one(helper, problem, *args, **kwargs):
+            result = save_image(helper, problem, *args, **kwargs)
+            if problem["title"] == "problem 2":
+                raise OSError("No space left on device")
+            return result
+
+        with mock.patch.object(FPSHelper, "save_image", fail_one):
+            resp, test_case_dir, upload_dir = self.import_fps(self.make_fps_file(5))
+        self.assertFailed(resp)
+        self.assertIn("problem 3/5", resp.data["data"])
+        self.assertFalse(Problem.objects.filter(_id__startswith="fps-").exists())
+        # 其他题和失败的题已经写入的文件都被删除
+        self.assertEqual(os.listdir(test_case_dir), [])
+        self.assertEqual(os.listdir(upload_dir), [])
+
+
 class ParseProblemTemplateTest(APITestCase):
     def test_parse(self):
         template_str = """
@@ -1,9 +1,11 @@
 import hashlib
 import json
+import logging
 import os
-# import shutil
+import shutil
 import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from wsgiref.util import FileWrapper
 
 from django.conf import settings
@@ -16,7 +18,8 @@ from contest.models import Contest, ContestStatus
 from fps.parser import FPSHelper, FPSParser
 from judge.dispatcher import SPJCompiler
 from options.options import SysOptions
-from submission.models import Submission, JudgeStatus
+from submission.models import ArchivedSubmission, Submission, JudgeStatus
+from submission.utils import SubmissionArchiveUnion, get_rank_type, rebuild_best_submission
 from utils.api import APIView, CSRFExemptAPIView, validate_serializer, APIError
 from utils.constants import Difficulty
 from utils.shortcuts import rand_str, natural_sort_key
@@ -30,6 +33,8 @@ from ..serializers import (CreateContestProblemSerializer, CompileSPJSerializer,
                            FPSProblemSerializer)
 from ..utils import TEMPLATE_BASE, build_problem_template
 
+logger = logging.getLogger(__name__)
+
 
 class TestCaseZipProcessor(object):
     def process_zip(self, uploaded_zip_file, spj, dir=""):
@@ -322,9 +327,13 @@ class ProblemAPI(ProblemBase):
         tags = data.pop("tags")
         data["languages"] = list(data["languages"])
 
+        rank_type = get_rank_type(problem)
         for k, v in data.items():
             setattr(problem, k, v)
         problem.save()
+        # 排名方式变化后, 每个用户的最优 AC 提交也会变化
+        if get_rank_type(problem) != rank_type:
+            rebuild_best_submission(problem)
 
         problem.tags.remove(*problem.tags.all())
         for tag in tags:
@@ -474,7 +483,8 @@ class ContestProblemAPI(ProblemBase):
         except Problem.DoesNotExist:
             return self.error("Problem does not exists")
         ensure_created_by(problem.contest, request.user)
-        if Submission.objects.filter(problem=problem).exists():
+        if Submission.objects.filter(problem=problem).exists() or \
+                ArchivedSubmission.objects.filter(problem=problem).exists():
             return self.error("Can't delete the problem as it has submissions")
         # d = os.path.join(settings.TEST_CASE_DIR, problem.test_case_id)
         # if os.path.isdir(d):
@@ -500,7 +510,7 @@ class MakeContestProblemPublicAPIView(APIView):
         if not problem.contest or problem.is_public:
             return self.error("Already be a public problem")
         problem.is_public = True
-        problem.save()
+        problem.save(update_fields=["is_public"])
         # https://docs.djangoproject.com/en/1.11/topics/db/queries/#copying-model-instances
         tags = problem.tags.all()
         problem.pk = None
@@ -546,11 +556,13 @@ class ExportProblemAPI(APIView):
     def choose_answers(self, user, problem):
         ret = []
         for item in problem.languages:
-            submission = Submission.objects.filter(problem=problem,
-                                                   user_id=user.id,
-                                                   language=item,
-                                                   result=JudgeStatus.ACCEPTED).order_by("-create_time").first()
-            if submission:
+            # 较早的 AC 提交可能已经归档
+            submissions = SubmissionArchiveUnion().filter(problem=problem,
+                                                          user_id=user.id,
+                                                          language=item,
+                                                          result=JudgeStatus.ACCEPTED) \
+                .prefetch_related("code_blob").order_by("-create_time")[:1]
+            for submission in submissions:
                 ret.append({"language": submission.language, "code": submission.code})
         return ret
 
@@ -673,8 +685,46 @@ class ImportProblemAPI(CSRFExemptAPIView, TestCaseZipProcessor):
 
 class FPSProblemImport(CSRFExemptAPIView):
     request_parsers = ()
-
-    def _create_problem(self, problem_data, creator):
+    # 写测试用例和图片的线程数, 以及每次 bulk_create 的条数
+    max_workers = 8
+    batch_size = 100
+
+    def _generate_display_ids(self, count):
+        # bulk_create 前一次性生成不冲突的 display id, 避免 (_id, contest) 唯一约束失败
+        display_ids = set()
+        while len(display_ids) < count:
+            candidates = {f"fps-{rand_str(4)}" for _ in range(count - len(display_ids))} - display_ids
+            exists = set(Problem.objects.filter(_id__in=candidates, contest__isnull=True).values_list("_id", flat=True))
+            display_ids |= candidates - exists
+        return list(display_ids)
+
+    def _save_files(self, helper, problem):
+        test_case_id = rand_str()
+        test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
+        os.mkdir(test_case_dir)
+        images = []
+        try:
+            score = []
+            for item in helper.save_test_case(problem, test_case_dir)["test_cases"].values():
+                score.append({"score": 0, "input_name": item["input_name"],
+                              "output_name": item.get("output_name")})
+            problem_data = helper.save_image(problem, settings.UPLOAD_DIR, settings.UPLOAD_PREFIX, saved_files=images)
+        except Exception:
+            # 只写了一部分的文件也要删除
+            self._delete_files([(test_case_id, None, None, images)])
+            raise
+        return test_case_id, score, problem_data, images
+
+    def _delete_files(self, saved):
+        for test_case_id, _, _, images in saved:
+            shutil.rmtree(os.path.join(settings.TEST_CASE_DIR, test_case_id), ignore_errors=True)
+            for path in images:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _build_problem(self, problem_data, creator, display_id, languages):
         if problem_data["time_limit"]["unit"] == "ms":
             time_limit = problem_data["time_limit"]["value"]
         else:
@@ -692,28 +742,28 @@ class FPSProblemImport(CSRFExemptAPIView):
                 our_lang = "Python3"
             template[our_lang] = TEMPLATE_BASE.format(prepend.get(lang, ""), t["code"], append.get(lang, ""))
         spj = problem_data["spj"] is not None
-        Problem.objects.create(_id=f"fps-{rand_str(4)}",
-                               title=problem_data["title"],
-                               description=problem_data["description"],
-                               input_description=problem_data["input"],
-                               output_description=problem_data["output"],
-                               hint=problem_data["hint"],
-                               test_case_score=problem_data["test_case_score"],
-                               time_limit=time_limit,
-                               memory_limit=problem_data["memory_limit"]["value"],
-                               samples=problem_data["samples"],
-                               template=template,
-                               rule_type=ProblemRuleType.ACM,
-                               source=problem_data.get("source", ""),
-                               spj=spj,
-                               spj_code=problem_data["spj"]["code"] if spj else None,
-                               spj_language=problem_data["spj"]["language"] if spj else None,
-                               spj_version=rand_str(8) if spj else "",
-                               visible=False,
-                               languages=SysOptions.language_names,
-                               created_by=creator,
-                               difficulty=Difficulty.MID,
-                               test_case_id=problem_data["test_case_id"])
+        return Problem(_id=display_id,
+                       title=problem_data["title"],
+                       description=problem_data["description"],
+                       input_description=problem_data["input"],
+                       output_description=problem_data["output"],
+                       hint=problem_data["hint"],
+                       test_case_score=problem_data["test_case_score"],
+                       time_limit=time_limit,
+                       memory_limit=problem_data["memory_limit"]["value"],
+                       samples=problem_data["samples"],
+                       template=template,
+                       rule_type=ProblemRuleType.ACM,
+                       source=problem_data.get("source", ""),
+                       spj=spj,
+                       spj_code=problem_data["spj"]["code"] if spj else None,
+                       spj_language=problem_data["spj"]["language"] if spj else None,
+                       spj_version=rand_str(8) if spj else "",
+                       visible=False,
+                       languages=languages,
+                       created_by=creator,
+                       difficulty=Difficulty.MID,
+                       test_case_id=problem_data["test_case_id"])
 
     def post(self, request):
         form = UploadProblemForm(request.POST, request.FILES)
@@ -731,21 +781,46 @@ class FPSProblemImport(CSRFExemptAPIView):
             return self.error("Parse upload file error")
 
         helper = FPSHelper()
-        with transaction.atomic():
-            for _problem in problems:
-                test_case_id = rand_str()
-                test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
-                os.mkdir(test_case_dir)
-                score = []
-                for item in helper.save_test_case(_problem, test_case_dir)["test_cases"].values():
-                    score.append({"score": 0, "input_name": item["input_name"],
-                                  "output_name": item.get("output_name")})
-                problem_data = helper.save_image(_problem, settings.UPLOAD_DIR, settings.UPLOAD_PREFIX)
-                s = FPSProblemSerializer(data=problem_data)
-                if not s.is_valid():
-                    return self.error(f"Parse FPS file error: {s.errors}")
-                problem_data = s.data
-                problem_data["test_case_id"] = test_case_id
-                problem_data["test_case_score"] = score
-                self._create_problem(problem_data, request.user)
-        return self.success({"import_count": len(problems)})
+        # 测试用例和图片的写入是 IO 密集的, 交给线程池并行处理; 校验和入库仍在当前线程
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._save_files, helper, item) for item in problems]
+        saved = []
+        error = None
+        for index, future in enumerate(futures):
+            try:
+                saved.append(future.result())
+            except Exception as e:
+                logger.exception(e)
+                if error is None:
+                    error = f"Failed to save files of problem {index + 1}/{len(problems)}: {e}"
+        if error:
+            # 任意一道题写入失败时整个文件都不导入, 其他题已经写入的文件一起删除
+            self._delete_files(saved)
+            return self.error(error)
+
+        languages = SysOptions.language_names
+        display_ids = self._generate_display_ids(len(saved))
+        problem_objs = []
+        for index, ((test_case_id, score, problem_data, _), display_id) in enumerate(zip(saved, display_ids)):
+            s = FPSProblemSerializer(data=problem_data)
+            if not s.is_valid():
+                # 一道题不合法时整个文件都不导入, 已经写入的测试用例和图片一起删除
+                self._delete_files(saved)
+                return self.error(f"Parse FPS file error in problem {index + 1}/{len(saved)}: {s.errors}")
+            problem_data = s.data
+            problem_data["test_case_id"] = test_case_id
+            problem_data["test_case_score"] = score
+            problem_objs.append(self._build_problem(problem_data, request.user, display_id, languages))
+
+        try:
+            with transaction.atomic():
+                for start in range(0, len(problem_objs), self.batch_size):
+                    Problem.objects.bulk_create(problem_objs[start:start + self.batch_size])
+                    logger.info("FPS import: %d/%d problems saved",
+                                min(start + self.batch_size, len(problem_objs)), len(problem_objs))
+        except Exception:
+            self._delete_files(saved)
+            raise
+        return self.success({"import_count": len(problem_objs),
+                             "test_case_count": sum(len(item[1]) for item in saved),
+                             "image_count": sum(len(item[3]) for item in saved)})
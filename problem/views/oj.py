@@ -1,6 +1,7 @@
 import random
 from django.db.models import Q, Count
 from utils.api import APIView
+from utils.throttling import rate_limit
 from account.decorators import check_contest_permission
 from ..models import ProblemTag, Problem, ProblemRuleType
 from ..serializers import ProblemSerializer, TagSerializer, ProblemSafeSerializer
@@ -45,6 +46,8 @@ class ProblemAPI(APIView):
                 else:
                     problem["my_status"] = oi_problems_status.get(str(problem["id"]), {}).get("status")
 
+    # icontains 搜索不能使用索引, 只限制带关键词的搜索
+    @rate_limit("problem_search", condition=lambda request: request.GET.get("keyword", "").strip())
     def get(self, request):
         # 问题详情页
         problem_id = request.GET.get("problem_id")
@@ -0,0 +1,139 @@
+"""
+判题详情(Submission.info)的紧凑编码
+
+JudgeServer 对每个测试点返回一个字段相同的 dict, 直接存 json 时每个测试点都要重复一遍字段名.
+这里按列存储: 整数列打包为定长的整数数组, 字符串列(以及 None)转为字符串字典里的下标,
+其他类型的列仍以 json 列表保存. 编码结果较大时再用 zlib 压缩.
+
+格式: MAGIC(2 字节) + 版本(1 字节) + 标志(1 字节) + 正文(可能经过压缩)
+正文: 头部长度(4 字节, 小端) + 头部 json + 各整数列的数据(小端)
+"""
+import array
+import json
+import struct
+import sys
+import zlib
+
+MAGIC = b"SI"
+VERSION = 1
+FLAG_COMPRESSED = 1
+# 正文超过这个大小才压缩, 太小时压缩反而更大
+COMPRESS_THRESHOLD = 256
+
+# 列的类型, 整数列和字符串列的数据放在头部之后, json 列直接放在头部里
+INT_COLUMN = "i"
+STRING_COLUMN = "s"
+JSON_COLUMN = "j"
+
+# 按占用从小到大尝试的整数数组类型
+_INT_TYPECODES = [(typecode, 2 ** (array.array(typecode).itemsize * 8 - 1)) for typecode in ("b", "h", "i", "q")]
+
+
+def _int_typecode(values):
+    low, high = min(values, default=0), max(values, default=0)
+    for typecode, bound in _INT_TYPECODES:
+        if -bound <= low and high < bound:
+            return typecode
+    return None
+
+
+def _pack_ints(values, typecode):
+    packed = array.array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack_ints(data, typecode):
+    packed = array.array(typecode)
+    packed.frombytes(data)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tolist()
+
+
+def _encode_rows(rows, header):
+    keys = list(rows[0].keys())
+    strings = {}
+    columns = []
+    blobs = []
+    for key in keys:
+        values = [row[key] for row in rows]
+        if all(type(value) is int for value in values):
+            typecode = _int_typecode(values)
+            if typecode:
+                columns.append([key, INT_COLUMN, typecode])
+                blobs.append(_pack_ints(values, typecode))
+                continue
+        elif all(value is None or isinstance(value, str) for value in values):
+            indexes = [-1 if value is None else strings.setdefault(value, len(strings)) for value in values]
+            typecode = _int_typecode(indexes)
+            columns.append([key, STRING_COLUMN, typecode])
+            blobs.append(_pack_ints(indexes, typecode))
+            continue
+        columns.append([key, JSON_COLUMN, values])
+    header["rows"] = len(rows)
+    header["columns"] = columns
+    header["strings"] = list(strings)
+    return b"".join(blobs)
+
+
+def _is_columnar(data):
+    if not isinstance(data, list) or not data or not all(isinstance(row, dict) for row in data):
+        return False
+    keys = list(data[0].keys())
+    return all(list(row.keys()) == keys for row in data)
+
+
+def encode_info(info):
+    """
+    info 的 data 字段是字段相同的测试点列表时按列编码, 否则整体以 json 保存在头部
+    """
+    header = {}
+    blob = b""
+    if isinstance(info, dict) and _is_columnar(info.get("data")):
+        header["info"] = {k: v for k, v in info.items() if k != "data"}
+        blob = _encode_rows(info["data"], header)
+    else:
+        header["raw"] = info
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    body = struct.pack("<I", len(header_bytes)) + header_bytes + blob
+    flags = 0
+    if len(body) > COMPRESS_THRESHOLD:
+        compressed = zlib.compress(body)
+        if len(compressed) < len(body):
+            body = compressed
+            flags |= FLAG_COMPRESSED
+    return MAGIC + bytes((VERSION, flags)) + body
+
+
+def decode_info(data):
+    data = bytes(data)
+    if data[:2] != MAGIC or data[2] != VERSION:
+        raise ValueError("Invalid submission info encoding")
+    body = data[4:]
+    if data[3] & FLAG_COMPRESSED:
+        body = zlib.decompress(body)
+    header_size = struct.unpack_from("<I", body)[0]
+    header = json.loads(body[4:4 + header_size].decode("utf-8"))
+    if "raw" in header:
+        return header["raw"]
+
+    rows = header["rows"]
+    strings = header["strings"]
+    offset = 4 + header_size
+    columns = []
+    for key, column_type, extra in header["columns"]:
+        if column_type == JSON_COLUMN:
+            columns.append((key, extra))
+            continue
+        size = array.array(extra).itemsize * rows
+        values = _unpack_ints(body[offset:offset + size], extra)
+        offset += size
+        if column_type == STRING_COLUMN:
+            values = [None if index == -1 else strings[index] for index in values]
+        columns.append((key, values))
+
+    info = header["info"]
+    info["data"] = [{key: values[index] for key, values in columns} for index in range(rows)]
+    return info
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-19 04:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0014_problem_share_submission'),
+        ('submission', '0012_auto_20180501_0436'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProblemBestSubmission',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField()),
+                ('username', models.TextField()),
+                ('result', models.IntegerField()),
+                ('rank_group', models.IntegerField()),
+                ('time_cost', models.IntegerField(null=True)),
+                ('memory_cost', models.BigIntegerField(null=True)),
+                ('create_time', models.DateTimeField()),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='problem.problem')),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='submission.submission')),
+            ],
+            options={
+                'db_table': 'problem_best_submission',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='problembestsubmission',
+            index=models.Index(fields=['problem', 'rank_group', 'time_cost', '-create_time'], name='problem_bes_problem_dd6e83_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='problembestsubmission',
+            index=models.Index(fields=['problem', 'rank_group', 'memory_cost', '-create_time'], name='problem_bes_problem_94bc13_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='problembestsubmission',
+            unique_together={('problem', 'user_id')},
+        ),
+    ]
@@ -0,0 +1,68 @@
+from django.db import migrations
+from django.db.models import Case, F, FloatField, IntegerField, Value, When
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast
+
+import json
+
+ACCEPTED = 0
+EXPIRED = -3
+
+
+def _rank_cost_key(spj_code):
+    rank_type = "time"
+    if spj_code:
+        try:
+            rank_type = json.loads(spj_code).get("rank_type", "time")
+        except Exception:
+            pass
+    return "memory_cost" if rank_type == "memory" else "time_cost"
+
+
+def _rank_group(result):
+    if result == ACCEPTED:
+        return 0
+    if result == EXPIRED:
+        return 2
+    return 1
+
+
+def fill_best_submission(apps, schema_editor):
+    Problem = apps.get_model("problem", "Problem")
+    Submission = apps.get_model("submission", "Submission")
+    ProblemBestSubmission = apps.get_model("submission", "ProblemBestSubmission")
+
+    rank_group = Case(When(result=ACCEPTED, then=Value(0)),
+                      When(result=EXPIRED, then=Value(2)),
+                      default=Value(1), output_field=IntegerField())
+    for problem in Problem.objects.filter(contest__isnull=True).only("id", "spj_code").iterator():
+        cost = Cast(KeyTextTransform(_rank_cost_key(problem.spj_code), "statistic_info"), FloatField())
+        ac_cost = Case(When(result=ACCEPTED, then=cost), output_field=FloatField())
+        best = Submission.objects.filter(problem_id=problem.id, contest__isnull=True) \
+            .only("id", "user_id", "username", "result", "statistic_info", "create_time") \
+            .annotate(best_rank_group=rank_group, best_ac_cost=ac_cost) \
+            .order_by("user_id", "best_rank_group", F("best_ac_cost").asc(nulls_last=True), "-create_time") \
+            .distinct("user_id")
+        ProblemBestSubmission.objects.bulk_create(
+            [ProblemBestSubmission(problem_id=problem.id,
+                                   user_id=item.user_id,
+                                   username=item.username,
+                                   submission_id=item.id,
+                                   result=item.result,
+                                   rank_group=_rank_group(item.result),
+                                   time_cost=item.statistic_info.get("time_cost"),
+                                   memory_cost=item.statistic_info.get("memory_cost"),
+                                   create_time=item.create_time)
+             for item in best.iterator()],
+            batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission', '0013_problembestsubmission'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_best_submission, reverse_code=migrations.RunPython.noop)
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.25 on 2026-10-19 04:06
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # submission 是最大的表, 索引用 CREATE INDEX CONCURRENTLY 创建, 不阻塞写入, 不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('submission', '0014_fill_problem_best_submission'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['-create_time'], name='submission_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(condition=models.Q(('contest__isnull', True)), fields=['user_id', '-create_time'], name='submission_public_user_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['problem', 'user_id', '-create_time'], name='submission_problem_user_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['contest', '-create_time', '-id'], name='submission_contest_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['contest', 'problem', '-create_time'], name='submission_contest_prob_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['contest', 'user_id', '-create_time'], name='submission_contest_user_idx'),
+        ),
+        # 新的联合索引建好之后再删除 contest 和 problem 的单列索引. 直接 AlterField 会重建外键约束并扫描全表,
+        # 数据库中只删除索引
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL('DROP INDEX CONCURRENTLY IF EXISTS "submission_contest_id_775716d5"',
+                                  'CREATE INDEX CONCURRENTLY "submission_contest_id_775716d5" ON "submission" ("contest_id")'),
+                migrations.RunSQL('DROP INDEX CONCURRENTLY IF EXISTS "submission_problem_id_76847b55"',
+                                  'CREATE INDEX CONCURRENTLY "submission_problem_id_76847b55" ON "submission" ("problem_id")'),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='submission',
+                    name='contest',
+                    field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='contest.contest'),
+                ),
+                migrations.AlterField(
+                    model_name='submission',
+                    name='problem',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='problem.problem'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,79 @@
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+
+# submission 是最大的表, 按 id 分批迁移, 每一批在单独的事务中, 不会长时间锁住整个表
+BATCH_SIZE = 5000
+CODE_HASH = "encode(sha256(convert_to(code, 'UTF8')), 'hex')"
+
+
+def _batches(schema_editor):
+    last_id = ""
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                cursor.execute("SELECT id FROM submission WHERE id > %s ORDER BY id LIMIT %s", [last_id, BATCH_SIZE])
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    return
+                yield cursor, ids
+            last_id = ids[-1]
+
+
+def split_code_and_info(apps, schema_editor):
+    for cursor, ids in _batches(schema_editor):
+        cursor.execute(f"INSERT INTO submission_code (hash, code) SELECT DISTINCT ON (1) {CODE_HASH}, code "
+                       "FROM submission WHERE id = ANY(%s) ON CONFLICT DO NOTHING", [ids])
+        cursor.execute(f"UPDATE submission SET code_hash = {CODE_HASH} WHERE id = ANY(%s)", [ids])
+        cursor.execute("INSERT INTO submission_detail (submission_id, info) "
+                       "SELECT id, info FROM submission WHERE id = ANY(%s) AND info <> '{}'::jsonb", [ids])
+
+
+def merge_code_and_info(apps, schema_editor):
+    for cursor, ids in _batches(schema_editor):
+        cursor.execute("UPDATE submission SET code = submission_code.code FROM submission_code "
+                       "WHERE submission_code.hash = submission.code_hash AND submission.id = ANY(%s)", [ids])
+        cursor.execute("UPDATE submission SET info = submission_detail.info FROM submission_detail "
+                       "WHERE submission_detail.submission_id = submission.id AND submission.id = ANY(%s)", [ids])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('submission', '0015_submission_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionCode',
+            fields=[
+                ('hash', models.TextField(primary_key=True, serialize=False)),
+                ('code', models.TextField()),
+            ],
+            options={
+                'db_table': 'submission_code',
+            },
+        ),
+        migrations.CreateModel(
+            name='SubmissionDetail',
+            fields=[
+                ('submission', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='detail', serialize=False, to='submission.submission')),
+                ('info', models.JSONField(default=dict)),
+            ],
+            options={
+                'db_table': 'submission_detail',
+            },
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='code_blob',
+            field=models.ForeignKey(db_column='code_hash', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='submission.submissioncode'),
+        ),
+        # 0017 中删除 code 字段前先允许为空, 回滚时重新加上的 code 字段才能在填充数据前为空
+        migrations.AlterField(
+            model_name='submission',
+            name='code',
+            field=models.TextField(null=True),
+        ),
+        migrations.RunPython(split_code_and_info, reverse_code=merge_code_and_info),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission', '0016_submission_code_detail'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='submission',
+            name='code',
+        ),
+        migrations.RemoveField(
+            model_name='submission',
+            name='info',
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='code_blob',
+            field=models.ForeignKey(db_column='code_hash', on_delete=django.db.models.deletion.PROTECT, related_name='+', to='submission.submissioncode'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations, models
+
+from submission.encoding import decode_info, encode_info
+
+
+def encode_existing_info(apps, schema_editor):
+    SubmissionDetail = apps.get_model("submission", "SubmissionDetail")
+    batch = []
+    for detail in SubmissionDetail.objects.iterator(chunk_size=1000):
+        detail.encoded_info = encode_info(detail.info)
+        batch.append(detail)
+        if len(batch) == 1000:
+            SubmissionDetail.objects.bulk_update(batch, ["encoded_info"])
+            batch = []
+    SubmissionDetail.objects.bulk_update(batch, ["encoded_info"])
+
+
+def decode_existing_info(apps, schema_editor):
+    SubmissionDetail = apps.get_model("submission", "SubmissionDetail")
+    batch = []
+    for detail in SubmissionDetail.objects.iterator(chunk_size=1000):
+        detail.info = decode_info(detail.encoded_info)
+        batch.append(detail)
+        if len(batch) == 1000:
+            SubmissionDetail.objects.bulk_update(batch, ["info"])
+            batch = []
+    SubmissionDetail.objects.bulk_update(batch, ["info"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission', '0017_remove_submission_code_info'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submissiondetail',
+            name='encoded_info',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='submissiondetail',
+            name='info',
+            field=models.JSONField(default=dict, null=True),
+        ),
+        migrations.RunPython(encode_existing_info, reverse_code=decode_existing_info),
+        migrations.RemoveField(
+            model_name='submissiondetail',
+            name='info',
+        ),
+        migrations.AlterField(
+            model_name='submissiondetail',
+            name='encoded_info',
+            field=models.BinaryField(),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.2.25 on 2026-10-19 04:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+import utils.shortcuts
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0014_problem_share_submission'),
+        ('contest', '0010_auto_20190326_0201'),
+        ('submission', '0018_encode_submission_info'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedSubmission',
+            fields=[
+                ('id', models.TextField(db_index=True, default=utils.shortcuts.rand_str, primary_key=True, serialize=False)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('user_id', models.IntegerField(db_index=True)),
+                ('username', models.TextField()),
+                ('result', models.IntegerField(db_index=True, default=6)),
+                ('language', models.TextField()),
+                ('shared', models.BooleanField(default=False)),
+                ('statistic_info', models.JSONField(default=dict)),
+                ('ip', models.TextField(null=True)),
+                ('encoded_info', models.BinaryField(null=True)),
+                ('code_blob', models.ForeignKey(db_column='code_hash', on_delete=django.db.models.deletion.PROTECT, related_name='+', to='submission.submissioncode')),
+                ('contest', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='contest.contest')),
+                ('problem', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='problem.problem')),
+            ],
+            options={
+                'db_table': 'submission_archive',
+                'ordering': ('-create_time',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedsubmission',
+            index=models.Index(fields=['-create_time'], name='submission_archive_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedsubmission',
+            index=models.Index(fields=['problem', 'user_id', '-create_time'], name='submission_archive_prob_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedsubmission',
+            index=models.Index(fields=['contest', '-create_time', '-id'], name='submission_archive_contest_idx'),
+        ),
+    ]
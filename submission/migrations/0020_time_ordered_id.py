@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-19 04:28
+
+from django.db import migrations, models
+import utils.shortcuts
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission', '0019_archivedsubmission'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedsubmission',
+            name='id',
+            field=models.TextField(db_index=True, default=utils.shortcuts.time_ordered_id, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='id',
+            field=models.TextField(db_index=True, default=utils.shortcuts.time_ordered_id, primary_key=True, serialize=False),
+        ),
+    ]
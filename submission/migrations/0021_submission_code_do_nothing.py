@@ -0,0 +1,22 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission', '0020_time_ordered_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedsubmission',
+            name='code_blob',
+            field=models.ForeignKey(db_column='code_hash', on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='submission.submissioncode'),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='code_blob',
+            field=models.ForeignKey(db_column='code_hash', on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='submission.submissioncode'),
+        ),
+    ]
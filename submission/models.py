@@ -1,11 +1,14 @@
-from django.db import models
+import hashlib
+
+from django.db import connection, models, transaction
 
 from utils.constants import ContestStatus
 from utils.models import JSONField
 from problem.models import Problem
 from contest.models import Contest
 
-from utils.shortcuts import rand_str
+from utils.shortcuts import time_ordered_id
+from .encoding import decode_info, encode_info
 
 
 class JudgeStatus:
@@ -23,17 +26,69 @@ class JudgeStatus:
     PARTIALLY_ACCEPTED = 8
 
 
-class Submission(models.Model):
-    id = models.TextField(default=rand_str, primary_key=True, db_index=True)
-    contest = models.ForeignKey(Contest, null=True, on_delete=models.CASCADE)
-    problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
+class SubmissionCode(models.Model):
+    """
+    按内容的 sha256 存储提交的代码, 相同的代码(比如直接提交的模板)只存一份, 不随提交删除.
+    不再被任何提交引用的代码由 submission.utils.delete_orphaned_code 定期清理
+    """
+    hash = models.TextField(primary_key=True)
+    code = models.TextField()
+
+    # 清理时持有排他的 advisory lock, 写入引用代码的提交时持有共享锁, 刚被引用的代码不会被删掉
+    LOCK_KEY = int.from_bytes(b"sub_code", "big")
+
+    @staticmethod
+    def hash_code(code):
+        return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def lock(cls, shared=True):
+        """
+        必须在事务中调用, 事务结束时释放
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT pg_advisory_xact_lock{'_shared' if shared else ''}(%s)", [cls.LOCK_KEY])
+
+    class Meta:
+        db_table = "submission_code"
+
+
+class SubmissionDetail(models.Model):
+    """
+    从JudgeServer返回的判题详情, 只在查看单个提交时需要, 没有判题详情的提交没有对应的记录
+    按列编码后保存, 见 submission.encoding
+    """
+    submission = models.OneToOneField("Submission", primary_key=True, on_delete=models.CASCADE,
+                                      related_name="detail")
+    encoded_info = models.BinaryField()
+
+    @property
+    def info(self):
+        return decode_info(self.encoded_info)
+
+    @info.setter
+    def info(self, value):
+        self.encoded_info = encode_info(value)
+
+    class Meta:
+        db_table = "submission_detail"
+
+
+class AbstractSubmission(models.Model):
+    """
+    submission 和 submission_archive 共用的字段, 两个表的字段顺序相同, 可以直接 union
+    """
+    # 早期的提交 id 是 rand_str() 生成的随机字符串, 新的提交 id 按时间递增, 见 time_ordered_id()
+    id = models.TextField(default=time_ordered_id, primary_key=True, db_index=True)
+    # contest 和 problem 的单列索引由 Meta.indexes 中以它们开头的联合索引代替
+    contest = models.ForeignKey(Contest, null=True, on_delete=models.CASCADE, db_index=False)
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE, db_index=False)
     create_time = models.DateTimeField(auto_now_add=True)
     user_id = models.IntegerField(db_index=True)
     username = models.TextField()
-    code = models.TextField()
+    # 代码的删除由 delete_orphaned_code 负责, 数据库的外键约束保证不会删除还在引用的代码
+    code_blob = models.ForeignKey(SubmissionCode, db_column="code_hash", on_delete=models.DO_NOTHING, related_name="+")
     result = models.IntegerField(db_index=True, default=JudgeStatus.PENDING)
-    # 从JudgeServer返回的判题详情
-    info = JSONField(default=dict)
     language = models.TextField()
     shared = models.BooleanField(default=False)
     # 存储该提交所用时间和内存值，方便提交列表显示
@@ -41,6 +96,22 @@ class Submission(models.Model):
     statistic_info = JSONField(default=dict)
     ip = models.TextField(null=True)
 
+    _code = None
+    _code_changed = False
+    _info = None
+
+    @property
+    def code(self):
+        if self._code is None:
+            self._code = self.code_blob.code
+        return self._code
+
+    @code.setter
+    def code(self, value):
+        self._code = value
+        self._code_changed = True
+        self.code_blob_id = SubmissionCode.hash_code(value)
+
     def check_user_permission(self, user, check_share=True):
         if self.user_id == user.id or user.is_super_admin() or user.can_mgmt_all_problem() or self.problem.created_by_id == user.id:
             return True
@@ -54,9 +125,146 @@ class Submission(models.Model):
             return True
         return False
 
+    class Meta:
+        abstract = True
+
+
+class Submission(AbstractSubmission):
+    """
+    code 和 info 不在 submission 表中, 而是分别存在 SubmissionCode 和 SubmissionDetail 里,
+    列表和排名的查询只读取较窄的 submission 表. 这两个属性在第一次访问时才加载,
+    需要时可以 select_related("code_blob", "detail") 一次取回, 赋值后在 save() 时写入
+    """
+    _info_changed = False
+
+    @property
+    def info(self):
+        if self._info is None:
+            if self._state.adding:
+                self._info = {}
+            else:
+                try:
+                    self._info = self.detail.info
+                except SubmissionDetail.DoesNotExist:
+                    self._info = {}
+        return self._info
+
+    @info.setter
+    def info(self, value):
+        self._info = value
+        self._info_changed = True
+
+    def has_info(self):
+        """
+        是否已经有判题详情, 不加载详情本身
+        """
+        if self._info is not None:
+            return bool(self._info)
+        return SubmissionDetail.objects.filter(submission_id=self.id).exists()
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            save_code = "code" in update_fields
+            save_info = "info" in update_fields
+            update_fields -= {"code", "info"}
+            if save_code:
+                update_fields.add("code_blob")
+            kwargs["update_fields"] = update_fields
+        else:
+            save_code = self._code_changed
+            save_info = self._info_changed
+        if save_code:
+            # 写入代码和引用它的提交在同一个事务中, 期间不会被 delete_orphaned_code 删除
+            with transaction.atomic():
+                SubmissionCode.lock(shared=True)
+                SubmissionCode.objects.get_or_create(hash=self.code_blob_id, defaults={"code": self._code})
+                self._save_submission(save_info, *args, **kwargs)
+            self._code_changed = False
+        else:
+            self._save_submission(save_info, *args, **kwargs)
+
+    def _save_submission(self, save_info, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if save_info:
+            # 判题详情为空时不保留记录, 与 has_info() 的判断一致
+            if self._info:
+                SubmissionDetail.objects.update_or_create(submission_id=self.id,
+                                                          defaults={"encoded_info": encode_info(self._info)})
+            elif not adding:
+                SubmissionDetail.objects.filter(submission_id=self.id).delete()
+            self._info_changed = False
+
     class Meta:
         db_table = "submission"
         ordering = ("-create_time",)
+        indexes = [
+            # 提交列表和 dashboard 的当日提交数
+            models.Index(fields=["-create_time"], name="submission_time_idx"),
+            # 非比赛的 "我的提交"
+            models.Index(fields=["user_id", "-create_time"], name="submission_public_user_idx",
+                         condition=models.Q(contest__isnull=True)),
+            # SubmissionExistsAPI, 导出题目时选择答案, 更新用户最优提交
+            models.Index(fields=["problem", "user_id", "-create_time"], name="submission_problem_user_idx"),
+            # 比赛提交列表(包括游标分页), 按题目或用户筛选, 以及下载比赛的 AC 代码
+            models.Index(fields=["contest", "-create_time", "-id"], name="submission_contest_time_idx"),
+            models.Index(fields=["contest", "problem", "-create_time"], name="submission_contest_prob_idx"),
+            models.Index(fields=["contest", "user_id", "-create_time"], name="submission_contest_user_idx"),
+        ]
 
     def __str__(self):
         return self.id
+
+
+class ArchivedSubmission(AbstractSubmission):
+    """
+    超过一定时间的提交由 archive_submissions 命令从 submission 表移到这里, 判题详情直接存在同一行中.
+    每个用户在非比赛题目上的最优提交(ProblemBestSubmission)不归档. 题目, 用户和比赛排名的统计数据是单独存储的, 不受影响
+    """
+    encoded_info = models.BinaryField(null=True)
+
+    @property
+    def info(self):
+        if self._info is None:
+            self._info = decode_info(self.encoded_info) if self.encoded_info is not None else {}
+        return self._info
+
+    def has_info(self):
+        return self.encoded_info is not None
+
+    class Meta:
+        db_table = "submission_archive"
+        ordering = ("-create_time",)
+        indexes = [
+            models.Index(fields=["-create_time"], name="submission_archive_time_idx"),
+            models.Index(fields=["problem", "user_id", "-create_time"], name="submission_archive_prob_idx"),
+            models.Index(fields=["contest", "-create_time", "-id"], name="submission_archive_contest_idx"),
+        ]
+
+
+class ProblemBestSubmission(models.Model):
+    """
+    非比赛题目中每个用户的最优提交, 判题结束后由 JudgeDispatcher 更新, 用于提交列表中按耗时或内存的排名
+    数据异常时可以用 python manage.py rebuild_best_submission 重新生成
+    """
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
+    user_id = models.IntegerField()
+    username = models.TextField()
+    submission = models.ForeignKey(Submission, on_delete=models.CASCADE)
+    result = models.IntegerField()
+    # 0: AC, 1: 未过期的非 AC 提交, 2: 过期的提交, 排名时先按此字段升序
+    rank_group = models.IntegerField()
+    time_cost = models.IntegerField(null=True)
+    memory_cost = models.BigIntegerField(null=True)
+    # 最优提交的提交时间
+    create_time = models.DateTimeField()
+
+    class Meta:
+        db_table = "problem_best_submission"
+        unique_together = (("problem", "user_id"),)
+        indexes = [
+            models.Index(fields=["problem", "rank_group", "time_cost", "-create_time"]),
+            models.Index(fields=["problem", "rank_group", "memory_cost", "-create_time"]),
+        ]
@@ -17,19 +17,22 @@ class ShareSubmissionSerializer(serializers.Serializer):
 
 
 class SubmissionModelSerializer(serializers.ModelSerializer):
+    code = serializers.CharField(read_only=True)
+    info = serializers.JSONField(read_only=True)
 
     class Meta:
         model = Submission
-        fields = "__all__"
+        exclude = ("code_blob",)
 
 
 # 不显示submission info的serializer, 用于ACM rule_type
 class SubmissionSafeModelSerializer(serializers.ModelSerializer):
     problem = serializers.SlugRelatedField(read_only=True, slug_field="_id")
+    code = serializers.CharField(read_only=True)
 
     class Meta:
         model = Submission
-        exclude = ("info", "contest", "ip")
+        exclude = ("code_blob", "contest", "ip")
 
 
 class SubmissionListSerializer(serializers.ModelSerializer):
@@ -42,7 +45,7 @@ class SubmissionListSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Submission
-        exclude = ("info", "contest", "code", "ip")
+        exclude = ("code_blob", "contest", "ip")
 
     def get_show_link(self, obj):
         # 没传user或为匿名user
@@ -0,0 +1,94 @@
+"""
+通过 redis pub/sub 推送提交的状态变化, 客户端用长轮询代替每秒请求一次 SubmissionAPI
+
+判题过程中每次状态变化(开始判题, 得到最终结果)都会向 submission_status:<id> 频道发布一条消息.
+redis 不可用或者同时等待的请求太多时, 长轮询立即返回当前状态, 客户端退回到普通的轮询
+"""
+import json
+import logging
+import time
+
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.long_poll import LongPollSlot
+
+logger = logging.getLogger(__name__)
+
+
+def _channel(submission_id):
+    return f"{CacheKey.submission_status}:{submission_id}"
+
+
+def publish_submission_status(submission_id, result, statistic_info=None):
+    data = {"id": submission_id, "result": result}
+    if statistic_info and "score" in statistic_info:
+        data["score"] = statistic_info["score"]
+    try:
+        cache.publish(_channel(submission_id), json.dumps(data))
+    except Exception as e:
+        # 推送失败不影响判题, 客户端还可以轮询
+        logger.exception(e)
+
+
+class SubmissionStatusSubscription:
+    """
+    # 先读取一次状态, 只在需要等待时订阅
+    with SubmissionStatusSubscription(ids) as subscription:
+        # 订阅之后再读取当前状态, 不会漏掉两者之间的状态变化
+        ...
+        if subscription.available:
+            subscription.wait(timeout)
+    """
+
+    def __init__(self, submission_ids):
+        self.submission_ids = submission_ids
+        self.pubsub = None
+        self._slot = LongPollSlot()
+
+    @property
+    def available(self):
+        return self.pubsub is not None
+
+    def __enter__(self):
+        # 没有要等待的提交时 subscribe() 会报错, 也不需要占用名额
+        if not self.submission_ids or not self._slot.acquire():
+            return self
+        pubsub = None
+        try:
+            pubsub = cache.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(*[_channel(item) for item in self.submission_ids])
+            self.pubsub = pubsub
+        except Exception as e:
+            logger.exception(e)
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            self._slot.release()
+        return self
+
+    def wait(self, timeout):
+        """
+        等待任意一个提交的状态变化, 超时返回 False
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                message = self.pubsub.get_message(timeout=remaining)
+                if message and message["type"] == "message":
+                    return True
+        except Exception as e:
+            logger.exception(e)
+            return False
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.pubsub is not None:
+            try:
+                self.pubsub.close()
+            except Exception:
+                pass
+        self._slot.release()
@@ -1,9 +1,34 @@
+import json
+import os
+import re
+import threading
+import time
 from copy import deepcopy
+from datetime import timedelta
 from unittest import mock
 
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from account.models import User
+from contest.models import Contest, ContestRuleType
+from contest.views.admin import DownloadContestSubmissions
+from options.options import SysOptions
 from problem.models import Problem, ProblemTag
+from problem.views.admin import ExportProblemAPI
 from utils.api.tests import APITestCase
-from .models import Submission
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.shortcuts import is_time_ordered_id, rand_str
+from utils.throttling import TokenBucket, consume_buckets
+from .encoding import decode_info, encode_info
+from .status import publish_submission_status
+from .models import (ArchivedSubmission, JudgeStatus, ProblemBestSubmission, Submission, SubmissionCode,
+                     SubmissionDetail)
+from .utils import archive_submissions, delete_orphaned_code, rebuild_best_submission, update_best_submission
+from .views.oj import SubmissionListAPI
 
 DEFAULT_PROBLEM_DATA = {"_id": "A-110", "title": "test", "description": "<p>test</p>", "input_description": "test",
                         "output_description": "test", "time_limit": 1000, "memory_limit": 256, "difficulty": "Low",
@@ -56,6 +81,172 @@ class SubmissionListTest(SubmissionPrepare):
         resp = self.client.get(self.url, data={"limit": "10"})
         self.assertSuccess(resp)
 
+    def _submit(self, user_id, username, result, time_cost=None, memory_cost=None):
+        statistic_info = {}
+        if time_cost is not None:
+            statistic_info["time_cost"] = time_cost
+        if memory_cost is not None:
+            statistic_info["memory_cost"] = memory_cost
+        data = deepcopy(self.submission_data)
+        data.update({"user_id": user_id, "username": username, "result": result, "statistic_info": statistic_info})
+        submission = Submission.objects.create(**data)
+        # 与判题结束后 JudgeDispatcher 的行为一致
+        update_best_submission(self.problem, user_id)
+        return submission
+
+    def _prepare_rank(self):
+        Submission.objects.all().delete()
+        fast = self._submit(2, "fast", JudgeStatus.ACCEPTED, time_cost=10, memory_cost=300)
+        self._submit(2, "fast", JudgeStatus.ACCEPTED, time_cost=50, memory_cost=100)
+        self._submit(3, "slow", JudgeStatus.WRONG_ANSWER, time_cost=1)
+        slow = self._submit(3, "slow", JudgeStatus.ACCEPTED, time_cost=30, memory_cost=200)
+        self._submit(4, "wrong", JudgeStatus.WRONG_ANSWER, time_cost=5)
+        wrong = self._submit(4, "wrong", JudgeStatus.COMPILE_ERROR)
+        self._submit(4, "wrong", JudgeStatus.EXPIRED)
+        late = self._submit(5, "late", JudgeStatus.EXPIRED)
+        return fast, slow, wrong, late
+
+    def test_best_submission_rank(self):
+        fast, slow, wrong, late = self._prepare_rank()
+        resp = self.client.get(self.url, data={"limit": "10", "problem_id": self.problem._id})
+        self.assertSuccess(resp)
+        data = resp.data["data"]
+        self.assertEqual(data["total"], 4)
+        self.assertEqual([(item["id"], item["rank"]) for item in data["results"]],
+                         [(fast.id, 1), (slow.id, 2), (wrong.id, 3), (late.id, 4)])
+
+    def test_best_submission_rank_by_memory(self):
+        self.problem.spj_code = '{"rank_type": "memory"}'
+        self.problem.save()
+        fast, slow, _, _ = self._prepare_rank()
+        resp = self.client.get(self.url, data={"limit": "10", "problem_id": self.problem._id})
+        self.assertSuccess(resp)
+        results = resp.data["data"]["results"]
+        self.assertEqual(results[0]["username"], "fast")
+        self.assertEqual(results[0]["statistic_info"]["memory_cost"], 100)
+        self.assertEqual(results[1]["id"], slow.id)
+
+    def test_best_submission_rank_filter_and_page(self):
+        self._prepare_rank()
+        resp = self.client.get(self.url, data={"limit": "1", "problem_id": self.problem._id, "username": "WRO"})
+        self.assertEqual([(item["username"], item["rank"]) for item in resp.data["data"]["results"]], [("wrong", 3)])
+
+        resp = self.client.get(self.url, data={"limit": "2", "page": "2", "problem_id": self.problem._id})
+        data = resp.data["data"]
+        self.assertEqual(data["total"], 4)
+        self.assertEqual([item["rank"] for item in data["results"]], [3, 4])
+
+        resp = self.client.get(self.url, data={"limit": "2", "page": "100", "problem_id": self.problem._id,
+                                               "result": str(JudgeStatus.ACCEPTED)})
+        self.assertEqual([item["rank"] for item in resp.data["data"]["results"]], [1, 2])
+
+    def test_get_submission_list_with_count_limit(self):
+        for _ in range(3):
+            Submission.objects.create(**self.submission_data)
+        with mock.patch.object(SubmissionListAPI, "pagination_count_limit", 2):
+            resp = self.client.get(self.url, data={"limit": "2"})
+        self.assertSuccess(resp)
+        # 超过上限时是查询计划中的估算值, 不小于上限
+        self.assertGreaterEqual(resp.data["data"]["total"], 2)
+        self.assertTrue(resp.data["data"]["total_approximate"])
+        self.assertEqual(len(resp.data["data"]["results"]), 2)
+
+        resp = self.client.get(self.url, data={"limit": "2"})
+        self.assertEqual(resp.data["data"]["total"], 4)
+        self.assertNotIn("total_approximate", resp.data["data"])
+
+    def test_get_submission_list_beyond_count_limit(self):
+        ids = [self.submission.id] + [Submission.objects.create(**self.submission_data).id for _ in range(3)]
+        with mock.patch.object(SubmissionListAPI, "pagination_count_limit", 2):
+            resp = self.client.get(self.url, data={"limit": "1", "page": "4"})
+            self.assertSuccess(resp)
+            data = resp.data["data"]
+            self.assertTrue(data["total_approximate"])
+            # 超过计数上限的页仍然可以访问, 最早的提交在最后一页
+            self.assertEqual([(item["id"], item["rank"]) for item in data["results"]], [(ids[0], 4)])
+            self.assertFalse(data["has_next"])
+            self.assertTrue(self.client.get(self.url, data={"limit": "1", "page": "3"}).data["data"]["has_next"])
+            self.assertEqual(self.client.get(self.url, data={"limit": "1", "page": "5"}).data["data"]["results"], [])
+
+            # 带过滤条件的查询也使用查询计划估算
+            resp = self.client.get(self.url, data={"limit": "1", "result": str(self.submission.result)})
+            self.assertTrue(resp.data["data"]["total_approximate"])
+            self.assertGreaterEqual(resp.data["data"]["total"], 2)
+
+    def test_update_best_submission_locked(self):
+        with CaptureQueriesContext(connection) as context:
+            update_best_submission(self.problem, 1)
+        sql = [query["sql"] for query in context.captured_queries]
+        # 先拿到锁, 再在同一个事务中查找和写入最优提交
+        lock = next(index for index, item in enumerate(sql) if "pg_advisory_xact_lock" in item)
+        self.assertLess(lock, next(index for index, item in enumerate(sql) if 'FROM "submission"' in item))
+        self.assertTrue(ProblemBestSubmission.objects.filter(problem_id=self.problem.id, user_id=1).exists())
+
+    def test_rebuild_best_submission(self):
+        self._prepare_rank()
+        fields = ("user_id", "submission_id", "result", "rank_group", "time_cost", "memory_cost")
+        expected = list(ProblemBestSubmission.objects.order_by("user_id").values_list(*fields))
+        ProblemBestSubmission.objects.all().delete()
+        rebuild_best_submission(self.problem)
+        self.assertEqual(list(ProblemBestSubmission.objects.order_by("user_id").values_list(*fields)), expected)
+        self.assertEqual(len(expected), 4)
+
+    def _archive_all(self):
+        return archive_submissions(timezone.now() + timedelta(seconds=1))
+
+    def test_archive_submissions(self):
+        self._prepare_rank()
+        best_ids = set(ProblemBestSubmission.objects.values_list("submission_id", flat=True))
+        archived = Submission.objects.exclude(id__in=best_ids).first()
+        archived.info = {"err": None, "data": [{"test_case": "1", "result": 0}]}
+        archived.save()
+        rank = self.client.get(self.url, data={"limit": "10", "problem_id": self.problem._id}).data["data"]
+
+        self.assertEqual(self._archive_all(), 4)
+        self.assertEqual(set(Submission.objects.values_list("id", flat=True)), best_ids)
+        self.assertEqual(ArchivedSubmission.objects.count(), 4)
+        self.assertFalse(SubmissionDetail.objects.filter(submission_id=archived.id).exists())
+
+        resp = self.client.get(self.url, data={"limit": "10"})
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"]["total"], 8)
+        self.assertEqual(len(resp.data["data"]["results"]), 8)
+        self.assertEqual(self.client.get(self.url, data={"limit": "10", "problem_id": self.problem._id}).data["data"],
+                         rank)
+
+        self.client.login(username="test", password="test123")
+        resp = self.client.get(self.reverse("submission_api"), data={"id": archived.id})
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"]["code"], self.submission_data["code"])
+        self.assertEqual(resp.data["data"]["info"]["data"][0]["result"], 0)
+
+    def test_rebuild_best_submission_restores_archived(self):
+        self._prepare_rank()
+        self._archive_all()
+        memory_best = ArchivedSubmission.objects.get(user_id=2)
+        self.problem.spj_code = '{"rank_type": "memory"}'
+        self.problem.save()
+        rebuild_best_submission(self.problem)
+        self.assertEqual(ProblemBestSubmission.objects.get(user_id=2).submission_id, memory_best.id)
+        self.assertTrue(Submission.objects.filter(id=memory_best.id).exists())
+        self.assertFalse(ArchivedSubmission.objects.filter(id=memory_best.id).exists())
+
+    def test_export_and_rejudge_archived(self):
+        self._prepare_rank()
+        self._archive_all()
+        archived = ArchivedSubmission.objects.get(user_id=2)
+        Submission.objects.filter(user_id=2).delete()
+        self.assertEqual(ExportProblemAPI().choose_answers(User(id=2), self.problem),
+                         [{"language": "C", "code": self.submission_data["code"]}])
+
+        self.create_super_admin()
+        with mock.patch("submission.views.admin.judge_task.send") as judge_task:
+            resp = self.client.get(self.reverse("submission_rejudge_api"), data={"id": archived.id})
+        self.assertSuccess(resp)
+        judge_task.assert_called_once_with(archived.id, self.problem.id)
+        self.assertTrue(Submission.objects.filter(id=archived.id).exists())
+        self.assertFalse(ArchivedSubmission.objects.filter(id=archived.id).exists())
+
 
 @mock.patch("submission.views.oj.judge_task.send")
 class SubmissionAPITest(SubmissionPrepare):
@@ -63,6 +254,8 @@ class SubmissionAPITest(SubmissionPrepare):
         self._create_problem_and_submission()
         self.user = self.create_user("123", "test123")
         self.url = self.reverse("submission_api")
+        cache.delete_pattern(f"{CacheKey.throttling}:*")
+        cache.delete(str(self.user.id))
 
     def test_create_submission(self, judge_task):
         resp = self.client.post(self.url, self.submission_data)
@@ -76,3 +269,321 @@ class SubmissionAPITest(SubmissionPrepare):
         self.assertDictEqual(resp.data, {"error": "error",
                                          "data": "Python3 is now allowed in the problem"})
         judge_task.assert_not_called()
+
+    def test_create_submission_throttled(self, judge_task):
+        cache.hset(str(self.user.id), mapping={"last_capacity": 0, "last_timestamp": time.time()})
+        resp = self.client.post(self.url, self.submission_data)
+        self.assertFailed(resp)
+        self.assertRegex(resp.data["data"], r"^Please wait \d+ seconds$")
+        judge_task.assert_not_called()
+
+    def test_ip_bucket_opt_in(self, judge_task):
+        cache.hset(f"{CacheKey.throttling}:ip:127.0.0.1", mapping={"last_capacity": 0, "last_timestamp": time.time()})
+        # 默认不按 IP 限制
+        self.assertSuccess(self.client.post(self.url, self.submission_data))
+        throttling = SysOptions.throttling
+        SysOptions.throttling = dict(throttling, ip=dict(throttling["ip"], enabled=True))
+        try:
+            resp = self.client.post(self.url, self.submission_data)
+        finally:
+            SysOptions.throttling = throttling
+        self.assertRegex(resp.data["data"], r"^Please wait \d+ seconds$")
+
+
+class TokenBucketTest(TestCase):
+    def setUp(self):
+        cache.delete_pattern(f"{CacheKey.throttling}:test:*")
+
+    def bucket(self, name, capacity=5, fill_rate=0.01):
+        return TokenBucket(key=f"{CacheKey.throttling}:test:{name}", capacity=capacity, fill_rate=fill_rate,
+                           default_capacity=capacity, redis_conn=cache)
+
+    def test_consume(self):
+        bucket = self.bucket("user", capacity=2, fill_rate=0.5)
+        self.assertTrue(bucket.consume()[0])
+        self.assertTrue(bucket.consume()[0])
+        can_consume, wait = bucket.consume()
+        self.assertFalse(can_consume)
+        self.assertAlmostEqual(wait, 2, delta=0.1)
+        # 空闲的 key 在桶被填满之后过期
+        self.assertEqual(cache.ttl(bucket._key), 4)
+
+    def test_consume_buckets(self):
+        user_bucket, ip_bucket = self.bucket("user", capacity=5), self.bucket("ip", capacity=1)
+        self.assertEqual(consume_buckets([user_bucket, ip_bucket]), (True, 0))
+        # IP 的桶不够时用户的桶也不消耗
+        self.assertFalse(consume_buckets([user_bucket, ip_bucket])[0])
+        self.assertEqual(float(cache.hget(user_bucket._key, "last_capacity")), 4)
+
+    def test_concurrent_consume(self):
+        bucket = self.bucket("concurrent", capacity=5)
+        results = []
+        barrier = threading.Barrier(20)
+
+        def consume():
+            barrier.wait()
+            results.append(bucket.consume()[0])
+
+        threads = [threading.Thread(target=consume) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 5)
+
+
+class SubmissionStatusTest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+        self.user = self.create_user("123", "test123")
+        self.submission_data.update({"user_id": self.user.id, "result": JudgeStatus.PENDING})
+        self.own_submission = Submission.objects.create(**self.submission_data)
+        self.url = self.reverse("submission_status_api")
+
+    def get_status(self, **params):
+        resp = self.client.get(self.url, data={"ids": f"{self.own_submission.id},{self.submission.id}", **params})
+        self.assertSuccess(resp)
+        return resp.data["data"]
+
+    def test_current_status(self):
+        data = self.get_status()
+        # 别人的提交没有权限查看
+        self.assertEqual(data["submissions"], [{"id": self.own_submission.id, "result": JudgeStatus.PENDING}])
+        self.assertTrue(data["long_poll"])
+
+    def test_wait_for_status_change(self):
+        # 测试在事务中运行, 其他线程看不到数据库的修改, 这里只在另一个线程中发布消息
+        timer = threading.Timer(0.2, publish_submission_status, args=(self.own_submission.id, JudgeStatus.JUDGING))
+        timer.start()
+        start = time.monotonic()
+        data = self.get_status(results=str(JudgeStatus.PENDING), timeout="5")
+        timer.join()
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(data["submissions"][0]["result"], JudgeStatus.PENDING)
+
+        # 状态和客户端已知的不同时立即返回
+        Submission.objects.filter(id=self.own_submission.id).update(result=JudgeStatus.ACCEPTED)
+        data = self.get_status(results=str(JudgeStatus.PENDING), timeout="5")
+        self.assertEqual(data["submissions"][0]["result"], JudgeStatus.ACCEPTED)
+
+    def test_fallback_to_polling(self):
+        with mock.patch("submission.status.cache.pubsub", side_effect=ConnectionError()):
+            data = self.get_status(results=str(JudgeStatus.PENDING), timeout="5")
+        self.assertFalse(data["long_poll"])
+        self.assertEqual(data["submissions"][0]["result"], JudgeStatus.PENDING)
+
+    def test_no_subscription_without_waiting(self):
+        with mock.patch("submission.status.cache.pubsub") as pubsub:
+            # 没有权限查看的提交都被过滤掉
+            resp = self.client.get(self.url, data={"ids": self.submission.id, "results": "0", "timeout": "5"})
+            self.assertSuccess(resp)
+            self.assertEqual(resp.data["data"]["submissions"], [])
+            # 不等待或者已经判完的提交立即返回
+            self.assertTrue(self.get_status(timeout="5")["long_poll"])
+            Submission.objects.filter(id=self.own_submission.id).update(result=JudgeStatus.ACCEPTED)
+            data = self.get_status(results=str(JudgeStatus.ACCEPTED), timeout="5")
+            self.assertEqual(data["submissions"][0]["result"], JudgeStatus.ACCEPTED)
+        pubsub.assert_not_called()
+
+
+class SubmissionContentTest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+
+    def test_time_ordered_id(self):
+        ids = [Submission.objects.create(**self.submission_data).id for _ in range(20)]
+        self.assertEqual(ids, sorted(ids))
+        for submission_id in ids:
+            self.assertRegex(submission_id, r"^0[0-9a-f]{31}$")
+            self.assertTrue(is_time_ordered_id(submission_id))
+        self.assertFalse(is_time_ordered_id(rand_str()))
+
+    def test_identical_code_stored_once(self):
+        Submission.objects.create(**self.submission_data)
+        self.assertEqual(SubmissionCode.objects.count(), 1)
+        self.assertEqual(SubmissionCode.objects.get().code, self.submission_data["code"])
+
+    def test_delete_orphaned_code(self):
+        data = dict(self.submission_data)
+        archived = Submission.objects.create(**dict(data, code="archived"))
+        orphaned = Submission.objects.create(**dict(data, code="orphaned"))
+        archive_submissions(timezone.now() + timedelta(seconds=1))
+        Submission.objects.create(**data)
+        ArchivedSubmission.objects.exclude(id=archived.id).delete()
+        Submission.objects.filter(id=orphaned.id).delete()
+
+        self.assertEqual(delete_orphaned_code(batch_size=1), 1)
+        self.assertEqual(set(SubmissionCode.objects.values_list("code", flat=True)),
+                         {self.submission_data["code"], "archived"})
+
+    def test_lazy_load_code_and_info(self):
+        self.assertFalse(SubmissionDetail.objects.exists())
+        self.submission.info = {"err": None, "data": [{"test_case": "1", "result": 0}]}
+        self.submission.save()
+
+        submission = Submission.objects.get(id=self.submission.id)
+        self.assertTrue(submission.has_info())
+        with self.assertNumQueries(2):
+            self.assertEqual(submission.code, self.submission_data["code"])
+            self.assertEqual(submission.info["data"][0]["result"], 0)
+
+        submission = Submission.objects.select_related("code_blob", "detail").get(id=self.submission.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(submission.code, self.submission_data["code"])
+            self.assertEqual(submission.info["data"][0]["result"], 0)
+
+        submission.info = {}
+        submission.save(update_fields=["info"])
+        self.assertFalse(SubmissionDetail.objects.exists())
+
+    def test_get_submission_with_code_and_info(self):
+        self.submission.info = {"err": None, "data": []}
+        self.submission.save()
+        self.client.login(username="test", password="test123")
+        resp = self.client.get(self.reverse("submission_api"), data={"id": self.submission.id})
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"]["code"], self.submission_data["code"])
+        self.assertEqual(resp.data["data"]["info"], {"err": None, "data": []})
+        self.assertNotIn("code_blob", resp.data["data"])
+
+
+class SubmissionInfoEncodingTest(TestCase):
+    def _judge_info(self, count):
+        return {"err": None,
+                "data": [{"cpu_time": index, "real_time": index * 2, "memory": 1024 * 1024 * (index + 1), "signal": 0,
+                          "exit_code": 0, "error": 0, "result": -1 if index % 3 else 0, "test_case": str(index + 1),
+                          "output_md5": "d41d8cd98f00b204e9800998ecf8427e", "output": None}
+                         for index in range(count)]}
+
+    def test_round_trip(self):
+        for info in (self._judge_info(1), self._judge_info(60), {}, {"err": "CompileError", "data": "error"},
+                     {"err": None, "data": [{"a": 1, "b": True}, {"a": 2 ** 70, "b": 1.5}]},
+                     {"err": None, "data": [{"a": 1}, {"b": 2}]}):
+            self.assertEqual(decode_info(encode_info(info)), info)
+
+    def test_smaller_than_json(self):
+        info = self._judge_info(60)
+        self.assertLess(len(encode_info(info)) * 5, len(json.dumps(info)))
+
+
+class SubmissionQueryPlanTest(SubmissionPrepare):
+    """
+    在较大的数据量上检查各个提交列表接口的查询计划, 分页查询应当走索引而不是全表扫描加排序
+    """
+    submission_count = 60000
+
+    def setUp(self):
+        self.admin = self.create_admin()
+        self.problems = []
+        for index in range(20):
+            problem_data = deepcopy(DEFAULT_PROBLEM_DATA)
+            problem_data.pop("tags")
+            problem_data.update({"_id": f"P{index}", "created_by": self.admin})
+            self.problems.append(Problem.objects.create(**problem_data))
+        self.contest = Contest.objects.create(title="test", description="test", created_by=self.admin,
+                                              start_time=timezone.now() - timedelta(days=30),
+                                              end_time=timezone.now() + timedelta(days=1),
+                                              rule_type=ContestRuleType.ACM, real_time_rank=True,
+                                              allowed_ip_ranges=[], visible=True)
+        self.contest_problems = []
+        for index in range(5):
+            problem_data = deepcopy(DEFAULT_PROBLEM_DATA)
+            problem_data.pop("tags")
+            problem_data.update({"_id": f"C{index}", "created_by": self.admin, "contest": self.contest})
+            self.contest_problems.append(Problem.objects.create(**problem_data))
+        # 每 5 个提交中有 1 个属于比赛, 用户 id 从管理员开始, 保证管理员在比赛内外都有提交
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO submission_code (hash, code) VALUES (%s, 'code')",
+                           [SubmissionCode.hash_code("code")])
+            cursor.execute("""
+                INSERT INTO submission (id, contest_id, problem_id, create_time, user_id, username, code_hash, result,
+                                        language, shared, statistic_info, ip)
+                SELECT md5(g::text),
+                       CASE WHEN g %% 5 = 0 THEN %s END,
+                       CASE WHEN g %% 5 = 0 THEN (%s::int[])[g / 5 %% 5 + 1] ELSE (%s::int[])[g %% 20 + 1] END,
+                       now() - g * interval '1 minute',
+                       %s + g %% 499, 'user' || g %% 499, %s, (ARRAY[0, -1, 1, 4])[g %% 4 + 1],
+                       'C', false, json_build_object('time_cost', g %% 1000, 'memory_cost', g %% 4096),
+                       '127.0.0.1'
+                FROM generate_series(1, %s) g
+            """, [self.contest.id, [p.id for p in self.contest_problems], [p.id for p in self.problems],
+                  self.admin.id, SubmissionCode.hash_code("code"), self.submission_count])
+            cursor.execute("ANALYZE submission")
+
+    def _submission_plans(self, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            func(*args, **kwargs)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                sql = query["sql"]
+                # 计数已经用 LIMIT 截断, 顺序扫描到上限即停止, 估算总数只生成查询计划, 这里只关心取数据的查询
+                if 'FROM "submission"' not in sql or sql.startswith(("SELECT COUNT", "EXPLAIN")):
+                    continue
+                cursor.execute(f"EXPLAIN {sql}")
+                plans.append((sql, "\n".join(row[0] for row in cursor.fetchall())))
+        self.assertTrue(plans)
+        return plans
+
+    def assertIndexScan(self, plans):
+        for sql, plan in plans:
+            # 这里只填充了 submission 表, 空的 submission_archive 走顺序扫描也没关系
+            self.assertNotRegex(plan, r"Seq Scan on submission\s", msg=f"{sql}\n{plan}")
+            # 索引已经把结果缩小到很少的几行时, 规划器在 join 之后再排序也是合理的
+            # Incremental Sort 建立在索引的有序输出上, 只对 create_time 相同的行排序, 不算在内
+            for rows in re.findall(r"(?<!Incremental )Sort  \(cost=\S+ rows=(\d+)", plan):
+                self.assertLessEqual(int(rows), 100, msg=f"{sql}\n{plan}")
+
+    def test_submission_list(self):
+        url = self.reverse("submission_list_api")
+        self.assertIndexScan(self._submission_plans(self.client.get, url, data={"limit": 20, "page": 3}))
+        self.assertIndexScan(self._submission_plans(self.client.get, url, data={"limit": 20, "myself": "1"}))
+
+    def test_contest_submission_list(self):
+        url = self.reverse("contest_submission_list_api")
+        params = {"contest_id": self.contest.id, "limit": 20}
+        self.assertIndexScan(self._submission_plans(self.client.get, url, data=params))
+        self.assertIndexScan(self._submission_plans(self.client.get, url, data={**params, "myself": "1"}))
+        self.assertIndexScan(self._submission_plans(self.client.get, url, data={**params, "problem_id": "C1"}))
+        self.assertIndexScan(self._submission_plans(self.client.get, url, data={**params, "cursor": ""}))
+
+    def test_download_contest_submissions(self):
+        paths = []
+
+        def dump():
+            paths.append(DownloadContestSubmissions()._dump_submissions(self.contest, exclude_admin=False))
+
+        plans = self._submission_plans(dump)
+        os.remove(paths[0])
+        self.assertIndexScan(plans)
+
+    def test_contest_submission_list_mixed_id_cursor(self):
+        # 一半的比赛提交换成 time_ordered_id 的格式, 游标的格式不随 id 的格式变化
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                UPDATE submission
+                SET id = lpad(to_hex((extract(epoch FROM create_time) * 1000)::bigint), 12, '0') || left(md5(id), 20)
+                WHERE contest_id = %s AND create_time > (SELECT percentile_disc(0.5) WITHIN GROUP (ORDER BY create_time)
+                                                         FROM submission WHERE contest_id = %s)
+            """, [self.contest.id, self.contest.id])
+            cursor.execute("ANALYZE submission")
+        url = self.reverse("contest_submission_list_api")
+        params = {"contest_id": self.contest.id, "limit": 20}
+        first = self.client.get(url, data={**params, "cursor": ""}).data["data"]
+        second = self.client.get(url, data={**params, "cursor": first["next"]}).data["data"]
+        ids = [item["id"] for item in first["results"] + second["results"]]
+        self.assertEqual(ids, list(Submission.objects.filter(contest=self.contest)
+                                   .order_by("-create_time", "-id").values_list("id", flat=True)[:40]))
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url, data={**params, "cursor": first["next"]})
+        # 不再为了选择游标的格式额外查询最早的提交
+        self.assertFalse(any('ORDER BY "submission"."create_time" ASC' in item["sql"] for item in context.captured_queries))
+        self.assertIndexScan(self._submission_plans(self.client.get, url,
+                                                    data={**params, "cursor": first["next"]}))
+
+    def test_submission_exists(self):
+        url = self.reverse("submission_exists")
+        self.assertIndexScan(self._submission_plans(self.client.get, url, data={"problem_id": self.problems[0].id}))
+
+    def test_export_problem_answers(self):
+        self.assertIndexScan(self._submission_plans(ExportProblemAPI().choose_answers, self.admin, self.problems[0]))
@@ -0,0 +1,321 @@
+import json
+
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, IntegerField, Value, When, Window
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast, RowNumber
+
+from .models import (ArchivedSubmission, JudgeStatus, ProblemBestSubmission, Submission, SubmissionCode,
+                     SubmissionDetail)
+
+
+class RankType(object):
+    TIME = "time"
+    MEMORY = "memory"
+
+
+# rank_type -> statistic_info 中对应的字段
+RANK_COST_KEY = {RankType.TIME: "time_cost", RankType.MEMORY: "memory_cost"}
+
+
+def get_rank_type(problem):
+    """
+    从 spj_code 的 json 配置里读取排名方式, 格式错误或者不支持时默认按耗时排名
+    """
+    rank_type = RankType.TIME
+    if problem.spj_code:
+        try:
+            rank_type = json.loads(problem.spj_code).get("rank_type", RankType.TIME)
+        except Exception:
+            pass
+    if rank_type not in RANK_COST_KEY:
+        rank_type = RankType.TIME
+    return rank_type
+
+
+def get_rank_group(result):
+    if result == JudgeStatus.ACCEPTED:
+        return 0
+    if result == JudgeStatus.EXPIRED:
+        return 2
+    return 1
+
+
+def order_by_best_submission(submissions, rank_type):
+    """
+    按最优提交的规则排序, 每个用户排在最前面的提交即为其最优提交
+     - 有 AC 的用户取耗时(或内存)最少的 AC 提交, 相同时取最近的一次
+     - 否则取最近一次未过期的提交, 都没有则取最近一次过期的提交
+    """
+    cost = Cast(KeyTextTransform(RANK_COST_KEY[rank_type], "statistic_info"), FloatField())
+    rank_group = Case(When(result=JudgeStatus.ACCEPTED, then=Value(0)),
+                      When(result=JudgeStatus.EXPIRED, then=Value(2)),
+                      default=Value(1), output_field=IntegerField())
+    ac_cost = Case(When(result=JudgeStatus.ACCEPTED, then=cost), output_field=FloatField())
+    return submissions.annotate(best_rank_group=rank_group, best_ac_cost=ac_cost) \
+        .order_by("user_id", "best_rank_group", F("best_ac_cost").asc(nulls_last=True), "-create_time")
+
+
+def _best_submission_fields(submission):
+    return {"username": submission.username,
+            "submission_id": submission.id,
+            "result": submission.result,
+            "rank_group": get_rank_group(submission.result),
+            "time_cost": submission.statistic_info.get("time_cost"),
+            "memory_cost": submission.statistic_info.get("memory_cost"),
+            "create_time": submission.create_time}
+
+
+def _best_submission_candidates(problem, model=Submission):
+    return model.objects.filter(problem_id=problem.id, contest_id__isnull=True) \
+        .only("id", "user_id", "username", "result", "statistic_info", "create_time")
+
+
+def _best_submission_key(submission):
+    # 与 order_by_best_submission 的排序规则相同, 用于比较 submission 和 submission_archive 中各自的最优提交
+    return (submission.best_rank_group, submission.best_ac_cost is None, submission.best_ac_cost or 0,
+            -submission.create_time.timestamp())
+
+
+def _find_best_submissions(problem, user_id=None):
+    """
+    分别在 submission 和 submission_archive 中找出每个用户的最优提交, 再合并
+    :return: {user_id: submission}
+    """
+    rank_type = get_rank_type(problem)
+    best = {}
+    for model in (Submission, ArchivedSubmission):
+        candidates = _best_submission_candidates(problem, model)
+        if user_id is not None:
+            candidates = candidates.filter(user_id=user_id)
+        for item in order_by_best_submission(candidates, rank_type).distinct("user_id").iterator():
+            if item.user_id not in best or _best_submission_key(item) < _best_submission_key(best[item.user_id]):
+                best[item.user_id] = item
+    return best
+
+
+def update_best_submission(problem, user_id):
+    """
+    重新计算某个用户在非比赛题目上的最优提交, 只涉及该用户在这道题上的提交.
+    最优提交重判后可能变差, 这时新的最优提交可能已经归档, 会被移回 submission 表
+    """
+    with transaction.atomic():
+        # 同一用户在同一道题上的两次判题同时结束时, 按顺序计算和写入, 后写入的一方能看到另一方的提交.
+        # 还没有最优提交时没有可以锁的行, 所以用事务级的 advisory lock
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [problem.id, user_id])
+        best = _find_best_submissions(problem, user_id).get(user_id)
+        if not best:
+            ProblemBestSubmission.objects.filter(problem_id=problem.id, user_id=user_id).delete()
+            return
+        if isinstance(best, ArchivedSubmission):
+            restore_archived_submissions([best.id])
+        ProblemBestSubmission.objects.update_or_create(problem_id=problem.id, user_id=user_id,
+                                                       defaults=_best_submission_fields(best))
+
+
+def rebuild_best_submission(problem):
+    """
+    重新计算一道题所有用户的最优提交. 排名方式改变后最优提交可能已经归档, 这时会把它移回 submission 表
+    """
+    best = _find_best_submissions(problem)
+    with transaction.atomic():
+        restore_archived_submissions([item.id for item in best.values() if isinstance(item, ArchivedSubmission)])
+        ProblemBestSubmission.objects.filter(problem_id=problem.id).delete()
+        ProblemBestSubmission.objects.bulk_create(
+            [ProblemBestSubmission(problem_id=problem.id, user_id=item.user_id, **_best_submission_fields(item))
+             for item in best.values()],
+            batch_size=1000)
+
+
+class BestSubmissionRank(object):
+    """
+    非比赛题目中每个用户的最优提交及其排名, 数据来自 ProblemBestSubmission, 可以直接交给 Paginator 使用
+     - 排名顺序为 AC, 未过期的非 AC, 过期, 同类中按耗时(或内存)升序, 再按提交时间倒序
+     - result, user_id, username 的筛选在排名之后进行, 不影响名次
+    切片返回 Submission 对象的列表, 每个对象带有 rank 属性
+    """
+    def __init__(self, problem, rank_type, result=None, user_id=None, username=None, filter_user=False):
+        self.problem = problem
+        self.cost_key = RANK_COST_KEY[rank_type]
+        self.result = result
+        self.user_id = user_id
+        self.username = username
+        self.filter_user = filter_user
+
+    def _ranked_sql(self):
+        ranked = ProblemBestSubmission.objects.filter(problem_id=self.problem.id) \
+            .annotate(rank=Window(expression=RowNumber(),
+                                  order_by=[F("rank_group").asc(), F(self.cost_key).asc(nulls_last=True),
+                                            F("create_time").desc(), F("submission_id").asc()])) \
+            .order_by() \
+            .values("submission_id", "user_id", "username", "result", "rank")
+        return ranked.query.sql_with_params()
+
+    def _sql(self, select, suffix="", suffix_params=()):
+        sql, params = self._ranked_sql()
+        where = []
+        params = list(params)
+        if self.result is not None:
+            where.append("result = %s")
+            params.append(int(self.result))
+        if self.filter_user:
+            where.append("user_id = %s")
+            params.append(self.user_id)
+        elif self.username:
+            escaped = self.username.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            where.append("username ILIKE %s")
+            params.append(f"%{escaped}%")
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+        return f"SELECT {select} FROM ({sql}) ranked {where_sql} {suffix}", params + list(suffix_params)
+
+    def count(self):
+        sql, params = self._sql("COUNT(*)")
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()[0]
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError("BestSubmissionRank only supports slicing without step")
+        offset = item.start or 0
+        limit = "ALL" if item.stop is None else max(item.stop - offset, 0)
+        sql, params = self._sql("submission_id, rank", f"ORDER BY rank LIMIT {limit} OFFSET %s", [offset])
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        submissions = Submission.objects.select_related("problem__created_by").in_bulk([row[0] for row in rows])
+        ret = []
+        for submission_id, rank in rows:
+            submission = submissions[submission_id]
+            submission.rank = rank
+            ret.append(submission)
+        return ret
+
+
+class SubmissionArchiveUnion(object):
+    """
+    把 submission 和 submission_archive 上相同条件的查询用 UNION ALL 合并, 结果都是 Submission 对象.
+    支持 paginate_data 和 Paginator 用到的 filter, order_by, count 和切片,
+    union 之后不能 select_related, 关联对象用 prefetch_related 在取回结果后一次加载
+    """
+    def __init__(self, query_sets=None, ordering=None, related=()):
+        if query_sets is None:
+            query_sets = (Submission.objects.all(), ArchivedSubmission.objects.defer("encoded_info"))
+        # union 的每一部分都不能带排序, 默认按 Submission 的默认排序对整体排序
+        self.query_sets = tuple(item.order_by() for item in query_sets)
+        self.ordering = tuple(Submission._meta.ordering if ordering is None else ordering)
+        self.related = tuple(related)
+        self.model = Submission
+
+    def _clone(self, **kwargs):
+        params = {"query_sets": self.query_sets, "ordering": self.ordering, "related": self.related}
+        params.update(kwargs)
+        return SubmissionArchiveUnion(**params)
+
+    def filter(self, *args, **kwargs):
+        return self._clone(query_sets=[item.filter(*args, **kwargs) for item in self.query_sets])
+
+    def order_by(self, *ordering):
+        return self._clone(ordering=ordering)
+
+    def prefetch_related(self, *lookups):
+        return self._clone(related=self.related + lookups)
+
+    @property
+    def query(self):
+        return self._union().query
+
+    def _union(self, query_sets=None):
+        first, *rest = query_sets or self.query_sets
+        query_set = first.union(*rest, all=True)
+        if self.ordering:
+            query_set = query_set.order_by(*self.ordering)
+        # Django 不允许对 union 调用 prefetch_related, 但取回结果后的预取与查询本身无关
+        query_set._prefetch_related_lookups = self.related
+        return query_set
+
+    def count(self):
+        return self.order_by()._union().count()
+
+    def __getitem__(self, item):
+        if isinstance(item, slice) and item.stop is not None:
+            # 子查询带条件时 Postgres 不会对 union 使用 Merge Append, 而是取出全部结果再排序.
+            # 每一部分先按同样的顺序取前 stop 条, 各自都能用上索引, 外层只需要对很少的行排序
+            return self._union([query_set.order_by(*self.ordering)[:item.stop] for query_set in self.query_sets])[item]
+        return self._union()[item]
+
+    def __iter__(self):
+        return iter(self._union())
+
+
+def _submission_columns():
+    return [field.column for field in ArchivedSubmission._meta.concrete_fields if field.name != "encoded_info"]
+
+
+def archive_submissions(before, batch_size=1000):
+    """
+    把 before 之前的提交移到 submission_archive, 判题详情一起移过去, 代码仍然留在 submission_code.
+    每个用户在非比赛题目上的最优提交, 以及还在等待或正在判题的提交不会被归档
+    :return: 归档的提交数量
+    """
+    columns = ", ".join(f'"{column}"' for column in _submission_columns())
+    source_columns = ", ".join(f's."{column}"' for column in _submission_columns())
+    sql = f"INSERT INTO {ArchivedSubmission._meta.db_table} ({columns}, encoded_info) " \
+          f"SELECT {source_columns}, d.encoded_info FROM {Submission._meta.db_table} s " \
+          f"LEFT JOIN {SubmissionDetail._meta.db_table} d ON d.submission_id = s.id WHERE s.id = ANY(%s)"
+    candidates = Submission.objects.filter(create_time__lt=before) \
+        .exclude(result__in=[JudgeStatus.PENDING, JudgeStatus.JUDGING]) \
+        .exclude(id__in=ProblemBestSubmission.objects.values("submission_id")) \
+        .order_by("create_time")
+    total = 0
+    while True:
+        with transaction.atomic():
+            ids = list(candidates.select_for_update(skip_locked=True).values_list("id", flat=True)[:batch_size])
+            if not ids:
+                break
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [ids])
+            Submission.objects.filter(id__in=ids).delete()
+        total += len(ids)
+    return total
+
+
+def delete_orphaned_code(batch_size=1000):
+    """
+    删除没有被任何提交引用的代码. 提交, 题目和用户被删除后留下的代码只能这样清理.
+    按 hash 分批扫描, 每一批持有 SubmissionCode 的排他锁, 与写入提交互斥
+    :return: 删除的代码数量
+    """
+    sql = f"WITH batch AS (SELECT hash FROM {SubmissionCode._meta.db_table} WHERE hash > %s ORDER BY hash LIMIT %s), " \
+          f"deleted AS (DELETE FROM {SubmissionCode._meta.db_table} c USING batch WHERE c.hash = batch.hash " \
+          f"AND NOT EXISTS (SELECT 1 FROM {Submission._meta.db_table} WHERE code_hash = c.hash) " \
+          f"AND NOT EXISTS (SELECT 1 FROM {ArchivedSubmission._meta.db_table} WHERE code_hash = c.hash) " \
+          f"RETURNING 1) " \
+          f"SELECT (SELECT max(hash) FROM batch), (SELECT count(*) FROM deleted)"
+    last_hash = ""
+    total = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            SubmissionCode.lock(shared=False)
+            cursor.execute(sql, [last_hash, batch_size])
+            last_hash, count = cursor.fetchone()
+        if last_hash is None:
+            return total
+        total += count
+
+
+def restore_archived_submissions(ids):
+    """
+    把归档的提交移回 submission 表
+    """
+    if not ids:
+        return
+    columns = ", ".join(f'"{column}"' for column in _submission_columns())
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {Submission._meta.db_table} ({columns}) "
+                       f"SELECT {columns} FROM {ArchivedSubmission._meta.db_table} WHERE id = ANY(%s)", [ids])
+        cursor.execute(f"INSERT INTO {SubmissionDetail._meta.db_table} (submission_id, encoded_info) "
+                       f"SELECT id, encoded_info FROM {ArchivedSubmission._meta.db_table} "
+                       f"WHERE id = ANY(%s) AND encoded_info IS NOT NULL", [ids])
+        ArchivedSubmission.objects.filter(id__in=ids).delete()
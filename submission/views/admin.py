@@ -2,7 +2,8 @@ from account.decorators import super_admin_required
 from judge.tasks import judge_task
 # from judge.dispatcher import JudgeDispatcher
 from utils.api import APIView
-from ..models import Submission
+from ..models import ArchivedSubmission, Submission
+from ..utils import restore_archived_submissions
 
 
 class SubmissionRejudgeAPI(APIView):
@@ -11,6 +12,9 @@ class SubmissionRejudgeAPI(APIView):
         id = request.GET.get("id")
         if not id:
             return self.error("Parameter error, id is required")
+        # 归档的提交先移回 submission 表再重判
+        restore_archived_submissions(list(ArchivedSubmission.objects.filter(id=id, contest_id__isnull=True)
+                                          .values_list("id", flat=True)))
         try:
             submission = Submission.objects.select_related("problem").get(id=id, contest_id__isnull=True)
         except Submission.DoesNotExist:
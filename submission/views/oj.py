@@ -1,5 +1,6 @@
 import ipaddress
-import json
+
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 
 from account.decorators import login_required, check_contest_permission
 from contest.models import ContestStatus, ContestRuleType
@@ -10,12 +11,15 @@ from problem.models import Problem, ProblemRuleType
 from utils.api import APIView, validate_serializer
 from utils.cache import cache
 from utils.captcha import Captcha
-from utils.throttling import TokenBucket
-from ..models import Submission
+from utils.constants import CacheKey
+from utils.throttling import TokenBucket, consume_buckets
+from ..models import ArchivedSubmission, JudgeStatus, Submission
 from ..serializers import (CreateSubmissionSerializer, SubmissionModelSerializer,
                            ShareSubmissionSerializer)
 from ..serializers import SubmissionSafeModelSerializer, SubmissionListSerializer
-from datetime import datetime
+from ..status import SubmissionStatusSubscription
+from ..utils import BestSubmissionRank, SubmissionArchiveUnion, get_rank_type
+
 
 class SubmissionAPI(APIView):
     def throttling(self, request):
@@ -23,25 +27,24 @@ class SubmissionAPI(APIView):
         auth_method = getattr(request, "auth_method", "")
         if auth_method == "api_key":
             return
-        user_bucket = TokenBucket(key=str(request.user.id),
-                                  redis_conn=cache, **SysOptions.throttling["user"])
-        can_consume, wait = user_bucket.consume()
+        throttling = SysOptions.throttling
+        buckets = [TokenBucket(key=str(request.user.id), redis_conn=cache, **throttling["user"])]
+        # 比赛现场的学生通常在同一个 NAT 后面, 按 IP 的限制需要在配置中设置 enabled 才会开启
+        ip_policy = dict(throttling.get("ip") or {})
+        if ip_policy.pop("enabled", False):
+            buckets.append(TokenBucket(key=f"{CacheKey.throttling}:ip:{request.ip}", redis_conn=cache, **ip_policy))
+        # 用户和 IP 的桶在一次请求中一起检查, 任意一个不够时都不消耗
+        can_consume, wait = consume_buckets(buckets)
         if not can_consume:
             return "Please wait %d seconds" % (int(wait))
 
-        # ip_bucket = TokenBucket(key=request.session["ip"],
-        #                         redis_conn=cache, **SysOptions.throttling["ip"])
-        # can_consume, wait = ip_bucket.consume()
-        # if not can_consume:
-        #     return "Captcha is required"
-
     @check_contest_permission(check_type="problems")
     def check_contest_permission(self, request):
         contest = self.contest
         if contest.status == ContestStatus.CONTEST_ENDED:
             return self.error("The contest have ended")
         if not request.user.is_contest_admin(contest):
-            user_ip = ipaddress.ip_address(request.session.get("ip"))
+            user_ip = ipaddress.ip_address(request.ip)
             if contest.allowed_ip_ranges:
                 if not any(user_ip in ipaddress.ip_network(cidr, strict=False) for cidr in contest.allowed_ip_ranges):
                     return self.error("Your IP is not allowed in this contest")
@@ -77,7 +80,7 @@ class SubmissionAPI(APIView):
                                                language=data["language"],
                                                code=data["code"],
                                                problem_id=problem.id,
-                                               ip=request.session["ip"],
+                                               ip=request.ip,
                                                contest_id=data.get("contest_id"))
         # use this for debug
         # JudgeDispatcher(submission.id, problem.id).judge()
@@ -93,9 +96,12 @@ class SubmissionAPI(APIView):
         if not submission_id:
             return self.error("Parameter id doesn't exist")
         try:
-            submission = Submission.objects.select_related("problem").get(id=submission_id)
+            submission = Submission.objects.select_related("problem", "code_blob", "detail").get(id=submission_id)
         except Submission.DoesNotExist:
-            return self.error("Submission doesn't exist")
+            try:
+                submission = ArchivedSubmission.objects.select_related("problem", "code_blob").get(id=submission_id)
+            except ArchivedSubmission.DoesNotExist:
+                return self.error("Submission doesn't exist")
         if not submission.check_user_permission(request.user):
             return self.error("No permission for this submission")
 
@@ -126,188 +132,91 @@ class SubmissionAPI(APIView):
         return self.error("No permission to share the submission")
 
 
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.utils.dateparse import parse_datetime
-from datetime import datetime
-
 class SubmissionListAPI(APIView):
+    pagination_count_limit = 10000
+
     def get(self, request):
-        # Validate required parameters
         if not request.GET.get("limit"):
             return self.error("Limit is needed")
         if request.GET.get("contest_id"):
             return self.error("Parameter error")
 
-        # Initial queryset with necessary filters
-        submissions = Submission.objects.filter(contest_id__isnull=True).select_related("problem__created_by")
         problem_id = request.GET.get("problem_id")
         myself = request.GET.get("myself")
         result = request.GET.get("result")
         username = request.GET.get("username")
+        filter_user = (myself and myself == "1") or not SysOptions.submission_list_show_all
 
-        
-        spj_code = None
-        rank_type = "time"
-        
-        if problem_id:
-            try:
-                spj_code = Problem.objects.get(_id=problem_id).spj_code
-                if spj_code:
-                    try:
-                        spj_config_data = json.loads(spj_code)
-                        rank_type = spj_config_data.get("rank_type", "time")
-                    except:
-                        pass
-            except Problem.DoesNotExist:
-                return self.error("Problem doesn't exist")
-            
-        if rank_type != "time" and rank_type != "memory":
-            rank_type = "time"
-            
-        
-        # Filter by problem_id if provided
         if problem_id:
             try:
                 problem = Problem.objects.get(_id=problem_id, contest_id__isnull=True, visible=True)
             except Problem.DoesNotExist:
                 return self.error("Problem doesn't exist")
-            submissions = submissions.filter(problem=problem)
+            # 每个用户只保留最优的一次提交并排名, result 和用户的筛选在排名之后进行
+            submissions = BestSubmissionRank(problem, get_rank_type(problem),
+                                             result=result or None,
+                                             user_id=request.user.id,
+                                             username=username,
+                                             filter_user=filter_user)
         else:
-            # Without problem_id, filter by result BEFORE ranking has been assigned
+            submissions = SubmissionArchiveUnion().filter(contest_id__isnull=True).prefetch_related("problem__created_by")
             if result:
                 submissions = submissions.filter(result=result)
-                
-            # Without problem_id, filter by user/username BEFORE ranking
-            if (myself and myself == "1") or not SysOptions.submission_list_show_all:
+            if filter_user:
                 submissions = submissions.filter(user_id=request.user.id)
             elif username:
                 submissions = submissions.filter(username__icontains=username)
-        
-        # Serialize all relevant submissions
-        serialized_submissions = SubmissionListSerializer(submissions, many=True, user=request.user).data
 
-        # If problem_id is provided, select the best submission per user
-        if problem_id:
-            
-            
-            if rank_type == "memory":
-                # Sort all submissions globally
-                sorted_submissions = sorted(
-                    serialized_submissions,
-                    key=lambda x: (
-                        x["result"] == -3,  # Move -3 result to the end (lowest priority)
-                        x["result"] != 0,  # Primary sort: result (0 first)
-                        x.get("statistic_info", {}).get("memory_cost", float('inf'))  # Secondary sort: memory_cost
-                    )
-                )
-            else:
-                # Sort all submissions globally
-                sorted_submissions = sorted(
-                    serialized_submissions,
-                    key=lambda x: (
-                        x["result"] == -3,  # Move -3 result to the end (lowest priority)
-                        x["result"] != 0,  # Primary sort: result (0 first)
-                        x.get("statistic_info", {}).get("time_cost", float('inf'))  # Secondary sort: time_cost
-                    )
-                )
-            
-            
-            # Select the best submission per user
-            user_best_result = {}
-            for item in sorted_submissions:
-                username_item = item["username"]
-
-
-                if username_item not in user_best_result:
-                    user_best_result[username_item] = item
-                else:
-                    # Don't replace a valid submission with an expired one (result == -3)
-                    if item["result"] == -3 and user_best_result[username_item]["result"] != -3:
-                        continue
-                    
-                    # Only replace if the current best result is not accepted (result != 0)
-                    if user_best_result[username_item]["result"] != 0:
-                        try:
-                            current_create_time = parse_datetime(item.get("create_time", ""))
-                            best_create_time = parse_datetime(user_best_result[username_item].get("create_time", "1970-01-01T00:00:00"))
-                        except (ValueError, TypeError):
-                            current_create_time = datetime.min
-                            best_create_time = datetime.min
-                        if current_create_time > best_create_time:
-                            user_best_result[username_item] = item
-    
-            # Convert to list and sort again to ensure proper ordering
-            filtered_results = list(user_best_result.values())
-            if rank_type == "memory":
-                filtered_sorted_results = sorted(
-                    filtered_results,
-                    key=lambda x: (
-                        x["result"] == -3,  # Move -3 result to the end (lowest priority)
-                        x["result"] != 0,  # Primary sort: result (0 first)
-                        x.get("statistic_info", {}).get("memory_cost", float('inf'))  # Secondary sort: memory_cost
-                    )
-                )
-            else:
-                filtered_sorted_results = sorted(
-                    filtered_results,
-                    key=lambda x: (
-                        x["result"] == -3,  # Move -3 result to the end (lowest priority)
-                        x["result"] != 0,  # Primary sort: result (0 first)
-                        x.get("statistic_info", {}).get("time_cost", float('inf'))  # Secondary sort: time_cost
-                    )
-                )
-    
-            # Assign ranks
-            for index, result_item in enumerate(filtered_sorted_results):
-                result_item["rank"] = index + 1
-    
-            results = filtered_sorted_results
-            
-            # When problem_id is provided, filter by user/username and result AFTER ranking
-            if result:
-                results = [submission for submission in results if submission["result"] == int(result)]
-                
-            if (myself and myself == "1") or not SysOptions.submission_list_show_all:
-                results = [submission for submission in results if submission["user_id"] == request.user.id]
-            elif username:
-                results = [submission for submission in results if username.lower() in submission["username"].lower()]
-        else:
-            # Assign ranks to all submissions first
-            for index, result_item in enumerate(serialized_submissions):
-                result_item["rank"] = index + 1
-    
-            results = serialized_submissions
-            
-        # Update total count after all filtering
-        total = len(results)
-        
-        # Implement pagination on the filtered list
         limit = int(request.GET.get("limit"))
         page = request.GET.get("page", 1)
-        paginator = Paginator(results, limit)
-        try:
-            paginated_results = paginator.page(page)
-        except PageNotAnInteger:
-            paginated_results = paginator.page(1)
-        except EmptyPage:
-            paginated_results = paginator.page(paginator.num_pages)
-    
-        # Prepare the final response data
-        response_data = {
-            "results": paginated_results.object_list,
-            "total": total
-        }
-    
-        return self.success(response_data)
+        approximate = False
+        if problem_id:
+            count = submissions.count()
+        else:
+            # 提交表很大, 计数超过上限时 total 是估算值
+            count, approximate = self.get_total(submissions)
+        if approximate:
+            # total 不准确, 不能用来计算页数, 直接按页码切片, 超过计数上限的提交仍然可以翻到
+            try:
+                number = max(int(page), 1)
+            except ValueError:
+                number = 1
+            offset = (number - 1) * limit
+            object_list = list(submissions[offset:offset + limit + 1])
+            has_next = len(object_list) > limit
+            object_list = object_list[:limit]
+        else:
+            paginator = Paginator(submissions, limit)
+            paginator.count = count
+            try:
+                paginated_results = paginator.page(page)
+            except PageNotAnInteger:
+                paginated_results = paginator.page(1)
+            except EmptyPage:
+                paginated_results = paginator.page(paginator.num_pages)
+            offset = (paginated_results.number - 1) * limit
+            object_list = list(paginated_results.object_list)
+            has_next = paginated_results.has_next()
+
+        results = SubmissionListSerializer(object_list, many=True, user=request.user).data
+        for index, (item, submission) in enumerate(zip(results, object_list)):
+            item["rank"] = submission.rank if problem_id else offset + index + 1
+        data = {"results": results, "total": count, "has_next": has_next}
+        if approximate:
+            data["total_approximate"] = True
+        return self.success(data)
+
 
 class ContestSubmissionListAPI(APIView):
+    pagination_count_limit = 10000
+
     @check_contest_permission(check_type="submissions")
     def get(self, request):
         if not request.GET.get("limit"):
             return self.error("Limit is needed")
 
         contest = self.contest
-        submissions = Submission.objects.filter(contest_id=contest.id).select_related("problem__created_by")
+        submissions = SubmissionArchiveUnion().filter(contest_id=contest.id).prefetch_related("problem__created_by")
         problem_id = request.GET.get("problem_id")
         myself = request.GET.get("myself")
         result = request.GET.get("result")
@@ -335,7 +244,7 @@ class ContestSubmissionListAPI(APIView):
             if not contest.real_time_rank and not request.user.is_contest_admin(contest):
                 submissions = submissions.filter(user_id=request.user.id)
 
-        data = self.paginate_data(request, submissions)
+        data = self.paginate_data(request, submissions, cursor_ordering=("-create_time", "-id"))
         data["results"] = SubmissionListSerializer(data["results"], many=True, user=request.user).data
         return self.success(data)
 
@@ -344,6 +253,64 @@ class SubmissionExistsAPI(APIView):
     def get(self, request):
         if not request.GET.get("problem_id"):
             return self.error("Parameter error, problem_id is required")
-        return self.success(request.user.is_authenticated and
-                            Submission.objects.filter(problem_id=request.GET["problem_id"],
-                                                      user_id=request.user.id).exists())
+        if not request.user.is_authenticated:
+            return self.success(False)
+        return self.success(any(model.objects.filter(problem_id=request.GET["problem_id"], user_id=request.user.id).exists()
+                                for model in (Submission, ArchivedSubmission)))
+
+
+class SubmissionStatusAPI(APIView):
+    # 长轮询最长等待的秒数, 要小于 nginx 和 gunicorn 的超时时间
+    max_wait = 25
+    max_submissions = 20
+
+    def _statuses(self, submission_ids):
+        statuses = {}
+        for item in Submission.objects.filter(id__in=submission_ids).values("id", "result", "statistic_info"):
+            statuses[item["id"]] = {"id": item["id"], "result": item["result"]}
+            if "score" in item["statistic_info"]:
+                statuses[item["id"]]["score"] = item["statistic_info"]["score"]
+        return statuses
+
+    def _pending(self, statuses, known):
+        """
+        所有状态都和客户端已知的相同时返回还在判题中的提交, 否则返回空列表, 不需要等待
+        """
+        if not known or any(item["result"] != known.get(item["id"]) for item in statuses.values()):
+            return []
+        return [item["id"] for item in statuses.values()
+                if item["result"] in (JudgeStatus.PENDING, JudgeStatus.JUDGING)]
+
+    @login_required
+    def get(self, request):
+        """
+        ids: 逗号分隔的提交 id; results: 客户端已知的状态, 和 ids 一一对应.
+        当前状态和 results 相同并且还在判题中时等待状态变化, 最多等待 timeout 秒; 不传 results 时立即返回.
+        返回的 long_poll 为 false 时服务端无法等待, 客户端应当退回到普通的轮询
+        """
+        submission_ids = [item for item in request.GET.get("ids", "").split(",") if item][:self.max_submissions]
+        if not submission_ids:
+            return self.error("Parameter ids doesn't exist")
+        try:
+            known = [int(item) for item in request.GET["results"].split(",")] if request.GET.get("results") else []
+            timeout = min(float(request.GET.get("timeout", self.max_wait)), self.max_wait)
+        except ValueError:
+            return self.error("Invalid parameter")
+        known = dict(zip(submission_ids, known))
+        submission_ids = [item.id for item in Submission.objects.select_related("problem", "contest")
+                          .filter(id__in=submission_ids) if item.check_user_permission(request.user)]
+        if not submission_ids:
+            return self.success({"submissions": [], "long_poll": True})
+
+        statuses = self._statuses(submission_ids)
+        pending = self._pending(statuses, known)
+        if not pending or timeout <= 0:
+            return self.success({"submissions": list(statuses.values()), "long_poll": True})
+        # 只有需要等待时才占用长轮询的名额和 redis 连接
+        with SubmissionStatusSubscription(pending) as subscription:
+            if subscription.available:
+                # 订阅之后再读取一次, 不会漏掉两次读取之间的状态变化
+                statuses = self._statuses(submission_ids)
+                if self._pending(statuses, known) and subscription.wait(timeout):
+                    statuses = self._statuses(submission_ids)
+        return self.success({"submissions": list(statuses.values()), "long_poll": subscription.available})
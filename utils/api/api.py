@@ -1,12 +1,21 @@
+import base64
 import functools
 import json
 import logging
 
+from django.db import connection
+from django.db.models import Q
 from django.http import HttpResponse, QueryDict
 from django.utils.decorators import method_decorator
+from django.utils.functional import cached_property
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger("")
 
 
@@ -40,15 +49,50 @@ class URLEncodedParser(object):
         return QueryDict(body)
 
 
+class JSONRenderer(object):
+    """
+    紧凑格式的 json, 安装了 orjson 时使用 orjson, 否则使用标准库
+    """
+    @staticmethod
+    def render(data):
+        if orjson is not None:
+            try:
+                return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                # orjson 不支持的类型(例如超过 64 位的整数)交给标准库处理
+                pass
+        return StdlibJSONRenderer.render(data)
+
+
+class StdlibJSONRenderer(object):
+    @staticmethod
+    def render(data):
+        return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
 class JSONResponse(object):
     content_type = ContentType.json_response
+    renderer = JSONRenderer
 
     @classmethod
     def response(cls, data):
-        resp = HttpResponse(json.dumps(data, indent=4), content_type=cls.content_type)
+        resp = HttpResponse(cls.renderer.render(data), content_type=cls.content_type)
         resp.data = data
         return resp
 
+    @classmethod
+    def response_from_json(cls, data):
+        """
+        data 是已经序列化好的 json 字符串(例如来自缓存), 直接拼接到响应中, 不再重新编码
+        """
+        return EncodedJSONResponse(data, content_type=cls.content_type)
+
+
+class EncodedJSONResponse(HttpResponse):
+    @cached_property
+    def data(self):
+        return json.loads(self.content.decode("utf-8"))
+
 
 class APIView(View):
     """
@@ -61,6 +105,9 @@ class APIView(View):
     """
     request_parsers = (JSONParser, URLEncodedParser)
     response_class = JSONResponse
+    # 分页时 total 精确计数的上限, None 表示总是精确计数. 超过上限时使用 postgres 查询计划中估算的行数,
+    # 估算值小于上限时返回上限, 这两种情况下返回数据中会带有 total_approximate = True
+    pagination_count_limit = None
 
     def _get_request_data(self, request):
         if request.method not in ["GET", "DELETE"]:
@@ -85,6 +132,12 @@ class APIView(View):
     def success(self, data=None):
         return self.response({"error": None, "data": data})
 
+    def success_json(self, data):
+        """
+        data 是已经序列化好的 json 字符串
+        """
+        return self.response_class.response_from_json('{"error":null,"data":' + data + "}")
+
     def error(self, msg="error", err="error"):
         return self.response({"error": err, "data": msg})
 
@@ -110,13 +163,29 @@ class APIView(View):
     def server_error(self):
         return self.error(err="server-error", msg="server error")
 
-    def paginate_data(self, request, query_set, object_serializer=None):
+    def paginate_data(self, request, query_set, object_serializer=None, cursor_ordering=None):
         """
         :param request: django的request
         :param query_set: django model的query set或者其他list like objects
         :param object_serializer: 用来序列化query set, 如果为None, 则直接对query set切片
+        :param cursor_ordering: 支持游标分页的排序字段, 例如 ("-create_time", "-id"), 字段组合必须唯一且不为 null.
+            请求中带有 cursor 参数(第一页传空字符串)时使用游标分页, 返回 next 游标, 不再返回 total
         :return:
         """
+        limit, offset = self.get_limit_offset(request)
+        if cursor_ordering and "cursor" in request.GET:
+            return self._paginate_by_cursor(request.GET["cursor"], query_set, object_serializer, cursor_ordering, limit)
+        results = query_set[offset:offset + limit]
+        count, approximate = self.get_total(query_set)
+        if object_serializer:
+            results = object_serializer(results, many=True).data
+        data = {"results": results,
+                "total": count}
+        if approximate:
+            data["total_approximate"] = True
+        return data
+
+    def get_limit_offset(self, request):
         try:
             limit = int(request.GET.get("limit", "10"))
         except ValueError:
@@ -129,15 +198,67 @@ class APIView(View):
             offset = 0
         if offset < 0:
             offset = 0
-        results = query_set[offset:offset + limit]
+        return limit, offset
+
+    def get_total(self, query_set):
+        """
+        按照 pagination_count_limit 计数
+        :return: count, 是否为估算值
+        """
+        limit = self.pagination_count_limit
+        if limit is None or not hasattr(query_set, "query"):
+            return query_set.count(), False
+        count = query_set.order_by()[:limit + 1].count()
+        if count <= limit:
+            return count, False
+        # 用查询计划中的行数估算, 带过滤条件的查询和 union 也可以估算
+        sql, params = query_set.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        rows = int(plan[0]["Plan"]["Plan Rows"])
+        # 统计信息可能过期或者还没有收集, 估算值不会小于已经确定的上限
+        if rows > limit:
+            return rows, True
+        return limit, True
+
+    def _paginate_by_cursor(self, cursor, query_set, object_serializer, ordering, limit):
+        fields = [query_set.model._meta.get_field(item.lstrip("-")) for item in ordering]
+        query_set = query_set.order_by(*ordering)
+        if cursor:
+            try:
+                values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+                values = [field.to_python(value) for field, value in zip(fields, values)]
+            except Exception:
+                raise APIError("Invalid cursor")
+            if len(values) != len(fields):
+                raise APIError("Invalid cursor")
+            # (a, b) 在游标之后: a 在游标之后, 或者 a 相等且 b 在游标之后
+            condition = Q()
+            for index, item in enumerate(ordering):
+                lookup = "lt" if item.startswith("-") else "gt"
+                q = Q(**{f"{fields[index].name}__{lookup}": values[index]})
+                for prev in range(index):
+                    q &= Q(**{fields[prev].name: values[prev]})
+                condition |= q
+            # 多个字段时上面的条件是 OR, 再加上第一个字段的范围, 数据库才能在索引上按范围扫描
+            if len(ordering) > 1:
+                lookup = "lte" if ordering[0].startswith("-") else "gte"
+                condition &= Q(**{f"{fields[0].name}__{lookup}": values[0]})
+            query_set = query_set.filter(condition)
+        results = list(query_set[:limit + 1])
+        has_next = len(results) > limit
+        results = results[:limit]
+        next_cursor = None
+        if has_next and results:
+            last = [field.value_to_string(results[-1]) for field in fields]
+            next_cursor = base64.urlsafe_b64encode(json.dumps(last).encode("utf-8")).decode("utf-8").rstrip("=")
         if object_serializer:
-            count = query_set.count()
             results = object_serializer(results, many=True).data
-        else:
-            count = query_set.count()
-        data = {"results": results,
-                "total": count}
-        return data
+        return {"results": results,
+                "next": next_cursor}
 
     def dispatch(self, request, *args, **kwargs):
         if self.request_parsers:
@@ -3,11 +3,21 @@ from django.test.testcases import TestCase
 from rest_framework.test import APIClient
 
 from account.models import AdminType, ProblemPermission, User, UserProfile
+from utils import throttling
+from utils.cache import cache
+from utils.constants import CacheKey
 
 
 class APITestCase(TestCase):
     client_class = APIClient
 
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # 测试的请求都来自同一个 IP, 频率限制的计数在 redis 和进程中都会跨测试保留
+        cache.delete_pattern(f"{CacheKey.throttling}:*")
+        throttling._blocked.clear()
+
     def create_user(self, username, password, admin_type=AdminType.REGULAR_USER, login=True,
                     problem_permission=ProblemPermission.NONE):
         user = User.objects.create(username=username, admin_type=admin_type, problem_permission=problem_permission)
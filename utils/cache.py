@@ -1,8 +1,38 @@
 from django.core.cache import cache, caches  # noqa
 from django.conf import settings  # noqa
 
+import threading
+
 from django_redis.cache import RedisCache
 from django_redis.client.default import DefaultClient
+from redis import Redis
+from redis.client import Pipeline
+
+# 每个线程中执行的 redis 命令数, pipeline 算作一次, 用于统计每个请求访问 redis 的次数
+_redis_calls = threading.local()
+
+
+def redis_call_count():
+    return getattr(_redis_calls, "count", 0)
+
+
+def _count_redis_call():
+    _redis_calls.count = getattr(_redis_calls, "count", 0) + 1
+
+
+class CountingPipeline(Pipeline):
+    def execute(self, raise_on_error=True):
+        _count_redis_call()
+        return super().execute(raise_on_error)
+
+
+class CountingRedis(Redis):
+    def execute_command(self, *args, **options):
+        _count_redis_call()
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return CountingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
 
 
 class MyRedisClient(DefaultClient):
@@ -1,8 +1,10 @@
 from . import Captcha
 from ..api import APIView
 from ..shortcuts import img2base64
+from ..throttling import rate_limit
 
 
 class CaptchaAPIView(APIView):
+    @rate_limit("captcha")
     def get(self, request):
         return self.success(img2base64(Captcha(request).get()))
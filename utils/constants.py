@@ -24,6 +24,18 @@ class ContestRuleType(Choices):
 class CacheKey:
     waiting_queue = "waiting_queue"
     contest_rank_cache = "contest_rank_cache"
+    contest_rank_version = "contest_rank_version"
+    contest_rank_lock = "contest_rank_lock"
+    contest_rank_export = "contest_rank_export"
+    contest_rank_snapshot = "contest_rank_snapshot"
+    submission_status = "submission_status"
+    contest_events = "contest_events"
+    throttling = "throttling"
+    options_version = "options_version"
+    options_invalidate = "options_invalidate"
+    open_api_appkey = "open_api_appkey"
+    user_sessions = "user_sessions"
+    request_stats = "request_stats"
     website_config = "website_config"
 
 
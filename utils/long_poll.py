@@ -0,0 +1,36 @@
+"""
+长轮询等待时会占用一个 gunicorn 线程, 所有长轮询接口共用每个进程的等待名额, 名额用完时不等待直接返回
+"""
+import threading
+
+from django.conf import settings
+
+_waiters = threading.BoundedSemaphore(settings.LONG_POLL_MAX_WAITERS)
+
+
+class LongPollSlot:
+    """
+    with LongPollSlot() as acquired:
+        if acquired:
+            # 可以阻塞等待
+            ...
+    """
+
+    def __init__(self):
+        self.acquired = False
+
+    def acquire(self):
+        if not self.acquired:
+            self.acquired = _waiters.acquire(blocking=False)
+        return self.acquired
+
+    def release(self):
+        if self.acquired:
+            _waiters.release()
+            self.acquired = False
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
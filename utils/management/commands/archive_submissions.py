@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from options.options import SysOptions
+from submission.utils import archive_submissions, delete_orphaned_code
+
+
+class Command(BaseCommand):
+    help = "Move submissions older than the given days into the submission archive " \
+           "and delete code no longer used by any submission"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="defaults to the submission_archive_days option, 0 to skip")
+        parser.add_argument("--batch_size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        days = options["days"] if options["days"] is not None else SysOptions.submission_archive_days
+        if not days:
+            self.stdout.write("Submission archiving is disabled")
+        else:
+            count = archive_submissions(timezone.now() - timedelta(days=days), batch_size=options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(f"Archived {count} submissions older than {days} days"))
+        # 提交, 题目和用户被删除之后留下的代码
+        count = delete_orphaned_code(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {count} unused submission code"))
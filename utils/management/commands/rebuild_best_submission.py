@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from problem.models import Problem
+from submission.utils import rebuild_best_submission
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-user best submissions used by the submission rank of public problems"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--problem_id", type=int, help="only rebuild the problem with this id")
+
+    def handle(self, *args, **options):
+        problems = Problem.objects.filter(contest_id__isnull=True).only("id", "spj_code")
+        if options["problem_id"]:
+            problems = problems.filter(id=options["problem_id"])
+        count = 0
+        for problem in problems.iterator():
+            rebuild_best_submission(problem)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt best submissions of {count} problems"))
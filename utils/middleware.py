@@ -0,0 +1,169 @@
+import logging
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+
+from .api.api import ContentType
+from .cache import cache, redis_call_count
+from .constants import CacheKey
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+_accepts_gzip = re.compile(r"\bgzip\b")
+_accepts_brotli = re.compile(r"\bbr\b")
+
+
+class JSONCompressionMiddleware(MiddlewareMixin):
+    """
+    压缩较大的 json 响应, 客户端支持并且安装了 brotli 时使用 brotli, 否则使用 gzip.
+    小的响应压缩之后节省的流量抵不上 CPU 时间, 不压缩
+    """
+    min_length = 1024
+    brotli_quality = 4
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header("Content-Encoding") or \
+                response.get("Content-Type") != ContentType.json_response or len(response.content) < self.min_length:
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if brotli is not None and _accepts_brotli.search(accept_encoding):
+            content, encoding = brotli.compress(response.content, quality=self.brotli_quality), "br"
+        elif _accepts_gzip.search(accept_encoding):
+            content, encoding = compress_string(response.content), "gzip"
+        else:
+            return response
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response["Content-Length"] = str(len(content))
+        response["Content-Encoding"] = encoding
+        return response
+
+
+# 每个接口汇总的字段, 依次是请求数, 总耗时, 被统计的请求数, SQL 数, SQL 耗时, redis 命令数, 慢请求数
+STAT_FIELDS = ("count", "time_ms", "sampled", "sql", "sql_ms", "redis", "slow")
+
+
+class _RequestStats:
+    """
+    每个进程先在内存中汇总, 每隔 flush_interval 秒写入 redis 的 hash, field 是 "接口|字段"
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = defaultdict(lambda: [0] * len(STAT_FIELDS))
+        self.flushed_at = time.monotonic()
+
+    def add(self, endpoint, values, flush_interval):
+        with self.lock:
+            row = self.data[endpoint]
+            for index, value in enumerate(values):
+                row[index] += value
+            if time.monotonic() - self.flushed_at < flush_interval:
+                return
+            data, self.data = self.data, defaultdict(lambda: [0] * len(STAT_FIELDS))
+            self.flushed_at = time.monotonic()
+        try:
+            pipe = cache.pipeline(transaction=False)
+            for endpoint, row in data.items():
+                for field, value in zip(STAT_FIELDS, row):
+                    if value:
+                        pipe.hincrbyfloat(CacheKey.request_stats, f"{endpoint}|{field}", value)
+            pipe.execute()
+        except Exception as e:
+            logger.exception(e)
+
+
+_request_stats = _RequestStats()
+
+
+def get_request_stats():
+    """
+    所有进程汇总之后每个接口的统计, 按总耗时从大到小排序
+    """
+    endpoints = defaultdict(lambda: dict.fromkeys(STAT_FIELDS, 0))
+    for key, value in cache.hgetall(CacheKey.request_stats).items():
+        endpoint, field = key.decode("utf-8").rsplit("|", 1)
+        if field in STAT_FIELDS:
+            endpoints[endpoint][field] = float(value)
+    result = []
+    for endpoint, item in endpoints.items():
+        count, sampled = item["count"] or 1, item["sampled"] or 1
+        result.append({"endpoint": endpoint, "count": int(item["count"]), "total_ms": round(item["time_ms"], 2),
+                       "avg_ms": round(item["time_ms"] / count, 2), "slow": int(item["slow"]),
+                       "sampled": int(item["sampled"]), "avg_sql": round(item["sql"] / sampled, 2),
+                       "avg_sql_ms": round(item["sql_ms"] / sampled, 2),
+                       "avg_redis": round(item["redis"] / sampled, 2)})
+    result.sort(key=lambda item: item["total_ms"], reverse=True)
+    return result
+
+
+def reset_request_stats():
+    cache.delete(CacheKey.request_stats)
+
+
+class _SQLCounter:
+    def __init__(self):
+        self.count = 0
+        self.time = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.count += 1
+
+
+class InstrumentationMiddleware:
+    """
+    记录每个请求的耗时, 按 sample_rate 抽样的请求还会记录 SQL 的次数和耗时以及 redis 命令数,
+    结果按接口汇总, 超过 slow_request_ms 的请求写入日志. 配置见 settings.INSTRUMENTATION
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = settings.INSTRUMENTATION
+        sampled = random.random() < config["sample_rate"]
+        start = time.perf_counter()
+        if sampled:
+            sql = _SQLCounter()
+            redis_calls = redis_call_count()
+            with connection.execute_wrapper(sql):
+                response = self.get_response(request)
+            redis_calls = redis_call_count() - redis_calls
+        else:
+            response = self.get_response(request)
+        duration = (time.perf_counter() - start) * 1000
+
+        match = request.resolver_match
+        endpoint = f"{request.method} {match.view_name if match else 'unknown'}"
+        slow = duration >= config["slow_request_ms"]
+        if sampled:
+            sql_ms = sql.time * 1000
+            if config["server_timing"]:
+                response["Server-Timing"] = f'app;dur={duration:.1f}, db;dur={sql_ms:.1f};desc="{sql.count} queries", ' \
+                                            f'redis;desc="{redis_calls} calls"'
+            values = (1, duration, 1, sql.count, sql_ms, redis_calls, int(slow))
+        else:
+            values = (1, duration, 0, 0, 0, 0, int(slow))
+        if slow:
+            extra = f", {sql.count} queries in {sql_ms:.1f}ms, {redis_calls} redis calls" if sampled else ""
+            logger.warning("Slow request %s %s: %.1fms%s", request.method, request.get_full_path(), duration, extra)
+        _request_stats.add(endpoint, values, config["flush_interval"])
+        return response
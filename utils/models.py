@@ -1,10 +1,41 @@
+import hashlib
+
 from django.db.models import JSONField  # NOQA
 from django.db import models
 
 from utils.xss_filter import XSSHtml
 
+# 过滤结果按内容的 hash 缓存在本进程中, 批量导入时相同的内容只过滤一次
+_MAX_SANITIZED = 512
+_sanitized = {}
+
+
+def sanitize_html(value):
+    key = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+    cleaned = _sanitized.get(key)
+    if cleaned is None:
+        with XSSHtml() as parser:
+            cleaned = parser.clean(value)
+        if len(_sanitized) >= _MAX_SANITIZED:
+            _sanitized.clear()
+        _sanitized[key] = cleaned
+    return cleaned
+
+
+class SanitizedText(str):
+    """
+    从数据库中读出的富文本, 写入时已经过滤过了. 字段没有被重新赋值时, 保存时不需要再次过滤,
+    对它做的任何字符串操作都会得到普通的 str, 会重新过滤
+    """
+
 
 class RichTextField(models.TextField):
+    def from_db_value(self, value, expression, connection):
+        return value if value is None else SanitizedText(value)
+
     def get_prep_value(self, value):
-        with XSSHtml() as parser:
-            return parser.clean(value or "")
+        if isinstance(value, SanitizedText):
+            return str(value)
+        if not value:
+            return ""
+        return sanitize_html(value)
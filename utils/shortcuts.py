@@ -2,6 +2,9 @@ import os
 import re
 import datetime
 import random
+import secrets
+import threading
+import time
 from base64 import b64encode
 from io import BytesIO
 
@@ -26,6 +29,34 @@ def rand_str(length=32, type="lower_hex"):
         return random.choice("123456789") + get_random_string(length - 1, allowed_chars="0123456789")
 
 
+_time_ordered_id_lock = threading.Lock()
+_last_time_ordered_id = [0, 0]
+
+
+def time_ordered_id():
+    """
+    ULID 风格的 id, 和 rand_str() 一样是 32 位小写十六进制字符串: 前 12 位是毫秒时间戳, 后 20 位随机.
+    按生成时间递增(同一毫秒内随机部分递增), 插入总是落在索引的末尾.
+    时间戳在公元 10889 年之前首位都是 0, 而 rand_str() 的首位不会是 0, 两种 id 可以区分开
+    """
+    with _time_ordered_id_lock:
+        timestamp = int(time.time() * 1000)
+        last_timestamp, last_random = _last_time_ordered_id
+        if timestamp <= last_timestamp:
+            timestamp, rand = last_timestamp, last_random + 1
+            if rand >= 1 << 80:
+                timestamp, rand = timestamp + 1, secrets.randbits(79)
+        else:
+            # 最高位留空, 同一毫秒内递增时不会溢出
+            rand = secrets.randbits(79)
+        _last_time_ordered_id[:] = [timestamp, rand]
+    return f"{timestamp:012x}{rand:020x}"
+
+
+def is_time_ordered_id(value):
+    return len(value) == 32 and value.startswith("0")
+
+
 def build_query_string(kv_data, ignore_none=True):
     # {"a": 1, "b": "test"} -> "?a=1&b=test"
     query_string = ""
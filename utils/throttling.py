@@ -1,9 +1,84 @@
+import functools
+import logging
+import math
 import time
 
+from options.options import OptionDefaultValue, SysOptions
+from .cache import cache
+from .constants import CacheKey
+from .shortcuts import rand_str
+
+logger = logging.getLogger(__name__)
+
+# 在 redis 中原子地检查并消耗一个或多个令牌桶, 只有所有的桶都有足够的令牌时才会消耗
+# KEYS: 各个桶的 key
+# ARGV: 当前时间, 然后每个桶依次是 capacity, fill_rate, default_capacity, num, ttl
+# 返回: {是否成功, 需要等待的秒数(字符串, redis 会把 lua 的小数截断为整数)}
+_CONSUME_SCRIPT = """
+local now = tonumber(ARGV[1])
+local ok = 1
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local base = 1 + (i - 1) * 5
+    local capacity = tonumber(ARGV[base + 1])
+    local fill_rate = tonumber(ARGV[base + 2])
+    local num = tonumber(ARGV[base + 4])
+    local values = redis.call("HMGET", key, "last_capacity", "last_timestamp")
+    local last_capacity = tonumber(values[1])
+    local last_timestamp = tonumber(values[2])
+    if last_capacity == nil or last_timestamp == nil then
+        last_capacity = tonumber(ARGV[base + 3])
+        last_timestamp = now
+    end
+    local current = math.min(capacity, last_capacity + math.max(0, now - last_timestamp) * fill_rate)
+    tokens[i] = current
+    if current < num then
+        ok = 0
+        wait = math.max(wait, (num - current) / fill_rate)
+    end
+end
+if ok == 1 then
+    for i, key in ipairs(KEYS) do
+        local base = 1 + (i - 1) * 5
+        redis.call("HSET", key, "last_capacity", tostring(tokens[i] - tonumber(ARGV[base + 4])),
+                   "last_timestamp", ARGV[1])
+        redis.call("EXPIRE", key, ARGV[base + 5])
+    end
+end
+return {ok, tostring(wait)}
+"""
+
+# 滑动窗口, 用 sorted set 记录窗口内每次请求的时间
+# KEYS[1]: key
+# ARGV: 当前时间, limit, window(秒), 这次请求的唯一标识
+_SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local window = tonumber(ARGV[3])
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now - window)
+if redis.call("ZCARD", KEYS[1]) < limit then
+    redis.call("ZADD", KEYS[1], now, ARGV[4])
+    redis.call("EXPIRE", KEYS[1], math.ceil(window))
+    return {1, "0"}
+end
+local oldest = redis.call("ZRANGE", KEYS[1], 0, 0, "WITHSCORES")
+return {0, tostring(tonumber(oldest[2]) + window - now)}
+"""
+
+_scripts = {}
+
+
+def _get_script(redis_conn, source):
+    script = _scripts.get((id(redis_conn), source))
+    if script is None:
+        script = _scripts[(id(redis_conn), source)] = redis_conn.register_script(source)
+    return script
+
 
 class TokenBucket:
     """
-    注意：对于单个key的操作不是线程安全的
+    令牌桶, 状态保存在 redis 的 hash 中, 检查和消耗在一个 lua 脚本中完成, 多个进程同时消耗同一个 key 也不会透支
     """
     def __init__(self, key, capacity, fill_rate, default_capacity, redis_conn):
         """
@@ -18,55 +93,127 @@ class TokenBucket:
         self._default_capacity = default_capacity
         self._redis_conn = redis_conn
 
-        self._last_capacity_key = "last_capacity"
-        self._last_timestamp_key = "last_timestamp"
-
-    def _init_key(self):
-        self._last_capacity = self._default_capacity
-        now = time.time()
-        self._last_timestamp = now
-        return self._default_capacity, now
-
     @property
-    def _last_capacity(self):
-        last_capacity = self._redis_conn.hget(self._key, self._last_capacity_key)
-        if last_capacity is None:
-            return self._init_key()[0]
-        else:
-            return float(last_capacity)
+    def _ttl(self):
+        # 空闲到桶被填满之后 key 就没有用了, 过期之后按初始容量重新开始
+        return max(1, math.ceil(self._capacity / self._fill_rate))
 
-    @_last_capacity.setter
-    def _last_capacity(self, value):
-        self._redis_conn.hset(self._key, self._last_capacity_key, value)
+    def consume(self, num=1):
+        """
+        消耗 num 个 token，返回是否成功
+        :param num:
+        :return: result: bool, wait_time: float
+        """
+        return consume_buckets([self], num)
 
-    @property
-    def _last_timestamp(self):
-        return float(self._redis_conn.hget(self._key, self._last_timestamp_key))
 
-    @_last_timestamp.setter
-    def _last_timestamp(self, value):
-        self._redis_conn.hset(self._key, self._last_timestamp_key, value)
+def consume_buckets(buckets, num=1):
+    """
+    同时从多个桶(例如用户和 IP)中各消耗 num 个 token, 只要有一个桶的 token 不够就都不消耗, 只需要一次 redis 请求.
+    所有的桶必须使用同一个 redis connection
+    :return: result: bool, wait_time: float, 等待时间取所有不够的桶中最长的
+    """
+    args = [time.time()]
+    for bucket in buckets:
+        args.extend([bucket._capacity, bucket._fill_rate, bucket._default_capacity, num, bucket._ttl])
+    script = _get_script(buckets[0]._redis_conn, _CONSUME_SCRIPT)
+    ok, wait = script(keys=[bucket._key for bucket in buckets], args=args)
+    return bool(ok), float(wait)
 
-    def _try_to_fill(self, now):
-        delta = self._fill_rate * (now - self._last_timestamp)
-        return min(self._last_capacity + delta, self._capacity)
 
-    def consume(self, num=1):
+class SlidingWindow:
+    """
+    滑动窗口, 任意 window 秒内最多 limit 次请求
+    """
+    def __init__(self, key, limit, window, redis_conn):
+        self._key = key
+        self._limit = limit
+        self._window = window
+        self._redis_conn = redis_conn
+
+    def consume(self):
         """
-        消耗 num 个 token，返回是否成功
-        :param num:
         :return: result: bool, wait_time: float
         """
-        # print("capacity ", self.fill(time.time()))
-        if self._last_capacity >= num:
-            self._last_capacity -= num
-            return True, 0
-        else:
+        script = _get_script(self._redis_conn, _SLIDING_WINDOW_SCRIPT)
+        ok, wait = script(keys=[self._key], args=[time.time(), self._limit, self._window, rand_str()])
+        return bool(ok), float(wait)
+
+
+class RateLimitScope:
+    IP = "ip"
+    # 登录用户按用户 id, 未登录时按 IP
+    USER = "user"
+    # 按请求中的账号(用户名或邮箱)和 IP, 同一个 NAT 后面的不同用户互不影响
+    ACCOUNT = "account"
+
+
+# 本进程中已知被限制的 key 和解除限制的时间, 被限制期间的请求不需要再访问 redis
+_blocked = {}
+_MAX_BLOCKED = 10000
+
+
+def _get_policy(name):
+    return SysOptions.throttling.get(name) or OptionDefaultValue.throttling[name]
+
+
+def _get_limiter(key, policy):
+    if policy.get("algorithm") == "sliding_window":
+        return SlidingWindow(key=key, limit=policy["limit"], window=policy["window"], redis_conn=cache)
+    return TokenBucket(key=key, capacity=policy["capacity"], fill_rate=policy["fill_rate"],
+                       default_capacity=policy["default_capacity"], redis_conn=cache)
+
+
+def _get_ident(request, scope, account_field):
+    if scope == RateLimitScope.USER and request.user.is_authenticated:
+        return f"user:{request.user.id}"
+    if scope == RateLimitScope.ACCOUNT:
+        data = request.data if isinstance(request.data, dict) else {}
+        account = str(data.get(account_field) or "").strip().lower()[:128]
+        return f"account:{account}:ip:{request.ip}"
+    return f"ip:{request.ip}"
+
+
+def rate_limit(policy_name, scope=RateLimitScope.IP, condition=None, account_field=None):
+    """
+    按 SysOptions.throttling[policy_name] 中的策略限制请求频率, 策略可以是令牌桶
+    {"capacity", "fill_rate", "default_capacity"} 或者滑动窗口 {"algorithm": "sliding_window", "limit", "window"}
+
+    @rate_limit("login")
+    def post(self, request):
+        ...
+
+    :param condition: condition(request) 为 False 时不限制
+    :param account_field: scope 为 ACCOUNT 时 request.data 中账号的字段名
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def handle(*args, **kwargs):
+            self = args[0]
+            request = args[1]
+            if condition is not None and not condition(request):
+                return view_method(*args, **kwargs)
+            key = f"{CacheKey.throttling}:{policy_name}:{_get_ident(request, scope, account_field)}"
+
             now = time.time()
-            cur_num = self._try_to_fill(now)
-            if cur_num >= num:
-                self._last_capacity = cur_num - num
-                self._last_timestamp = now
-                return True, 0
-            else:
-                return False, (num - cur_num) / self._fill_rate
+            wait = _blocked.get(key, 0) - now
+            if wait <= 0:
+                try:
+                    can_consume, wait = _get_limiter(key, _get_policy(policy_name)).consume()
+                except Exception as e:
+                    # redis 不可用时不限制
+                    logger.exception(e)
+                    can_consume = True
+                if can_consume:
+                    return view_method(*args, **kwargs)
+                if len(_blocked) >= _MAX_BLOCKED:
+                    _blocked.clear()
+                _blocked[key] = now + wait
+            wait = math.ceil(wait)
+            resp = self.error("Too many requests, please wait %d seconds" % wait)
+            resp["Retry-After"] = str(wait)
+            return resp
+
+        return handle
+
+    return decorator
@@ -26,9 +26,16 @@ Cannot defense xss in browser which is belowed IE7
 浏览器版本：IE7+ 或其他浏览器，无法防御IE6及以下版本浏览器中的XSS
 """
 import re
-import copy
 from html.parser import HTMLParser
 
+_url_prog = re.compile(r"(^(http|https|ftp)://.+)|(^/)", re.I | re.S)
+_style_escape = re.compile(r"(\\|&#|/\*|\*/)")
+_style_expression = re.compile(r"e.*x.*p.*r.*e.*s.*s.*i.*o.*n")
+
+
+def _allowed_attrs(common_attrs, tags_own_attrs):
+    return {tag: frozenset(common_attrs + attrs) for tag, attrs in tags_own_attrs.items()}
+
 
 class XSSHtml(HTMLParser):
     allow_tags = ['a', 'img', 'br', 'strong', 'b', 'code', 'pre',
@@ -45,10 +52,15 @@ class XSSHtml(HTMLParser):
         "table": ["border", "cellpadding", "cellspacing"],
         "font": ["color"]
     }
+    # 每个标签都会用到, 预先转换为集合
+    _default_allow_tags = frozenset(allow_tags)
+    _common_attrs = frozenset(common_attrs)
+    _tags_allowed_attrs = _allowed_attrs(common_attrs, tags_own_attrs)
 
     def __init__(self, allows=[]):
         HTMLParser.__init__(self)
         self.allow_tags = allows if allows else self.allow_tags
+        self._allow_tags = frozenset(allows) if allows else self._default_allow_tags
         self.result = []
         self.start = []
         self.data = []
@@ -59,6 +71,10 @@ class XSSHtml(HTMLParser):
     def __exit__(self, exc_type, exc_val, exc_tb):
         super().close()
 
+    def updatepos(self, i, j):
+        # 不需要行号和列号, 跳过 HTMLParser 在每个标签之后统计换行的开销
+        return j
+
     def clean(self, content):
         self.feed(content)
         return self.get_html()
@@ -67,38 +83,28 @@ class XSSHtml(HTMLParser):
         """
         Get the safe html code
         """
-        for i in range(0, len(self.result)):
-            if self.result[i].strip('\n'):
-                self.data.append(self.result[i])
+        self.data.extend(item for item in self.result if item.strip('\n'))
         return ''.join(self.data)
 
     def handle_startendtag(self, tag, attrs):
         self.handle_starttag(tag, attrs)
 
     def handle_starttag(self, tag, attrs):
-        if tag not in self.allow_tags:
+        if tag not in self._allow_tags:
             return
         end_diagonal = ' /' if tag in self.nonend_tags else ''
         if not end_diagonal:
             self.start.append(tag)
-        attdict = {}
-        for attr in attrs:
-            attdict[attr[0]] = attr[1]
 
-        attdict = self._wash_attr(attdict, tag)
-        if hasattr(self, "node_%s" % tag):
-            attdict = getattr(self, "node_%s" % tag)(attdict)
-        else:
-            attdict = self.node_default(attdict)
+        attdict = self._wash_attr(attrs, tag)
+        attdict = getattr(self, "node_" + tag, self.node_default)(attdict)
 
-        attrs = []
-        for (key, value) in attdict.items():
-            attrs.append('%s="%s"' % (key, self._htmlspecialchars(value)))
-        attrs = (' ' + ' '.join(attrs)) if attrs else ''
+        escape = self._htmlspecialchars
+        attrs = ''.join([' %s="%s"' % (key, escape(value)) for key, value in attdict.items()])
         self.result.append('<' + tag + attrs + end_diagonal + '>')
 
     def handle_endtag(self, tag):
-        if self.start and tag == self.start[len(self.start) - 1]:
+        if self.start and tag == self.start[-1]:
             self.result.append('</' + tag + '>')
             self.start.pop()
 
@@ -142,16 +148,15 @@ class XSSHtml(HTMLParser):
         return attrs
 
     def _true_url(self, url):
-        prog = re.compile(r"(^(http|https|ftp)://.+)|(^/)", re.I | re.S)
-        if prog.match(url):
+        if _url_prog.match(url):
             return url
         else:
             return "http://%s" % url
 
     def _true_style(self, style):
         if style:
-            style = re.sub(r"(\\|&#|/\*|\*/)", "_", style)
-            style = re.sub(r"e.*x.*p.*r.*e.*s.*s.*i.*o.*n", "_", style)
+            style = _style_escape.sub("_", style)
+            style = _style_expression.sub("_", style)
         return style
 
     def _get_style(self, attrs):
@@ -165,15 +170,11 @@ class XSSHtml(HTMLParser):
         return attrs
 
     def _wash_attr(self, attrs, tag):
-        if tag in self.tags_own_attrs:
-            other = self.tags_own_attrs.get(tag)
-        else:
-            other = []
-        if attrs:
-            for key, value in copy.deepcopy(attrs).items():
-                if key not in self.common_attrs + other:
-                    del attrs[key]
-        return attrs
+        """
+        :param attrs: HTMLParser 解析出的 [(name, value)], 同名的属性保留最后一个值
+        """
+        allowed = self._tags_allowed_attrs.get(tag, self._common_attrs)
+        return {key: value for key, value in attrs if key in allowed}
 
     def _common_attr(self, attrs):
         attrs = self._get_style(attrs)